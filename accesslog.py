@@ -0,0 +1,375 @@
+import atexit
+import heapq
+import json
+import math
+import mmap
+import os
+import queue
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:   # Windows: one process per log there
+    fcntl = None
+
+from metrics import add_collector
+
+# ---------- SETTINGS ----------
+# empty ACCESS_LOG turns request logging off
+ACCESS_LOG = os.environ.get("ACCESS_LOG", "access.jsonl")
+ACCESS_LOG_BYTES = int(os.environ.get("ACCESS_LOG_BYTES", str(50 * 1024 * 1024)))
+ACCESS_LOG_BACKUPS = int(os.environ.get("ACCESS_LOG_BACKUPS", "5"))
+ACCESS_LOG_QUEUE = int(os.environ.get("ACCESS_LOG_QUEUE", "10000"))   # records held before dropping
+ACCESS_LOG_BATCH = 1000            # records per write
+ACCESS_LOG_FLUSH = float(os.environ.get("ACCESS_LOG_FLUSH", "1.0"))   # seconds between writes
+_STOP = object()
+
+
+# ---------- WRITER ----------
+class AccessLog:
+    # Request handlers only build a dict and put it on a bounded queue; one
+    # background thread turns whatever has queued up into a single write. A
+    # full queue drops the record (counted) rather than slowing a request.
+    #
+    # Forked workers share the file: each write and rotation happens under
+    # an flock on PATH.lock, and a writer whose file was rotated away by
+    # another process reopens it before writing.
+
+    def __init__(self, path, max_bytes=ACCESS_LOG_BYTES, backups=ACCESS_LOG_BACKUPS,
+                 maxsize=ACCESS_LOG_QUEUE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize)
+        self._file = None
+        self._lockfile = None
+        self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, entry):
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=ACCESS_LOG_FLUSH)
+            except queue.Empty:
+                continue
+            batch = [first]
+            while len(batch) < ACCESS_LOG_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            lines = [json.dumps(e, separators=(",", ":")) + "\n" for e in batch if e is not _STOP]
+            if lines:
+                try:
+                    self._write("".join(lines).encode())
+                    self.written += len(lines)
+                except OSError:
+                    self.dropped += len(lines)
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _write(self, data):
+        if fcntl is not None and self._lockfile is None:
+            self._lockfile = open(self.path + ".lock", "ab")
+        if self._lockfile is not None:
+            fcntl.flock(self._lockfile, fcntl.LOCK_EX)
+        try:
+            if self._file is None or self._replaced():
+                self._reopen()
+            size = os.fstat(self._file.fileno()).st_size
+            if size and size + len(data) > self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+        finally:
+            if self._lockfile is not None:
+                fcntl.flock(self._lockfile, fcntl.LOCK_UN)
+
+    def _replaced(self):
+        # another process rotated the log since we opened it
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _reopen(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, "ab")
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._reopen()
+
+    def close(self):
+        # flush what is queued; called at interpreter exit
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(5)
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+    def _after_fork(self):
+        # Queued records are the parent's to write. The inherited lock file
+        # shares the parent's flock, so this process opens its own.
+        for f in (self._file, self._lockfile):
+            if f is not None:
+                f.close()
+        self._file = self._lockfile = None
+        self._queue = queue.Queue(self._queue.maxsize)
+        self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+        self._thread.start()
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+def get_access_log(path=ACCESS_LOG):
+    if not path:
+        return None
+    with _logs_lock:
+        log = _logs.get(path)
+        if log is None:
+            log = _logs[path] = AccessLog(path)
+            add_collector(("access_log", path), access_log_collector(log))
+        return log
+
+
+def _after_fork():
+    global _logs_lock
+    _logs_lock = threading.Lock()
+    for log in _logs.values():
+        log._after_fork()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def access_log_collector(log):
+    def collect():
+        stats = log.stats()
+        yield "access_log_queued", "gauge", "Access log records waiting to be written", stats["queued"]
+        yield "access_log_dropped_total", "counter", "Access log records dropped (queue full)", stats["dropped"]
+    return collect
+
+
+def entry(method, route, status, seconds, size, target_id):
+    # target_id is the <user_id> the route acts on, not who made the request
+    if target_id is not None:
+        try:
+            target_id = int(target_id)
+        except ValueError:
+            pass
+    return {"ts": round(time.time(), 3), "method": method, "route": route, "status": status,
+            "ms": round(seconds * 1000, 3), "bytes": size, "target_id": target_id}
+
+
+class CountingBody:
+    # Wraps a streamed response body and counts what is actually sent
+    # (NDJSON listings, import progress, SSE), which has no Content-Length
+
+    def __init__(self, body):
+        self.body = body
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.size += len(chunk.encode() if isinstance(chunk, str) else chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self.body, "close"):
+            self.body.close()
+
+
+# ---------- FLASK ----------
+def access_log_flask(app, path=ACCESS_LOG):
+    # streamed responses are timed and sized until closed, so their bodies
+    # count in full
+    from flask import g, request
+
+    log = get_access_log(path)
+    if log is None:
+        return
+
+    @app.before_request
+    def start_access_timer():
+        g.access_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        started = g.pop("access_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            method = request.method
+            target_id = (request.view_args or {}).get("user_id")
+
+            def done(size):
+                log.record(entry(method, route, response.status_code,
+                                 time.perf_counter() - started, size, target_id))
+            if response.is_streamed and not response.direct_passthrough:
+                body = response.response = CountingBody(response.response)
+                response.call_on_close(lambda: done(body.size))
+            elif response.is_streamed:
+                # send_file: the server may hand the file over untouched
+                response.call_on_close(lambda: done(response.content_length))
+            else:
+                done(response.content_length)
+        return response
+
+
+# ---------- ASGI ----------
+class AccessLogMiddleware:
+    # Pure ASGI, like MetricsMiddleware: the record is queued after the last
+    # body chunk, with the byte count of everything sent
+
+    def __init__(self, app, log):
+        self.app = app
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        state = {"status": 500, "size": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["size"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            target_id = scope.get("path_params", {}).get("user_id")
+            self.log.record(entry(scope["method"], route, state["status"],
+                                  time.perf_counter() - started, state["size"], target_id))
+
+
+def access_log_asgi(app, path=ACCESS_LOG):
+    log = get_access_log(path)
+    if log is not None:
+        app.add_middleware(AccessLogMiddleware, log=log)
+
+
+# ---------- ANALYZER ----------
+# Latencies go into log-spaced buckets (2% apart) per route, so percentiles
+# over any number of requests take constant memory and are within ~1%.
+BUCKET_RATIO = 1.02
+_LOG_RATIO = math.log(BUCKET_RATIO)
+
+
+class RouteStats:
+    __slots__ = ("count", "errors", "total_ms", "max_ms", "bytes", "buckets")
+
+    def __init__(self):
+        self.count = self.errors = self.bytes = 0
+        self.total_ms = self.max_ms = 0.0
+        self.buckets = {}
+
+    def add(self, ms, status, size):
+        self.count += 1
+        self.errors += status >= 500
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.bytes += size or 0
+        b = math.floor(math.log(ms) / _LOG_RATIO) if ms > 0 else -10**6
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+
+    def percentile(self, q):
+        rank = q * self.count
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= rank:
+                return 0.0 if b == -10**6 else min(BUCKET_RATIO ** (b + 0.5), self.max_ms)
+        return self.max_ms
+
+
+def log_files(path):
+    # oldest backup first, then the live file
+    names = [f"{path}.{i}" for i in range(ACCESS_LOG_BACKUPS, 0, -1)] + [path]
+    return [name for name in names if os.path.exists(name)]
+
+
+def read_lines(name):
+    # mmap'd, so a multi-GB log is paged in by the OS rather than read into memory
+    with open(name, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from iter(mm.readline, b"")
+
+
+def analyze(files, top=10, route=None):
+    routes = {}
+    slowest = []    # min-heap of the `top` slowest (ms, n, record)
+    n = 0
+    for name in files:
+        for line in read_lines(name):
+            try:
+                rec = json.loads(line)
+                ms = float(rec["ms"])
+            except (ValueError, KeyError, TypeError):
+                continue
+            if route is not None and rec.get("route") != route:
+                continue
+            key = f"{rec.get('method', '')} {rec.get('route', '')}"
+            stats = routes.get(key)
+            if stats is None:
+                stats = routes[key] = RouteStats()
+            stats.add(ms, rec.get("status", 0), rec.get("bytes"))
+            n += 1
+            if top:
+                if len(slowest) < top:
+                    heapq.heappush(slowest, (ms, n, rec))
+                elif ms > slowest[0][0]:
+                    heapq.heapreplace(slowest, (ms, n, rec))
+    return routes, [rec for _, _, rec in sorted(slowest, reverse=True)]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Per-route latency percentiles and the slowest requests")
+    ap.add_argument("logs", nargs="*", help=f"log files (default: {ACCESS_LOG} and its backups)")
+    ap.add_argument("--top", type=int, default=10, help="slowest requests to list")
+    ap.add_argument("--route", help="only this route template")
+    args = ap.parse_args()
+
+    routes, slowest = analyze(args.logs or log_files(ACCESS_LOG), args.top, args.route)
+    print(f"{'route':40} {'count':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'5xx':>6} {'MB':>8}")
+    for key, s in sorted(routes.items(), key=lambda kv: kv[1].total_ms, reverse=True):
+        print(f"{key[:40]:40} {s.count:9d} {s.percentile(0.5):9.2f} {s.percentile(0.95):9.2f} "
+              f"{s.percentile(0.99):9.2f} {s.max_ms:9.2f} {s.errors:6d} {s.bytes / 1e6:8.1f}")
+    if slowest:
+        print(f"\nslowest {len(slowest)} requests (ms):")
+        for rec in slowest:
+            print(f"{rec['ms']:10.2f}  {rec.get('method', '')} {rec.get('route', '')} "
+                  f"-> {rec.get('status')}  target={rec.get('target_id')}  "
+                  f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(rec.get('ts', 0)))}")
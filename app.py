@@ -1,89 +1,162 @@
-from fastapi import FastAPI, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, Form, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
+from typing import Optional
 import sqlite3
-import hashlib
+
+from database import init_schema
+from async_db import AsyncDB
+from counters import start_reconciler
+from etag import etag_headers, etag_matches, make_etag
+from changes import changes_since
+from events import SSE, SSE_HEADERS, asse_stream, get_hub
+from metrics import instrument_asgi
+from accesslog import access_log_asgi
+from usercache import get_user_cache
+from resultcache import get_result_cache, request_key
+from writer import WriteQueueFull
+from pagination import DEFAULT_LIMIT, page_headers, page_url
+from hashing import HashQueueFull, get_hasher
+from bulk import aimport_users, batch_size, import_format, import_response
+from streaming import NDJSON, wants_stream
+from backends import get_backend
 
 app = FastAPI(title="User Management Dashboard")
 
+# ---------- DATABASE ----------
 DB = "users.db"
 
-# ---------- DATABASE ----------
+# Every user operation goes through the storage backend (backends.py):
+# users.db by default, SHARDS=N files of it, or STORAGE=memory. Reads run
+# on the DB threads via adb; writes are awaited. `pool` is the single file,
+# None for the other two: then there is no users.db to set up and no
+# change feed, event hub, user cache or count reconciler over it, so
+# /users/changes always says "reset" and /users/events is closed.
+store = get_backend(DB)
+pool = store.pool
+
 def get_db():
-    return sqlite3.connect(DB, check_same_thread=False)
+    return pool.connection()
 
 def init_db():
-    db = get_db()
-    c = db.cursor()
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL
-    )
-    """)
-    db.commit()
-    db.close()
-
-init_db()
-
-def hash_pw(pw: str):
-    return hashlib.sha256(pw.encode()).hexdigest()
+    conn = get_db()
+    init_schema(conn)
+    conn.close()
+
+adb = AsyncDB(pool)
+hasher = get_hasher().start()
+results = get_result_cache(DB)
+instrument_asgi(app, pool, hasher)
+access_log_asgi(app)
+
+if pool is not None:
+    init_db()
+    start_reconciler(pool)
+    hub = get_hub(pool)
+    user_cache = get_user_cache(pool)
+
+def publish():
+    # wake the event hub after a write instead of waiting for its next poll,
+    # and have the user cache catch up before it answers again
+    if pool is not None:
+        hub.notify()
+        user_cache.invalidate()
+
+async def hash_pw(pw: str):
+    return await hasher.hash_async(pw)
 
 # ---------- API ----------
 @app.get("/status")
-def status():
-    db = get_db()
-    c = db.cursor()
-    c.execute("SELECT COUNT(*) FROM users")
-    count = c.fetchone()[0]
-    db.close()
-    return {"status": "online", "users": count}
+async def status():
+    count = await adb.call(store.count)
+    return {"status": "online", "users": count,
+            "db_pool": pool.stats() if pool is not None else None,
+            "hashing": hasher.stats()}
 
 @app.get("/users")
-def list_users():
-    db = get_db()
-    c = db.cursor()
-    c.execute("SELECT id, email FROM users ORDER BY id DESC")
-    rows = c.fetchall()
-    db.close()
-    return [{"id": r[0], "email": r[1]} for r in rows]
+async def list_users(request: Request, limit: int = DEFAULT_LIMIT,
+                     after: Optional[int] = None, before: Optional[int] = None):
+    version = await adb.call(store.version)
+    etag = make_etag(version)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    if wants_stream(request.headers.get("accept"), request.query_params.get("stream")):
+        rows = adb.iterate(await adb.call(store.stream, after, descending=True))
+        return StreamingResponse(rows, media_type=NDJSON, headers=etag_headers(etag))
+    seq = await adb.call(store.change_seq)
+    seq = {"X-Change-Seq": str(seq)} if seq is not None else {}
+
+    async def render():
+        page = await adb.call(store.page, limit, after, before, True)
+        rows = [{"id": r[0], "email": r[1]} for r in page.rows]
+        return JSONResponse(rows).body, page_headers(request.url.path, request.query_params, page)
+
+    # serialized pages per data version; identical concurrent misses share
+    # one query (see resultcache.py)
+    key = request_key(request.url.path, request.query_params.multi_items())
+    body, headers = await results.aget(key, version, render)
+    return Response(body, media_type="application/json",
+                    headers=dict(headers, **etag_headers(etag), **seq))
+
+# Server-Sent Events of user changes; see events.py
+@app.get("/users/events")
+async def user_events(request: Request):
+    if store.pool is None:
+        return Response(status_code=204)   # tells EventSource not to reconnect
+    stream = asse_stream(hub, adb.run, request.headers.get("last-event-id"))
+    return StreamingResponse(stream, media_type=SSE, headers=SSE_HEADERS)
+
+@app.get("/users/changes")
+async def list_changes(since: Optional[int] = None, limit: Optional[int] = None):
+    if store.pool is None:
+        return {"changes": [], "next": 0, "more": False, "reset": True}
+    return await adb.run(changes_since, since, limit)
 
 @app.post("/users")
-def add_user(email: str = Form(...), password: str = Form(...)):
-    db = get_db()
-    c = db.cursor()
+async def add_user(email: str = Form(...), password: str = Form(...)):
+    # the scrypt derivation runs in the hashing process pool and the INSERT
+    # in a group commit; the event loop only awaits both. A known duplicate
+    # is turned away before paying for the hash.
+    email = email.lower()
+    if await adb.call(store.find_email, email) is not None:
+        return RedirectResponse("/", status_code=303)
+    hashed = await hash_pw(password)
     try:
-        c.execute(
-            "INSERT INTO users(email,password) VALUES (?,?)",
-            (email, hash_pw(password))
-        )
-        db.commit()
+        await store.acreate(email, hashed)
     except sqlite3.IntegrityError:
         pass
-    finally:
-        db.close()
+    publish()
     return RedirectResponse("/", status_code=303)
 
+@app.post("/users/import")
+async def import_users_bulk(request: Request, format: Optional[str] = None,
+                            batch: Optional[int] = None):
+    if store.pool is None:
+        return JSONResponse({"detail": "Import needs the single-file SQLite storage"}, status_code=501)
+    fmt = import_format(format, request.headers.get("content-type"))
+    events = aimport_users(pool, request.stream(), fmt, hasher, adb.call,
+                           batch_size(batch), on_commit=publish)
+    return import_response(events)
+
 @app.post("/delete/{user_id}")
-def delete_user(user_id: int):
-    db = get_db()
-    c = db.cursor()
-    c.execute("DELETE FROM users WHERE id=?", (user_id,))
-    db.commit()
-    db.close()
+async def delete_user(user_id: int):
+    await store.adelete(user_id)
+    publish()
     return RedirectResponse("/", status_code=303)
 
+@app.exception_handler(HashQueueFull)
+@app.exception_handler(WriteQueueFull)
+async def server_busy(request: Request, exc: Exception):
+    return JSONResponse({"detail": "Server busy, try again"}, status_code=503)
+
 # ---------- WEB DASHBOARD ----------
 @app.get("/", response_class=HTMLResponse)
-def dashboard():
-    db = get_db()
-    c = db.cursor()
-    c.execute("SELECT id, email FROM users ORDER BY id DESC")
-    users = c.fetchall()
-    db.close()
+async def dashboard(request: Request, limit: int = DEFAULT_LIMIT,
+                    after: Optional[int] = None, before: Optional[int] = None):
+    page = await adb.call(store.page, limit, after, before, True)
+    users = page.rows
 
     user_rows = "".join(f"""
-        <tr>
+        <tr id="u{u[0]}">
             <td>{u[0]}</td>
             <td>{u[1]}</td>
             <td>
@@ -94,6 +167,13 @@ def dashboard():
         </tr>
     """ for u in users)
 
+    query = request.query_params
+    pager = ""
+    if page.prev_before is not None:
+        pager += f'<a href="{page_url("/", query, before=page.prev_before)}">&larr; Newer</a> '
+    if page.next_after is not None:
+        pager += f'<a href="{page_url("/", query, after=page.next_after)}">Older &rarr;</a>'
+
     html = f"""
     <html>
     <head>
@@ -104,6 +184,7 @@ def dashboard():
             th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
             th {{ background-color: #f2f2f2; }}
             button {{ padding: 5px 10px; }}
+            .pager {{ margin-top: 10px; }}
             input[type=email], input[type=password] {{ padding: 5px; margin-right: 10px; }}
         </style>
     </head>
@@ -116,9 +197,36 @@ def dashboard():
         </form>
 
         <table>
-            <tr><th>ID</th><th>Email</th><th>Action</th></tr>
-            {user_rows}
+            <thead><tr><th>ID</th><th>Email</th><th>Action</th></tr></thead>
+            <tbody id="users">{user_rows}</tbody>
         </table>
+        <p class="pager">{pager}</p>
+        <script>
+        // patch the table from /users/events instead of reloading the page
+        const firstPage = {"false" if before or after else "true"};
+        const events = new EventSource('/users/events');
+        function row(c) {{
+            let tr = document.createElement('tr');
+            tr.id = 'u' + c.id;
+            tr.innerHTML = `<td>${{c.id}}</td><td></td><td><form method="POST" action="/delete/${{c.id}}" style="display:inline;"><button type="submit">Delete</button></form></td>`;
+            tr.cells[1].textContent = c.email;
+            return tr;
+        }}
+        events.addEventListener('insert', e => {{
+            let c = JSON.parse(e.data);
+            if (firstPage && !document.getElementById('u' + c.id))
+                document.getElementById('users').prepend(row(c));
+        }});
+        events.addEventListener('update', e => {{
+            let c = JSON.parse(e.data), tr = document.getElementById('u' + c.id);
+            if (tr) tr.cells[1].textContent = c.email;
+        }});
+        events.addEventListener('delete', e => {{
+            let tr = document.getElementById('u' + JSON.parse(e.data).id);
+            if (tr) tr.remove();
+        }});
+        events.addEventListener('reset', () => location.reload());
+        </script>
     </body>
     </html>
     """
@@ -1,6 +1,22 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-import sqlite3, os, hashlib
+from database import init_schema
+from pagination import clamp_limit, page_headers
+from hashing import HashQueueFull, get_hasher
+from bulk import batch_size, import_format, import_users, ndjson, text_lines
+from bulk import parse_changes, parse_selector
+from streaming import NDJSON, wants_stream
+from etag import etag_headers, etag_matches, make_etag
+from changes import changes_since
+from events import SSE, SSE_BUSY_RETRY, SSE_HEADERS, StreamsFull, get_hub, sse_stream
+from metrics import instrument_flask
+from accesslog import access_log_flask
+from usercache import get_user_cache
+from resultcache import get_result_cache, request_key
+from writer import WriteQueueFull
+from suggest import get_suggest_index
+from backends import get_backend
+import sqlite3, os
 
 app = Flask(__name__)
 CORS(app)
@@ -8,40 +24,127 @@ CORS(app)
 DB_PATH = "users.db"
 
 # ---------- DB ----------
+# Every user operation goes through the storage backend (backends.py):
+# users.db by default, SHARDS=N files of it, or STORAGE=memory. `pool` is
+# the single file, None for the other two: then there is no users.db to
+# set up and no change feed, event hub or user cache over it, so /changes
+# always says "reset" and /events is closed.
+store = get_backend(DB_PATH)
+pool = store.pool
+
 def get_db():
-    return sqlite3.connect(DB_PATH)
+    return pool.connection()
 
 def init_db():
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL
-    )
-    """)
-    conn.commit()
+    init_schema(conn)
     conn.close()
 
-def hash_password(p):
-    return hashlib.sha256(p.encode()).hexdigest()
+hasher = get_hasher().start()
+results = get_result_cache(DB_PATH)
+instrument_flask(app, pool, hasher)
+access_log_flask(app)
 
-init_db()
+if pool is not None:
+    # before anything reads the tables (the suggest index loads on creation)
+    init_db()
+    hub = get_hub(pool)
+    user_cache = get_user_cache(pool)
+    suggestions = get_suggest_index(pool)
+else:
+    hub = user_cache = None
+    suggestions = store   # the backend answers suggestions itself
+
+def hash_password(p):
+    return hasher.hash(p)
 
 # ---------- API ----------
 @app.route("/api/users", methods=["GET"])
 def list_users():
     q = request.args.get("search", "").lower()
+    limit = clamp_limit(request.args.get("limit", type=int))
+    after = request.args.get("after", type=int)
+    before = request.args.get("before", type=int)
+    prefix = request.args.get("match") == "prefix"
+    # the version is read before the rows, so a tag can only ever be older
+    # than the data it goes with, never newer
+    version = store.version()
+    etag = make_etag(version)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return "", 304, etag_headers(etag)
+    # where a client should start following /api/users/changes from
+    seq = store.change_seq()
+    seq = {"X-Change-Seq": str(seq)} if seq is not None else {}
+    if wants_stream(request.headers.get("Accept"), request.args.get("stream")):
+        # whole (filtered) listing as NDJSON
+        rows = store.stream(after, q, prefix)
+        return Response(stream_with_context(rows), mimetype=NDJSON, headers=dict(etag_headers(etag), **seq))
+
+    def render():
+        if q and request.args.get("order") == "rank":
+            page = store.ranked(q, limit)
+        elif q:
+            page = store.search(q, limit, after, before, prefix=prefix)
+        else:
+            page = store.page(limit, after, before)
+        rows = [{"id": r[0], "email": r[1]} for r in page.rows]
+        return jsonify(rows).get_data(), page_headers(request.path, request.args, page)
+
+    # serialized pages and search results per data version; identical
+    # concurrent misses share one query (see resultcache.py)
+    key = request_key(request.path, request.args.items(multi=True))
+    body, headers = results.get(key, version, render)
+    return Response(body, mimetype="application/json",
+                    headers=dict(headers, **etag_headers(etag), **seq))
+
+@app.route("/api/users/changes", methods=["GET"])
+def list_changes():
+    if store.pool is None:
+        return jsonify({"changes": [], "next": 0, "more": False, "reset": True})
+    since = request.args.get("since", type=int)
     conn = get_db()
-    cur = conn.cursor()
-    if q:
-        cur.execute("SELECT id, email FROM users WHERE LOWER(email) LIKE ?", ('%'+q+'%',))
-    else:
-        cur.execute("SELECT id, email FROM users")
-    rows = cur.fetchall()
+    feed = changes_since(conn, since, request.args.get("limit", type=int))
     conn.close()
-    return jsonify([{"id": r[0], "email": r[1]} for r in rows])
+    return jsonify(feed)
+
+# type-ahead from an in-memory sorted email index; no SQLite on this path
+# (sharded storage answers from each shard's email index instead)
+@app.route("/api/users/suggest", methods=["GET"])
+def suggest_users():
+    return jsonify(suggestions.suggest(request.args.get("prefix", ""),
+                                       request.args.get("limit", type=int)))
+
+@app.route("/api/users/suggest/stats", methods=["GET"])
+def suggest_stats():
+    return jsonify(suggestions.stats())
+
+# Server-Sent Events: one "insert"/"update"/"delete" event per change, "reset"
+# when the client should reload; reconnects resume from Last-Event-ID
+@app.route("/api/users/events", methods=["GET"])
+def user_events():
+    if store.pool is None:
+        return "", 204   # tells EventSource not to reconnect
+    try:
+        stream = sse_stream(hub, request.headers.get("Last-Event-ID"))
+    except StreamsFull:
+        # this worker's stream threads are all taken (see events.py); the
+        # dashboard keeps to /api/users/changes and asks again later
+        return jsonify({"error": "Too many event streams"}), 503, {"Retry-After": str(SSE_BUSY_RETRY)}
+    return Response(stream_with_context(stream), mimetype=SSE, headers=SSE_HEADERS)
+
+def publish():
+    # wake the event hub after a write instead of waiting for its next poll,
+    # and have the user cache catch up before it answers again
+    hub.notify()
+    user_cache.invalidate()
+
+@app.after_request
+def publish_changes(response):
+    # after any write; an import's rows land while its response streams,
+    # after this has run, so the import publishes each batch itself
+    if pool is not None and request.method != "GET" and request.path.startswith("/api/users"):
+        publish()
+    return response
 
 @app.route("/api/users", methods=["POST"])
 def add_user():
@@ -50,50 +153,99 @@ def add_user():
     password = data.get("password")
     if not email or not password:
         return jsonify({"error":"Missing data"}), 400
+    # a known duplicate is turned away before paying for a scrypt hash
+    if store.find_email(email.lower()) is not None:
+        return jsonify({"error":"Email already exists"}), 400
+
+    hashed = hash_password(password)
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO users (email,password) VALUES (?,?)",
-            (email.lower(), hash_password(password))
-        )
-        conn.commit()
-        conn.close()
+        store.create(email.lower(), hashed)
         return jsonify({"success": True})
     except sqlite3.IntegrityError:
         return jsonify({"error": "Email already exists"}), 400
 
+@app.route("/api/users/import", methods=["POST"])
+def import_users_bulk():
+    # CSV (header: email,password) or JSONL body, read line by line;
+    # the response streams one NDJSON line per rejected row and batch
+    if store.pool is None:
+        return jsonify({"error":"Import needs the single-file SQLite storage"}), 501
+    fmt = import_format(request.args.get("format"), request.content_type)
+    size = batch_size(request.args.get("batch", type=int))
+    lines = text_lines(request.stream)
+
+    def generate():
+        for event in import_users(pool, lines, fmt, hasher, size, on_commit=publish):
+            yield ndjson(event)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/api/users/<int:user_id>", methods=["GET"])
+def get_user(user_id):
+    row = store.get(user_id)
+    if row is None:
+        return jsonify({"error":"Not found"}), 404
+    return jsonify({"id": row[0], "email": row[1]})
+
 @app.route("/api/users/<int:user_id>", methods=["PUT"])
 def update_user(user_id):
     data = request.json
     email = data.get("email")
     password = data.get("password")
 
-    conn = get_db()
-    cur = conn.cursor()
-    if password:
-        cur.execute(
-            "UPDATE users SET email=?, password=? WHERE id=?",
-            (email.lower(), hash_password(password), user_id)
-        )
-    else:
-        cur.execute(
-            "UPDATE users SET email=? WHERE id=?",
-            (email.lower(), user_id)
-        )
-    conn.commit()
-    conn.close()
+    owner = store.find_email(email.lower())
+    if owner is not None and owner[0] != user_id:
+        return jsonify({"error":"Email already exists"}), 400
+
+    hashed = hash_password(password) if password else None
+    try:
+        # sharded: may move the user to another shard if the email hashes elsewhere
+        store.update(user_id, email.lower(), hashed)
+    except sqlite3.IntegrityError:
+        return jsonify({"error":"Email already exists"}), 400
     return jsonify({"success": True})
 
 @app.route("/api/users/<int:user_id>", methods=["DELETE"])
 def delete_user(user_id):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE id=?", (user_id,))
-    conn.commit()
-    conn.close()
+    store.delete(user_id)
     return jsonify({"success": True})
 
+# body: one of "ids": [...], "id_range": [first, last] or "search": "...",
+# plus "dry_run": true to get the counts without changing anything
+@app.route("/api/users/bulk-delete", methods=["POST"])
+def bulk_delete_users():
+    data = request.json or {}
+    try:
+        selector = parse_selector(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(store.bulk_delete(selector, bool(data.get("dry_run"))))
+
+@app.route("/api/users/bulk-update", methods=["POST"])
+def bulk_update_users():
+    data = request.json or {}
+    try:
+        # first: it rejects a body that is not a JSON object
+        selector = parse_selector(data)
+        dry_run = bool(data.get("dry_run"))
+        changes = parse_changes(data, hasher, dry_run)
+    except (TypeError, ValueError, KeyError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        return jsonify(store.bulk_update(selector, changes, dry_run))
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "Email already exists"}), 400
+    except ValueError as e:
+        # what this storage cannot do (replace_domain across shards)
+        return jsonify({"error": str(e)}), 400
+
+@app.errorhandler(HashQueueFull)
+@app.errorhandler(WriteQueueFull)
+def server_busy(e):
+    return jsonify({"error": "Server busy, try again"}), 503
+
 # ---------- UI ----------
 @app.route("/")
 def dashboard():
@@ -126,7 +278,8 @@ input.password { font-family: password; }
 <button onclick="addUser()">Add</button>
 <span id="message"></span>
 
-<input type="text" id="search" placeholder="Search Email..." oninput="loadUsers()">
+<input type="text" id="search" placeholder="Search Email..." list="suggestions" oninput="suggest(); loadUsers()">
+<datalist id="suggestions"></datalist>
 
 <table>
 <thead>
@@ -134,28 +287,115 @@ input.password { font-family: password; }
 </thead>
 <tbody id="users"></tbody>
 </table>
+<button id="more" onclick="loadUsers(true)" style="display:none">Load more</button>
 </div>
 
 <script>
-async function loadUsers() {
+let nextCursor = null;
+let changeSeq = null;
+
+function userRow(u) {
+  let tr = document.createElement('tr');
+  tr.id = 'u' + u.id;
+  tr.dataset.id = u.id;
+  tr.innerHTML = `
+    <td><input id="e${u.id}"></td>
+    <td><input value="••••••" disabled class="password"></td>
+    <td>
+      <button onclick="updateUser(${u.id})">💾</button>
+      <button onclick="deleteUser(${u.id})">🗑</button>
+    </td>`;
+  tr.querySelector('input').value = u.email;
+  return tr;
+}
+
+async function loadUsers(more) {
   let query = document.getElementById('search').value;
-  let res = await fetch('/api/users?search=' + encodeURIComponent(query));
+  let url = '/api/users?search=' + encodeURIComponent(query);
+  if (more && nextCursor) url += '&after=' + nextCursor;
+  let res = await fetch(url);
+  nextCursor = res.headers.get('X-Next-Cursor');
+  if (!more) changeSeq = res.headers.get('X-Change-Seq');
+  document.getElementById('more').style.display = nextCursor ? '' : 'none';
   let data = await res.json();
 
+  let rows = document.createDocumentFragment();
+  data.forEach(u => rows.appendChild(userRow(u)));
   let tbody = document.getElementById('users');
-  tbody.innerHTML = '';
-  data.forEach(u => {
-    tbody.innerHTML += `
-      <tr>
-        <td><input value="${u.email}" id="e${u.id}"></td>
-        <td><input value="••••••" disabled class="password"></td>
-        <td>
-          <button onclick="updateUser(${u.id})">💾</button>
-          <button onclick="deleteUser(${u.id})">🗑</button>
-        </td>
-      </tr>`;
+  if (more) tbody.appendChild(rows); else tbody.replaceChildren(rows);
+}
+
+async function suggest() {
+  let prefix = document.getElementById('search').value;
+  let list = document.getElementById('suggestions');
+  if (!prefix) return list.replaceChildren();
+  let res = await fetch('/api/users/suggest?prefix=' + encodeURIComponent(prefix));
+  let options = document.createDocumentFragment();
+  (await res.json()).forEach(u => {
+    let option = document.createElement('option');
+    option.value = u.email;
+    options.appendChild(option);
   });
+  list.replaceChildren(options);
+}
+
+// patch the table with /api/users/changes instead of reloading it
+async function syncChanges() {
+  if (events.readyState === EventSource.OPEN) return;
+  if (changeSeq === null) return loadUsers();
+  while (true) {
+    let res = await fetch('/api/users/changes?since=' + changeSeq);
+    let feed = await res.json();
+    if (feed.reset) return loadUsers();
+    feed.changes.forEach(applyChange);
+    changeSeq = feed.next;
+    if (!feed.more) return;
+  }
+}
+
+function applyChange(c) {
+  if (changeSeq !== null && c.seq <= Number(changeSeq)) return;
+  let row = document.getElementById('u' + c.id);
+  let query = document.getElementById('search').value.toLowerCase();
+  let visible = c.op !== 'delete' && c.email.toLowerCase().includes(query);
+  if (!visible) {
+    if (row) row.remove();
+    return;
+  }
+  if (row) {
+    let input = row.querySelector('input');
+    if (document.activeElement !== input) input.value = c.email;
+    return;
+  }
+  // a new row only belongs here if it falls inside the pages loaded so far
+  if (nextCursor && c.id > Number(nextCursor)) return;
+  let tbody = document.getElementById('users');
+  let last = tbody.lastElementChild;
+  let before = null;
+  if (last && Number(last.dataset.id) > c.id) {
+    before = Array.from(tbody.rows).find(r => Number(r.dataset.id) > c.id);
+  }
+  tbody.insertBefore(userRow(c), before);
+}
+
+// live updates from other dashboards; the browser reconnects on its own
+// and the server replays what was missed from Last-Event-ID. A server with
+// no stream to spare answers 503 and the browser gives up: catch up from
+// the changes feed then and try again later.
+let events;
+function listen() {
+  events = new EventSource('/api/users/events');
+  ['insert', 'update', 'delete'].forEach(op => events.addEventListener(op, e => {
+    let c = JSON.parse(e.data);
+    applyChange(c);
+    changeSeq = Math.max(Number(changeSeq), c.seq);
+  }));
+  events.addEventListener('reset', () => loadUsers());
+  events.onerror = () => {
+    if (events.readyState === EventSource.CLOSED) setTimeout(() => { listen(); syncChanges(); }, 30000);
+  };
 }
+listen();
 
 async function addUser() {
   let email = document.getElementById('email').value;
@@ -173,7 +413,7 @@ async function addUser() {
       message.innerHTML = `<span class="success">User added!</span>`;
       document.getElementById('email').value='';
       document.getElementById('password').value='';
-      loadUsers(); // 🔥 تحديث الجدول بعد الإضافة
+      syncChanges(); // 🔥 تحديث الجدول بعد الإضافة
   }
 }
 
@@ -184,13 +424,13 @@ async function updateUser(id) {
     headers:{'Content-Type':'application/json'},
     body:JSON.stringify({email})
   });
-  loadUsers(); // 🔥 تحديث الجدول بعد التعديل
+  syncChanges(); // 🔥 تحديث الجدول بعد التعديل
 }
 
 async function deleteUser(id) {
   if(!confirm("Are you sure?")) return;
   await fetch('/api/users/'+id,{method:'DELETE'});
-  loadUsers(); // 🔥 تحديث الجدول بعد الحذف
+  syncChanges(); // 🔥 تحديث الجدول بعد الحذف
 }
 
 // تحميل البيانات عند فتح الصفحة
@@ -1,115 +1,65 @@
-import sqlite3
-import hashlib
-import threading
-import time
-
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List
-import uvicorn
-
-# ================= DATABASE =================
-DB = "users.db"
-
-def get_db():
-    return sqlite3.connect(DB, check_same_thread=False)
-
-def init_db():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL
-    )
-    """)
-    conn.commit()
-    conn.close()
-
-init_db()
-
-def hash_pw(pw: str):
-    return hashlib.sha256(pw.encode()).hexdigest()
-
-# ================= FASTAPI =================
-api = FastAPI(title="Users API")
-
-class UserIn(BaseModel):
-    email: str
-    password: str
-
-class UserOut(BaseModel):
-    id: int
-    email: str
-
-@api.get("/api/status")
-def status():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM users")
-    count = cur.fetchone()[0]
-    conn.close()
-    return {"status": "online", "users": count}
-
-@api.get("/api/users", response_model=List[UserOut])
-def list_users():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT id, email FROM users ORDER BY id DESC")
-    rows = cur.fetchall()
-    conn.close()
-    return [{"id": r[0], "email": r[1]} for r in rows]
-
-@api.post("/api/users")
-def add_user(user: UserIn):
-    conn = get_db()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            "INSERT INTO users (email, password) VALUES (?, ?)",
-            (user.email, hash_pw(user.password))
-        )
-        conn.commit()
-    except sqlite3.IntegrityError:
-        raise HTTPException(400, "Email already exists")
-    finally:
-        conn.close()
-    return {"success": True}
-
-@api.delete("/api/users/{user_id}")
-def delete_user(user_id: int):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE id=?", (user_id,))
-    conn.commit()
-    conn.close()
-    return {"deleted": True}
-
-# ================= START API THREAD =================
-def start_api():
-    uvicorn.run(api, host="127.0.0.1", port=8000, log_level="warning")
-
-api_thread = threading.Thread(target=start_api, daemon=True)
-api_thread.start()
-
-time.sleep(1)  # نضمن أن السيرفر اشتغل
+import os
 
-# ================= STREAMLIT =================
 import streamlit as st
 import requests
 import pandas as pd
 
-API = "http://127.0.0.1:8000/api"
+from pagination import DEFAULT_LIMIT
+import app6_api
+from app6_api import API_HOST, API_PORT, store
+
+# ================= START API =================
+# Streamlit re-executes this file on every interaction, so it holds only the
+# page. The API, its storage and background threads live in app6_api.py,
+# imported once per process; the embedded server is a cache_resource, so it
+# starts once and every later rerun just gets the running handle back. With
+# API_EMBEDDED=0 it is not started: `python serve.py app6` runs the API
+# under gunicorn and this page talks to that instead.
+API_EMBEDDED = os.environ.get("API_EMBEDDED", "1") != "0"
+
+@st.cache_resource
+def api_server():
+    return app6_api.start_server() if API_EMBEDDED else None
+
+api_server()
+
+# ================= STREAMLIT =================
+API = f"http://{API_HOST}:{API_PORT}/api"
 
 st.set_page_config("User Dashboard", layout="wide")
 st.title("🧩 User Management Dashboard")
 
+# ===== DATA =====
+# Reads go straight to the storage backend in this process and are cached
+# per data version (bumped on every write), so a widget interaction costs
+# one O(1) version lookup; any mutation, from here or elsewhere, invalidates
+# by changing the key. Writes still go through the API over one keep-alive
+# session so hashing and validation stay in one place.
+@st.cache_resource
+def http():
+    return requests.Session()
+
+def data_version():
+    return store.version()
+
+@st.cache_data(max_entries=8)
+def load_status(version):
+    return {"status": "online", "users": store.count()}
+
+@st.cache_data(max_entries=64)
+def load_users(after, version):
+    page = store.page(DEFAULT_LIMIT, after, descending=True)
+    return pd.DataFrame(page.rows, columns=["id", "email"]), page.next_after
+
 # ===== STATUS =====
-status = requests.get(f"{API}/status").json()
-c1, c2 = st.columns(2)
-c1.metric("Server", status["status"])
-c2.metric("Users", status["users"])
+@st.fragment(run_every=2)
+def status_bar():
+    status = load_status(data_version())
+    c1, c2 = st.columns(2)
+    c1.metric("Server", status["status"])
+    c2.metric("Users", status["users"])
+
+status_bar()
 
 st.divider()
 
@@ -118,7 +68,7 @@ with st.form("add_user"):
     email = st.text_input("Email")
     password = st.text_input("Password", type="password")
     if st.form_submit_button("Add"):
-        r = requests.post(f"{API}/users", json={
+        r = http().post(f"{API}/users", json={
             "email": email,
             "password": password
         })
@@ -131,16 +81,34 @@ with st.form("add_user"):
 st.divider()
 
 # ===== USERS TABLE =====
-users = requests.get(f"{API}/users").json()
-
-if users:
-    df = pd.DataFrame(users)
-    st.dataframe(df, use_container_width=True)
-
-    uid = st.selectbox("Delete user", df["id"])
-    if st.button("Delete"):
-        requests.delete(f"{API}/users/{uid}")
-        st.warning("User deleted")
-        st.rerun()
-else:
-    st.info("No users found")
+# A fragment that re-runs on its own every couple of seconds; unless the
+# data version moved, that is a cache hit and nothing is rebuilt. Buttons
+# act in on_click callbacks, which run before the fragment re-renders.
+def delete_user_clicked(uid):
+    http().delete(f"{API}/users/{uid}")
+    st.session_state["deleted"] = uid
+
+def set_page(after):
+    st.session_state["after"] = after
+
+@st.fragment(run_every=2)
+def users_table():
+    df, next_cursor = load_users(st.session_state.get("after"), data_version())
+
+    if not df.empty:
+        st.dataframe(df, use_container_width=True)
+
+        uid = st.selectbox("Delete user", df["id"])
+        st.button("Delete", on_click=delete_user_clicked, args=(uid,))
+        if st.session_state.pop("deleted", None) is not None:
+            st.warning("User deleted")
+    else:
+        st.info("No users found")
+
+    p1, p2 = st.columns(2)
+    if st.session_state.get("after"):
+        p1.button("First page", on_click=set_page, args=(None,))
+    if next_cursor:
+        p2.button("Next page", on_click=set_page, args=(int(next_cursor),))
+
+users_table()
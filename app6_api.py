@@ -0,0 +1,259 @@
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from typing import List, Optional
+import uvicorn
+
+from database import init_schema
+from async_db import AsyncDB
+from counters import start_reconciler
+from etag import etag_headers, etag_matches, make_etag
+from changes import changes_since
+from events import SSE, SSE_HEADERS, asse_stream, get_hub
+from metrics import instrument_asgi
+from accesslog import access_log_asgi
+from usercache import get_user_cache
+from resultcache import get_result_cache, request_key
+from writer import WriteQueueFull
+from pagination import DEFAULT_LIMIT, page_headers
+from hashing import HashQueueFull, get_hasher
+from bulk import aimport_users, batch_size, import_format, import_response
+from streaming import NDJSON, wants_stream
+from bulk import parse_changes, parse_selector
+from backends import get_backend
+
+# The API behind the app6.py dashboard. Streamlit re-executes app6.py on
+# every interaction; everything here is an ordinary module, imported once
+# per process, so the storage, background threads and routes are set up a
+# single time. `python serve.py app6` runs `api` under gunicorn.
+
+# ================= DATABASE =================
+DB = "users.db"
+
+# Every user operation goes through the storage backend (backends.py):
+# users.db by default, SHARDS=N files of it, or STORAGE=memory. Reads run
+# on the DB threads via adb; writes are awaited. `pool` is the single file,
+# None for the other two: then there is no users.db to set up and no
+# change feed, event hub, user cache or count reconciler over it, so
+# /api/users/changes always says "reset" and /api/users/events is closed.
+store = get_backend(DB)
+pool = store.pool
+
+def get_db():
+    return pool.connection()
+
+def init_db():
+    conn = get_db()
+    init_schema(conn)
+    conn.close()
+
+adb = AsyncDB(pool)
+hasher = get_hasher().start()
+results = get_result_cache(DB)
+
+if pool is not None:
+    init_db()
+    start_reconciler(pool)
+    hub = get_hub(pool)
+    user_cache = get_user_cache(pool)
+
+def publish():
+    # wake the event hub after a write instead of waiting for its next poll,
+    # and have the user cache catch up before it answers again
+    if pool is not None:
+        hub.notify()
+        user_cache.invalidate()
+
+async def hash_pw(pw: str):
+    return await hasher.hash_async(pw)
+
+# ================= FASTAPI =================
+api = FastAPI(title="Users API")
+instrument_asgi(api, pool, hasher)
+access_log_asgi(api)
+
+class UserIn(BaseModel):
+    email: str
+    password: str
+
+class UserOut(BaseModel):
+    id: int
+    email: str
+
+class BulkSelect(BaseModel):
+    ids: Optional[List[int]] = None
+    id_range: Optional[List[int]] = None
+    search: Optional[str] = None
+    dry_run: bool = False
+
+class BulkUpdate(BulkSelect):
+    set: Optional[dict] = None
+    replace_domain: Optional[dict] = None
+
+# ----- storage calls (run on the DB threads via adb) -----
+def update_selected(selector, changes, dry_run):
+    try:
+        return store.bulk_update(selector, changes, dry_run)
+    except sqlite3.IntegrityError:
+        raise HTTPException(400, "Email already exists")
+    except ValueError as e:
+        # what this storage cannot do (replace_domain across shards)
+        raise HTTPException(400, str(e))
+
+# ----- routes -----
+@api.get("/api/health")
+async def health():
+    # readiness probe; no DB work
+    return {"status": "ok"}
+
+@api.get("/api/status")
+async def status():
+    count = await adb.call(store.count)
+    return {"status": "online", "users": count,
+            "db_pool": pool.stats() if pool is not None else None,
+            "hashing": hasher.stats()}
+
+@api.get("/api/users", response_model=List[UserOut])
+async def list_users(request: Request, limit: int = DEFAULT_LIMIT,
+                     after: Optional[int] = None, before: Optional[int] = None):
+    version = await adb.call(store.version)
+    etag = make_etag(version)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    if wants_stream(request.headers.get("accept"), request.query_params.get("stream")):
+        rows = adb.iterate(await adb.call(store.stream, after, descending=True))
+        return StreamingResponse(rows, media_type=NDJSON, headers=etag_headers(etag))
+    seq = await adb.call(store.change_seq)
+    seq = {"X-Change-Seq": str(seq)} if seq is not None else {}
+
+    async def render():
+        page = await adb.call(store.page, limit, after, before, True)
+        rows = [{"id": r[0], "email": r[1]} for r in page.rows]
+        return JSONResponse(rows).body, page_headers(request.url.path, request.query_params, page)
+
+    # serialized pages per data version; identical concurrent misses share
+    # one query (see resultcache.py)
+    key = request_key(request.url.path, request.query_params.multi_items())
+    body, headers = await results.aget(key, version, render)
+    return Response(body, media_type="application/json",
+                    headers=dict(headers, **etag_headers(etag), **seq))
+
+# Server-Sent Events of user changes for browser clients; see events.py
+@api.get("/api/users/events")
+async def user_events(request: Request):
+    if store.pool is None:
+        return Response(status_code=204)   # tells EventSource not to reconnect
+    stream = asse_stream(hub, adb.run, request.headers.get("last-event-id"))
+    return StreamingResponse(stream, media_type=SSE, headers=SSE_HEADERS)
+
+@api.get("/api/users/changes")
+async def list_changes(since: Optional[int] = None, limit: Optional[int] = None):
+    if store.pool is None:
+        return {"changes": [], "next": 0, "more": False, "reset": True}
+    return await adb.run(changes_since, since, limit)
+
+@api.post("/api/users")
+async def add_user(user: UserIn):
+    # a known duplicate is turned away before paying for a scrypt hash
+    email = user.email.lower()
+    if await adb.call(store.find_email, email) is not None:
+        raise HTTPException(400, "Email already exists")
+    hashed = await hash_pw(user.password)
+    try:
+        await store.acreate(email, hashed)
+    except sqlite3.IntegrityError:
+        raise HTTPException(400, "Email already exists")
+    publish()
+    return {"success": True}
+
+@api.post("/api/users/import")
+async def import_users_bulk(request: Request, format: Optional[str] = None,
+                            batch: Optional[int] = None):
+    if store.pool is None:
+        raise HTTPException(501, "Import needs the single-file SQLite storage")
+    fmt = import_format(format, request.headers.get("content-type"))
+    events = aimport_users(pool, request.stream(), fmt, hasher, adb.call,
+                           batch_size(batch), on_commit=publish)
+    return import_response(events)
+
+@api.get("/api/users/{user_id}", response_model=UserOut)
+async def get_user(user_id: int):
+    row = await adb.call(store.get, user_id)
+    if row is None:
+        raise HTTPException(404, "Not found")
+    return {"id": row[0], "email": row[1]}
+
+@api.delete("/api/users/{user_id}")
+async def delete_user(user_id: int):
+    await store.adelete(user_id)
+    publish()
+    return {"deleted": True}
+
+@api.post("/api/users/bulk-delete")
+async def bulk_delete_users(body: BulkSelect):
+    try:
+        selector = parse_selector(body.model_dump())
+    except (TypeError, ValueError) as e:
+        raise HTTPException(400, str(e))
+    result = await adb.call(store.bulk_delete, selector, body.dry_run)
+    publish()
+    return result
+
+@api.post("/api/users/bulk-update")
+async def bulk_update_users(body: BulkUpdate):
+    data = body.model_dump()
+    if (data["set"] or {}).get("password") and not body.dry_run:
+        # hash the new shared password on the hashing pool, not a DB thread
+        data["set"] = {"password_hash": await hash_pw(str(data["set"]["password"]))}
+    try:
+        selector = parse_selector(data)
+        changes = parse_changes(data, hasher, body.dry_run)
+    except (TypeError, ValueError, KeyError) as e:
+        raise HTTPException(400, str(e))
+    result = await adb.call(update_selected, selector, changes, body.dry_run)
+    publish()
+    return result
+
+@api.exception_handler(HashQueueFull)
+@api.exception_handler(WriteQueueFull)
+async def server_busy(request: Request, exc: Exception):
+    return JSONResponse({"detail": "Server busy, try again"}, status_code=503)
+
+# ================= EMBEDDED SERVER =================
+API_HOST = os.environ.get("API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("API_PORT", "8000"))
+API_START_TIMEOUT = float(os.environ.get("API_START_TIMEOUT", "10"))
+
+def wait_ready(server, thread, url, timeout=API_START_TIMEOUT):
+    # poll the health endpoint with backoff (5ms doubling to 200ms) until
+    # our own server reports it is listening and answers
+    delay = 0.005
+    deadline = time.monotonic() + timeout
+    while True:
+        if not thread.is_alive():
+            raise RuntimeError(f"API server exited during startup (is port {API_PORT} in use?)")
+        if server.started:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as r:
+                    if r.status == 200:
+                        return
+            except OSError:
+                pass
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"API server not ready after {timeout}s")
+        time.sleep(delay)
+        delay = min(delay * 2, 0.2)
+
+def start_server():
+    # uvicorn on a daemon thread of this process; returns once it answers
+    server = uvicorn.Server(uvicorn.Config(api, host=API_HOST, port=API_PORT, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="api", daemon=True)
+    thread.start()
+    wait_ready(server, thread, f"http://{API_HOST}:{API_PORT}/api/health")
+    return server
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from database import POOL_SIZE
+
+# ---------- SETTINGS ----------
+# DB threads per process; at most DB_POOL_SIZE, so they alone never
+# exhaust the pool. Request threads, the event hub's poller and the user
+# count reconciler check out connections too, each only for one query or
+# batch, so a DB thread may wait for one but never for long.
+DB_WORKERS = int(os.environ.get("DB_WORKERS", str(POOL_SIZE)))
+
+_DONE = object()
+
+
+# ---------- EXECUTOR ----------
+class AsyncDB:
+    # sqlite3 has no async API, so blocking calls run on a small dedicated
+    # thread pool instead of Starlette's shared 40-thread default. Handlers
+    # stay `async def` and only await the result.
+
+    def __init__(self, pool, workers=DB_WORKERS):
+        self.pool = pool
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        _instances.add(self)
+
+    def _with_conn(self, fn, args, kwargs):
+        conn = self.pool.connection()
+        try:
+            return fn(conn, *args, **kwargs)
+        finally:
+            conn.close()
+
+    async def run(self, fn, *args, **kwargs):
+        # fn(conn, *args) on a DB thread with a pooled connection
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._with_conn, fn, args, kwargs)
+
+    async def call(self, fn, *args, **kwargs):
+        # fn(*args) on a DB thread; for helpers that manage their own connection
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    async def connection(self):
+        # checkout can block when the pool is exhausted, so it happens off-loop too
+        return await self.call(self.pool.connection)
+
+    async def iterate(self, iterator):
+        # drive a blocking iterator (e.g. a fetchmany() generator) one step
+        # at a time on the DB threads
+        iterator = iter(iterator)
+        try:
+            while True:
+                item = await self.call(next, iterator, _DONE)
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                await self.call(close)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+# An executor's threads do not survive fork(), but it would still count
+# them as idle and never start new ones: give each child a fresh one.
+_instances = weakref.WeakSet()
+
+def _after_fork():
+    for adb in _instances:
+        adb._executor = ThreadPoolExecutor(max_workers=adb.workers, thread_name_prefix="db")
+
+os.register_at_fork(after_in_child=_after_fork)
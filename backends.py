@@ -0,0 +1,475 @@
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+from typing import Protocol
+
+from bulk import SAMPLE_SIZE, bulk_delete, bulk_update
+from changes import current_seq
+from counters import user_count, users_version
+from database import get_pool
+from pagination import Page, clamp_limit, fetch_page
+from search import MIN_INDEXED_LEN, ranked_search, search_clause, search_users
+from streaming import STREAM_BATCH, stream_users
+from suggest import MAX_SUGGEST_LIMIT, SUGGEST_LIMIT, normalize
+from usercache import get_user_cache
+from writer import get_writer
+
+# ---------- SETTINGS ----------
+# sqlite: users.db, or SHARDS files of it (see shards.py). memory: dicts
+# in this process only, gone on restart; for load-testing the HTTP layer
+# without the database, and for throwaway instances.
+STORAGE = os.environ.get("STORAGE", "sqlite")
+# memory: start from a copy of this SQLite file's users (read-only)
+MEMORY_SEED = os.environ.get("MEMORY_SEED", "")
+
+
+class DuplicateEmail(sqlite3.IntegrityError):
+    # raised by engines without SQLite's UNIQUE index, so handlers keep
+    # catching sqlite3.IntegrityError whatever the engine
+    pass
+
+
+# ---------- PROTOCOL ----------
+class UserBackend(Protocol):
+    # What the handlers ask of storage. Rows are (id, email); listings are
+    # pagination.Page in id order with fetch_page's cursors; emails are
+    # stored as given (the apps lowercase them) and a taken one raises
+    # sqlite3.IntegrityError. `pool` is the single SQLite database when
+    # there is one: the change feed, SSE and import need it. The a* writes
+    # are for the ASGI apps: they await the write without holding a thread.
+    pool: object
+
+    def get(self, user_id): ...
+    def find_email(self, email): ...
+    def create(self, email, password): ...                 # -> new id
+    def update(self, user_id, email, password=None): ...   # -> rows changed
+    def delete(self, user_id): ...                         # -> rows changed
+    async def acreate(self, email, password): ...
+    async def aupdate(self, user_id, email, password=None): ...
+    async def adelete(self, user_id): ...
+    def page(self, limit, after=None, before=None, descending=False): ...
+    def search(self, q, limit, after=None, before=None, descending=False, prefix=False): ...
+    def ranked(self, q, limit): ...
+    def stream(self, after=None, q="", prefix=False, descending=False): ...  # NDJSON chunks
+    def count(self): ...
+    def version(self): ...                                 # moves on every write
+    def change_seq(self): ...                              # None without a change feed
+    def bulk_delete(self, selector, dry_run=False): ...
+    def bulk_update(self, selector, changes, dry_run=False): ...   # bulk.Changes
+    def stats(self): ...
+
+
+def stream_pages(backend, after=None, q="", prefix=False, descending=False, batch=STREAM_BATCH):
+    # NDJSON of every (matching) user in id order, for engines without a
+    # cursor of their own to stream from
+    while True:
+        if q:
+            page = backend.search(q, batch, after, descending=descending, prefix=prefix)
+        else:
+            page = backend.page(batch, after, descending=descending)
+        if page.rows:
+            yield "".join(json.dumps({"id": r[0], "email": r[1]}) + "\n" for r in page.rows)
+        if page.next_after is None:
+            return
+        after = page.next_after
+
+
+# ---------- SQLITE ----------
+def _insert(conn, email, password):
+    return conn.execute("INSERT INTO users (email, password) VALUES (?, ?)",
+                        (email, password)).lastrowid
+
+
+def _by_email(conn, email):
+    return conn.execute("SELECT id, email FROM users WHERE email = ?", (email,)).fetchone()
+
+
+def _update(conn, user_id, email, password):
+    if password is None:
+        return conn.execute("UPDATE users SET email = ? WHERE id = ?", (email, user_id)).rowcount
+    return conn.execute("UPDATE users SET email = ?, password = ? WHERE id = ?",
+                        (email, password, user_id)).rowcount
+
+
+class SQLiteBackend:
+    # The single users.db: reads on pooled connections, single users through
+    # the user cache, writes queued for the group-commit writer (each call
+    # returns once its batch has committed).
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.cache = get_user_cache(pool)
+        self.writes = get_writer(pool)
+
+    def _read(self, fn, *args):
+        conn = self.pool.connection()
+        try:
+            return fn(conn, *args)
+        finally:
+            conn.close()
+
+    # -- single users --
+    def get(self, user_id):
+        return self.cache.get(user_id)
+
+    def find_email(self, email):
+        # The duplicate check before a sign-up or email change, so straight
+        # from the table: the user cache can be USER_CACHE_CHECK behind other
+        # processes' writes, and a stale hit would turn away an email that
+        # was just freed. It is one lookup on the unique index either way.
+        return self._read(_by_email, email)
+
+    def create(self, email, password):
+        return self.writes.submit(_insert, email, password).result()
+
+    def update(self, user_id, email, password=None):
+        return self.writes.submit(_update, user_id, email, password).result()
+
+    def delete(self, user_id):
+        return self.writes.execute("DELETE FROM users WHERE id = ?", (user_id,))
+
+    async def acreate(self, email, password):
+        return await self.writes.asubmit(_insert, email, password)
+
+    async def aupdate(self, user_id, email, password=None):
+        return await self.writes.asubmit(_update, user_id, email, password)
+
+    async def adelete(self, user_id):
+        return await self.writes.aexecute("DELETE FROM users WHERE id = ?", (user_id,))
+
+    # -- listings --
+    def page(self, limit, after=None, before=None, descending=False):
+        return self._read(fetch_page, limit, after, before, descending)
+
+    def search(self, q, limit, after=None, before=None, descending=False, prefix=False):
+        return self._read(search_users, q, limit, after, before, descending, prefix)
+
+    def ranked(self, q, limit):
+        return self._read(ranked_search, q, limit)
+
+    def stream(self, after=None, q="", prefix=False, descending=False):
+        clause = self._read(search_clause, q, prefix) if q else {}
+        return stream_users(self.pool, after, descending, **clause)
+
+    def count(self):
+        return self._read(user_count)
+
+    def version(self):
+        return self._read(users_version)
+
+    def change_seq(self):
+        return self._read(current_seq)
+
+    # -- bulk --
+    def bulk_delete(self, selector, dry_run=False):
+        return self._read(bulk_delete, selector, dry_run)
+
+    def bulk_update(self, selector, changes, dry_run=False):
+        return self._read(bulk_update, selector, changes, dry_run)
+
+    def stats(self):
+        return {"engine": "sqlite", "users": self.count(), "pool": self.pool.stats()}
+
+
+# ---------- MEMORY ----------
+class MemoryBackend:
+    # Users in dicts, with the ids kept sorted for keyset pages and
+    # (normalized email, id) pairs kept sorted for suggestions, behind one
+    # lock. Same cursors, uniqueness and id rules as SQLite (AUTOINCREMENT:
+    # ids are never reused), but nothing is written anywhere. Search scans
+    # from the cursor like the LIKE fallback does.
+    pool = None
+
+    def __init__(self):
+        self._users = {}      # id -> (email, password)
+        self._emails = {}     # email -> id
+        self._ids = []        # sorted
+        self._keys = []       # sorted (normalize(email), id)
+        self._next = 1
+        # a fresh instance must not answer an old ETag with 304
+        self._version = time.time_ns()
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        # (id, email, password) rows, e.g. straight out of a users table:
+        # collected in one pass and sorted once, so a large seed is
+        # O(n log n). A taken id or email fails the load before anything
+        # is added, like the INSERT would.
+        with self._lock:
+            users, emails = {}, {}
+            for uid, email, password in rows:
+                if uid in users or uid in self._users:
+                    raise sqlite3.IntegrityError("UNIQUE constraint failed: users.id")
+                if email in emails or email in self._emails:
+                    raise DuplicateEmail("UNIQUE constraint failed: users.email")
+                users[uid] = (email, password)
+                emails[email] = uid
+            if not users:
+                return self
+            self._users.update(users)
+            self._emails.update(emails)
+            self._ids = sorted(self._users)
+            self._keys = sorted(self._keys + [(normalize(e), uid) for e, uid in emails.items()])
+            self._next = max(self._next, self._ids[-1] + 1)
+            self._version += 1
+        return self
+
+    def _put(self, uid, email, password):
+        self._users[uid] = (email, password)
+        self._emails[email] = uid
+        bisect.insort(self._keys, (normalize(email), uid))
+
+    def _drop(self, uid):
+        email, _ = self._users.pop(uid)
+        del self._emails[email]
+        del self._keys[bisect.bisect_left(self._keys, (normalize(email), uid))]
+        return email
+
+    # -- single users --
+    def get(self, user_id):
+        with self._lock:
+            row = self._users.get(user_id)
+        return (user_id, row[0]) if row else None
+
+    def find_email(self, email):
+        with self._lock:
+            uid = self._emails.get(email)
+        return (uid, email) if uid is not None else None
+
+    def create(self, email, password):
+        with self._lock:
+            if email in self._emails:
+                raise DuplicateEmail("UNIQUE constraint failed: users.email")
+            uid = self._next
+            self._next += 1
+            self._put(uid, email, password)
+            self._ids.append(uid)   # always the largest
+            self._version += 1
+        return uid
+
+    def update(self, user_id, email, password=None):
+        with self._lock:
+            row = self._users.get(user_id)
+            if row is None:
+                return 0
+            owner = self._emails.get(email)
+            if owner is not None and owner != user_id:
+                raise DuplicateEmail("UNIQUE constraint failed: users.email")
+            self._drop(user_id)
+            self._put(user_id, email, row[1] if password is None else password)
+            self._version += 1
+        return 1
+
+    def delete(self, user_id):
+        with self._lock:
+            return self._delete(user_id)
+
+    # nothing here blocks for longer than the lock is held
+    async def acreate(self, email, password):
+        return self.create(email, password)
+
+    async def aupdate(self, user_id, email, password=None):
+        return self.update(user_id, email, password)
+
+    async def adelete(self, user_id):
+        return self.delete(user_id)
+
+    def _delete(self, user_id):
+        if user_id not in self._users:
+            return 0
+        self._drop(user_id)
+        del self._ids[bisect.bisect_left(self._ids, user_id)]
+        self._version += 1
+        return 1
+
+    # -- listings --
+    def _scan(self, bound, upward, match, n):
+        # up to n matching rows strictly past `bound` (None: from the end)
+        ids, users = self._ids, self._users
+        if upward:
+            start = 0 if bound is None else bisect.bisect_right(ids, bound)
+            positions = range(start, len(ids))
+        else:
+            start = len(ids) if bound is None else bisect.bisect_left(ids, bound)
+            positions = range(start - 1, -1, -1)
+        rows = []
+        for i in positions:
+            uid = ids[i]
+            email = users[uid][0]
+            if match is None or match(email):
+                rows.append((uid, email))
+                if len(rows) == n:
+                    break
+        return rows
+
+    def _page(self, limit, after, before, descending, match=None):
+        # the Page fetch_page would return for the same rows in SQLite
+        limit = clamp_limit(limit)
+        with self._lock:
+            if before is not None:
+                rows = self._scan(before, descending, match, limit + 1)
+            else:
+                rows = self._scan(after, not descending, match, limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not rows:
+            return Page([], None, None)
+        if before is not None:
+            rows.reverse()
+            return Page(rows, rows[-1][0], rows[0][0] if has_more else None)
+        return Page(rows, rows[-1][0] if has_more else None,
+                    rows[0][0] if after is not None else None)
+
+    @staticmethod
+    def _matcher(q, prefix):
+        q = q.lower()
+        if prefix:
+            return lambda email: email.lower().startswith(q)
+        return lambda email: q in email.lower()
+
+    def page(self, limit, after=None, before=None, descending=False):
+        return self._page(limit, after, before, descending)
+
+    def search(self, q, limit, after=None, before=None, descending=False, prefix=False):
+        return self._page(limit, after, before, descending, self._matcher(q, prefix))
+
+    def ranked(self, q, limit):
+        # no bm25 here: shortest matching email first, which is what it
+        # mostly comes down to for one phrase over short strings
+        limit = clamp_limit(limit)
+        if len(q) < MIN_INDEXED_LEN:
+            return self.search(q, limit)
+        match = self._matcher(q, False)
+        with self._lock:
+            rows = [(uid, row[0]) for uid, row in self._users.items() if match(row[0])]
+        rows.sort(key=lambda r: (len(r[1]), r[0]))
+        return Page(rows[:limit], None, None)
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        # same answers as SuggestIndex.suggest
+        prefix = normalize(prefix or "")
+        limit = max(1, min(int(limit or SUGGEST_LIMIT), MAX_SUGGEST_LIMIT))
+        out = []
+        with self._lock:
+            i = bisect.bisect_left(self._keys, (prefix,))
+            for key, uid in self._keys[i:i + limit]:
+                if not key.startswith(prefix):
+                    break
+                out.append({"id": uid, "email": self._users[uid][0]})
+        return out
+
+    def stream(self, after=None, q="", prefix=False, descending=False):
+        return stream_pages(self, after, q, prefix, descending)
+
+    def count(self):
+        with self._lock:
+            return len(self._users)
+
+    def version(self):
+        with self._lock:
+            return self._version
+
+    def change_seq(self):
+        return None
+
+    # -- bulk --
+    def _selected(self, selector):
+        kind, value = selector
+        if kind == "ids":
+            return [(uid, self._users[uid][0]) for uid in value if uid in self._users]
+        if kind == "id_range":
+            lo = bisect.bisect_left(self._ids, value[0])
+            hi = bisect.bisect_right(self._ids, value[1])
+            return [(uid, self._users[uid][0]) for uid in self._ids[lo:hi]]
+        return self._scan(None, True, self._matcher(value, False), len(self._ids) + 1)
+
+    def bulk_delete(self, selector, dry_run=False):
+        # all or nothing under the lock, like bulk.py's single transaction
+        with self._lock:
+            rows = self._selected(selector)
+            if not dry_run:
+                for uid, _ in rows:
+                    self._delete(uid)
+        return {"matched": len(rows), "affected": len(rows), "dry_run": dry_run,
+                "sample": [{"id": r[0], "email": r[1]} for r in rows[:SAMPLE_SIZE]]}
+
+    def bulk_update(self, selector, changes, dry_run=False):
+        # What bulk.bulk_update's UPDATE does, checked in full before
+        # anything changes: a new email someone else has fails the whole
+        # operation, dry run or not, like the rolled-back transaction.
+        with self._lock:
+            rows = self._selected(selector)
+            updates = {}
+            for uid, email in rows:
+                new = email
+                if changes.domain and email.lower().endswith(changes.domain[0]):
+                    new = email[:-len(changes.domain[0])] + changes.domain[1]
+                elif changes.password is None:
+                    continue   # only a domain swap, and not this user's domain
+                updates[uid] = new
+            # unique once every update is in: no two updated users end up
+            # with one email, and none takes one its holder keeps
+            clash = len(set(updates.values())) < len(updates)
+            for uid, new in updates.items():
+                owner = self._emails.get(new)
+                if owner is not None and owner != uid and updates.get(owner, new) == new:
+                    clash = True
+            if clash:
+                raise DuplicateEmail("UNIQUE constraint failed: users.email")
+            if not dry_run and updates:
+                for uid, new in updates.items():
+                    password = self._users[uid][1] if changes.password is None else changes.password
+                    self._drop(uid)
+                    self._put(uid, new, password)
+                self._version += 1
+        return {"matched": len(rows), "affected": len(updates), "dry_run": dry_run,
+                "sample": [{"id": r[0], "email": r[1]} for r in rows[:SAMPLE_SIZE]]}
+
+    def stats(self):
+        with self._lock:
+            return {"engine": "memory", "users": len(self._users), "entries": len(self._keys)}
+
+
+def read_users(path):
+    # (id, email, password) of every user in a SQLite file, opened read-only
+    uri = "file:" + urllib.request.pathname2url(os.path.abspath(path)) + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    try:
+        return conn.execute("SELECT id, email, password FROM users ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+# ---------- REGISTRY ----------
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_backend(path, storage=STORAGE):
+    # one per database file and engine per process
+    from shards import get_store   # shards.py builds on this module
+
+    key = (os.path.abspath(path), storage)
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            if storage == "memory":
+                backend = MemoryBackend()
+                if MEMORY_SEED:
+                    backend.load(read_users(MEMORY_SEED))
+            elif storage == "sqlite":
+                backend = get_store(path) or SQLiteBackend(get_pool(path))
+            else:
+                raise ValueError(f"unknown STORAGE {storage!r}: use sqlite or memory")
+            _backends[key] = backend
+        return backend
+
+
+def _after_fork():
+    global _backends_lock
+    _backends_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
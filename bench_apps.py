@@ -0,0 +1,380 @@
+import argparse
+import http.client
+import importlib
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from database import init_schema
+
+# ---------- APPS ----------
+FLASK_APPS = ["app1", "app2", "app3", "app4", "app5"]
+ASGI_APPS = ["app", "app6"]
+OPERATIONS = ["list", "search", "create", "update", "delete", "status"]
+
+
+# Each operation -> (method, path, json body or form dict) for iteration i,
+# left out where an app has no such endpoint. `n` is the seeded row count;
+# updates touch ids from the bottom, deletes from the top, so they never meet.
+def flask_routes(name):
+    routes = {
+        "list": lambda i, n: ("GET", "/api/users?limit=50", None),
+        "create": lambda i, n: ("POST", "/api/users",
+                                {"email": f"bench{i}@new.com", "password": "bench-pw"}),
+        "update": lambda i, n: ("PUT", f"/api/users/{i % n + 1}",
+                                {"email": f"updated{i}@example.com"}),
+        "delete": lambda i, n: ("DELETE", f"/api/users/{n - i}", None),
+    }
+    if name in ("app3", "app4", "app5"):
+        routes["search"] = lambda i, n: ("GET", f"/api/users?limit=50&search=user{i % 1000}", None)
+    return routes
+
+
+def app_routes():
+    return {
+        "list": lambda i, n: ("GET", "/users?limit=50", None),
+        "create": lambda i, n: ("POST", "/users",
+                                {"form": {"email": f"bench{i}@new.com", "password": "bench-pw"}}),
+        "delete": lambda i, n: ("POST", f"/delete/{n - i}", None),
+        "status": lambda i, n: ("GET", "/status", None),
+    }
+
+
+def app6_routes():
+    return {
+        "list": lambda i, n: ("GET", "/api/users?limit=50", None),
+        "create": lambda i, n: ("POST", "/api/users",
+                                {"email": f"bench{i}@new.com", "password": "bench-pw"}),
+        # app6 has no single-user PUT; its update path is bulk-update
+        "update": lambda i, n: ("POST", "/api/users/bulk-update",
+                                {"ids": [i % n + 1],
+                                 "replace_domain": {"from": "example.com", "to": f"x{i}.org"}}),
+        "delete": lambda i, n: ("DELETE", f"/api/users/{n - i}", None),
+        "status": lambda i, n: ("GET", "/api/status", None),
+    }
+
+
+def routes_for(name):
+    if name in FLASK_APPS:
+        return flask_routes(name)
+    return app_routes() if name == "app" else app6_routes()
+
+
+def load_app(name, workdir):
+    # the apps open "users.db" relative to the working directory at import
+    os.chdir(workdir)
+    if name == "app6":
+        return importlib.import_module("app6_api").api
+    return importlib.import_module(name).app
+
+
+# ---------- CLIENTS ----------
+class InProcessClient:
+    # Flask test client / Starlette TestClient: no sockets, no server
+    def __init__(self, name, app):
+        if name in FLASK_APPS:
+            self.client = app.test_client()
+        else:
+            from fastapi.testclient import TestClient
+            self.client = TestClient(app)
+
+    def request(self, method, path, body):
+        kwargs = {}
+        if isinstance(body, dict) and "form" in body:
+            kwargs["data"] = body["form"]
+        elif body is not None:
+            kwargs["json"] = body
+        if hasattr(self.client, "open"):   # Flask
+            response = self.client.open(path, method=method, **kwargs)
+        else:
+            response = self.client.request(method, path, follow_redirects=False, **kwargs)
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class SocketClient:
+    # keep-alive HTTP/1.1 over a real socket to a server thread
+    def __init__(self, host, port):
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+
+    def request(self, method, path, body):
+        headers = {}
+        payload = None
+        if isinstance(body, dict) and "form" in body:
+            payload = urlencode(body["form"])
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        self.conn.request(method, path, payload, headers)
+        response = self.conn.getresponse()
+        response.read()
+        return response.status
+
+    def close(self):
+        self.conn.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(name, app, port):
+    # -> stop(); Flask on werkzeug's threaded server, ASGI apps on uvicorn
+    if name in FLASK_APPS:
+        from werkzeug.serving import make_server
+        server = make_server("127.0.0.1", port, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server.shutdown
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port,
+                                           log_level="warning", access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+    return stop
+
+
+# ---------- MEASURE ----------
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+
+    def pct(q):
+        return round(latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000, 3)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": pct(0.50) if latencies else None,
+        "p95_ms": pct(0.95) if latencies else None,
+        "p99_ms": pct(0.99) if latencies else None,
+    }
+
+
+def run_operation(make_client, route, users, requests, concurrency, start=0):
+    # `requests` calls split over `concurrency` threads, each with its own
+    # client; iterations are numbered from `start` so runs never reuse ids
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    counter = iter(range(start, start + requests))
+
+    def worker():
+        client = make_client()
+        mine = []
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    break
+                method, path, body = route(i, users)
+                t0 = time.perf_counter()
+                status = client.request(method, path, body)
+                mine.append(time.perf_counter() - t0)
+                if status >= 400:
+                    with lock:
+                        errors[0] += 1
+        finally:
+            client.close()
+            with lock:
+                latencies.extend(mine)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def seed(path, users):
+    conn = sqlite3.connect(path)
+    init_schema(conn)
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, ?)",
+                     ((f"user{i}@example.com", "x") for i in range(users)))
+    conn.commit()
+    conn.close()
+
+
+def bench_app(name, workdir, args):
+    # runs in a process of its own (see bench): -> {op: summary or None}
+    app = load_app(name, workdir)
+    stop = None
+    if args.mode == "socket":
+        port = free_port()
+        stop = serve(name, app, port)
+        make_client = lambda: SocketClient("127.0.0.1", port)
+    else:
+        make_client = lambda: InProcessClient(name, app)
+    routes = routes_for(name)
+    results = {}
+    try:
+        for op in args.ops:
+            if op not in routes:
+                results[op] = None   # no such endpoint in this app
+                continue
+            warmup = min(args.warmup, args.users // 8)
+            run_operation(make_client, routes[op], args.users, warmup, 1)
+            requests = args.requests
+            if op in ("update", "delete"):
+                requests = min(requests, args.users // 4 - warmup)
+            results[op] = run_operation(
+                make_client, routes[op], args.users, requests, args.concurrency, warmup)
+            print(name, op, results[op], flush=True)
+    finally:
+        if stop is not None:
+            stop()
+    return results
+
+
+def bench_app_to_file(name, workdir, args, out):
+    from hashing import get_hasher
+    try:
+        results = bench_app(name, workdir, args)
+    finally:
+        # multiprocessing joins the scrypt workers on the way out, and they
+        # only stop once the hasher does
+        get_hasher().shutdown()
+    with open(out, "w") as f:
+        json.dump(results, f)
+
+
+def bench(args):
+    # Each app is imported in a fresh interpreter: apps loaded side by side
+    # would share the hasher, metrics and everything else kept per process,
+    # and each one's background threads would load the next one's run.
+    spawn = multiprocessing.get_context("spawn")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, "template.db")
+        seed(template, args.users)
+        print(f"seeded {args.users} users", flush=True)
+        for name in args.apps:
+            workdir = os.path.join(tmp, name)
+            os.makedirs(workdir)
+            shutil.copy(template, os.path.join(workdir, "users.db"))
+            out = os.path.join(tmp, f"{name}.json")
+            # not a Pool: its workers are daemons and may not start the
+            # apps' scrypt processes
+            proc = spawn.Process(target=bench_app_to_file, args=(name, workdir, args, out))
+            proc.start()
+            proc.join()
+            if proc.exitcode != 0:
+                raise RuntimeError(f"{name} benchmark exited with {proc.exitcode}")
+            with open(out) as f:
+                results[name] = json.load(f)
+    return results
+
+
+# ---------- COMPARE ----------
+def load_runs(path):
+    runs = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                run = json.loads(line)
+                if run.get("bench") == "apps":
+                    runs.append(run)
+    return runs
+
+
+def compare(base, new, threshold):
+    # -> list of regressions: throughput down or p95 up by more than `threshold`
+    regressions = []
+    for name, ops in new["results"].items():
+        for op, now in ops.items():
+            before = base["results"].get(name, {}).get(op)
+            if not now or not before:
+                continue
+            if before["rps"] and now["rps"] < before["rps"] * (1 - threshold):
+                regressions.append((name, op, "rps", before["rps"], now["rps"]))
+            if before["p95_ms"] and now["p95_ms"] > before["p95_ms"] * (1 + threshold):
+                regressions.append((name, op, "p95_ms", before["p95_ms"], now["p95_ms"]))
+    return regressions
+
+
+def report(base, new, threshold):
+    def setup(run):
+        return run["users"], run["mode"], run.get("storage", "sqlite")
+
+    if setup(base) != setup(new):
+        print(f"warning: comparing {'/'.join(map(str, setup(base)))} "
+              f"against {'/'.join(map(str, setup(new)))}")
+    regressions = compare(base, new, threshold)
+    for name, op, metric, before, now in regressions:
+        print(f"REGRESSION {name} {op} {metric}: {before} -> {now}")
+    if not regressions:
+        print(f"no regressions beyond {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark every app's endpoints in-process or over sockets")
+    ap.add_argument("--users", type=int, default=10_000, help="seeded rows (1k to 1M)")
+    ap.add_argument("--apps", default=",".join(FLASK_APPS + ASGI_APPS))
+    ap.add_argument("--ops", default=",".join(OPERATIONS))
+    ap.add_argument("--requests", type=int, default=200, help="calls per operation")
+    ap.add_argument("--warmup", type=int, default=20)
+    ap.add_argument("--mode", choices=("inprocess", "socket"), default="inprocess")
+    ap.add_argument("--concurrency", type=int, default=1, help="client threads per operation")
+    ap.add_argument("--scrypt-n", type=int, help="override SCRYPT_N (cheaper hashing for create)")
+    ap.add_argument("--storage", choices=("sqlite", "memory"), default="sqlite",
+                    help="memory: apps on backends.py serve from dicts, to time the HTTP layer alone")
+    ap.add_argument("--output", default="bench_output.txt", help="append JSON results to this file")
+    ap.add_argument("--compare", nargs="*", metavar="FILE",
+                    help="compare the last two app runs in --output, or the last run of "
+                         "BASE against NEW (one or two files); exits 1 on regressions")
+    ap.add_argument("--threshold", type=float, default=0.10)
+    args = ap.parse_args()
+
+    if args.compare is not None:
+        if len(args.compare) == 2:
+            base, new = load_runs(args.compare[0])[-1:], load_runs(args.compare[1])[-1:]
+            runs = base + new
+        else:
+            runs = load_runs(args.compare[0] if args.compare else args.output)[-2:]
+        if len(runs) < 2:
+            sys.exit("need two benchmark runs to compare")
+        sys.exit(report(runs[0], runs[1], args.threshold))
+
+    if args.scrypt_n:
+        # read by hashing.py at import, so it has to be set before the apps load
+        os.environ["SCRYPT_N"] = str(args.scrypt_n)
+    # same for backends.py; the in-memory engine starts from the seeded users
+    os.environ["STORAGE"] = args.storage
+    if args.storage == "memory":
+        os.environ["MEMORY_SEED"] = "users.db"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    args.apps = args.apps.split(",")
+    args.ops = args.ops.split(",")
+
+    results = {"bench": "apps", "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "users": args.users, "mode": args.mode, "storage": args.storage,
+               "concurrency": args.concurrency,
+               "requests": args.requests, "results": bench(args)}
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from async_db import AsyncDB
+from database import get_pool, init_schema
+from pagination import fetch_page
+
+# ---------- APPS ----------
+# The same two read endpoints as app.py/app6.py, once as plain `def`
+# handlers (Starlette's shared threadpool) and once as `async def` handlers
+# on the dedicated DB executor.
+def create_app():
+    from fastapi import FastAPI
+
+    kind = os.environ.get("BENCH_APP", "async")
+    pool = get_pool(os.environ["BENCH_DB"])
+    api = FastAPI()
+
+    def users_page(conn, limit, after):
+        return fetch_page(conn, limit, after, descending=True)
+
+    def first_user(conn):
+        return conn.execute("SELECT id, email FROM users ORDER BY id LIMIT 1").fetchone()
+
+    if kind == "sync":
+        @api.get("/users")
+        def users(limit: int = 50, after: Optional[int] = None):
+            conn = pool.connection()
+            try:
+                page = users_page(conn, limit, after)
+            finally:
+                conn.close()
+            return [{"id": r[0], "email": r[1]} for r in page.rows]
+
+        @api.get("/ping")
+        def ping():
+            conn = pool.connection()
+            try:
+                return {"first": first_user(conn)}
+            finally:
+                conn.close()
+    else:
+        adb = AsyncDB(pool)
+
+        @api.get("/users")
+        async def users(limit: int = 50, after: Optional[int] = None):
+            page = await adb.run(users_page, limit, after)
+            return [{"id": r[0], "email": r[1]} for r in page.rows]
+
+        @api.get("/ping")
+        async def ping():
+            return {"first": await adb.run(first_user)}
+
+    return api
+
+
+# ---------- LOAD ----------
+async def client(host, port, paths, deadline, latencies, errors):
+    # minimal keep-alive HTTP/1.1 client; far cheaper per request than a
+    # full HTTP library, so 1k clients do not saturate the load generator
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        errors.append("connect")
+        return
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            t0 = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - t0)
+            if not head.startswith(b"HTTP/1.1 200"):
+                errors.append(head.split(b"\r\n")[0].decode())
+    except (OSError, asyncio.IncompleteReadError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+
+
+async def load(host, port, paths, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        client(host, port, paths, deadline, latencies, errors) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def pct(q):
+        return round(latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000, 2)
+
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": pct(0.50) if latencies else None,
+        "p99_ms": pct(0.99) if latencies else None,
+    }
+
+
+# ---------- SERVER ----------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(kind, db, port, env):
+    env = dict(os.environ, BENCH_APP=kind, BENCH_DB=db, **env)
+    cmd = [sys.executable, "-m", "uvicorn", "bench_async:create_app", "--factory",
+           "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+           "--no-access-log", "--backlog", "4096"]
+    proc = subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    for _ in range(200):
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+def seed(path, users):
+    conn = sqlite3.connect(path)
+    init_schema(conn)
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, ?)",
+                     ((f"user{i}@example.com", "x") for i in range(users)))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="sync def vs async def + DB executor under load")
+    ap.add_argument("--users", type=int, default=100_000)
+    ap.add_argument("--concurrency", type=int, default=1000)
+    ap.add_argument("--duration", type=float, default=10)
+    ap.add_argument("--paths", default="/users?limit=50,/ping")
+    ap.add_argument("--db-workers", type=int, default=8)
+    ap.add_argument("--output", help="append JSON results to this file (e.g. bench_output.txt)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        seed(db, args.users)
+        env = {"DB_WORKERS": str(args.db_workers), "DB_POOL_SIZE": str(max(args.db_workers, 40))}
+        results = {"bench": "async", "users": args.users,
+                   "concurrency": args.concurrency, "db_workers": args.db_workers}
+        for kind in ("sync", "async"):
+            port = free_port()
+            proc = serve(kind, db, port, env)
+            try:
+                paths = args.paths.split(",")
+                asyncio.run(load("127.0.0.1", port, paths, 10, 1))   # warm-up
+                results[kind] = asyncio.run(
+                    load("127.0.0.1", port, paths, args.concurrency, args.duration))
+            finally:
+                proc.terminate()
+                proc.wait()
+            print(kind, results[kind], flush=True)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from database import init_schema
+from search import search_users
+
+# ---------- SEED ----------
+DOMAINS = ["gmail.com", "yahoo.com", "outlook.com", "example.org", "corp.io"]
+NAMES = ["ahmed", "sara", "john", "maria", "omar", "lina", "peter", "nour", "alex", "mona"]
+
+
+def seed(conn, users, batch=50_000):
+    rnd = random.Random(42)
+    cur = conn.cursor()
+    for start in range(0, users, batch):
+        rows = [
+            (f"{rnd.choice(NAMES)}.{i}{rnd.choice(NAMES)}@{rnd.choice(DOMAINS)}", "x")
+            for i in range(start, min(start + batch, users))
+        ]
+        cur.executemany("INSERT INTO users (email, password) VALUES (?, ?)", rows)
+        conn.commit()
+
+
+# ---------- QUERIES ----------
+def like_scan(conn, q, limit):
+    # the query app3-app5 used before the trigram index
+    cur = conn.cursor()
+    cur.execute("SELECT id, email FROM users WHERE LOWER(email) LIKE ?", ('%' + q + '%',))
+    return cur.fetchall()[:limit]
+
+
+def indexed(conn, q, limit):
+    return search_users(conn, q, limit).rows
+
+
+def indexed_prefix(conn, q, limit):
+    return search_users(conn, q, limit, prefix=True).rows
+
+
+def timeit(fn, conn, queries, limit, repeat):
+    samples = []
+    for _ in range(repeat):
+        for q in queries:
+            t0 = time.perf_counter()
+            fn(conn, q, limit)
+            samples.append((time.perf_counter() - t0) * 1e6)
+    samples.sort()
+    return {
+        "p50_us": round(statistics.median(samples), 1),
+        "p99_us": round(samples[int(len(samples) * 0.99) - 1], 1),
+        "mean_us": round(statistics.fmean(samples), 1),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare LIKE scan vs trigram index for ?search=")
+    ap.add_argument("--users", type=int, default=200_000)
+    ap.add_argument("--limit", type=int, default=100)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--db", help="reuse an existing seeded database instead of a temp one")
+    ap.add_argument("--output", help="append JSON results to this file (e.g. bench_output.txt)")
+    args = ap.parse_args()
+
+    tmp = None
+    path = args.db
+    if path is None:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, "bench.db")
+    conn = sqlite3.connect(path)
+    init_schema(conn)
+    if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
+        t0 = time.perf_counter()
+        seed(conn, args.users)
+        print(f"seeded {args.users} users in {time.perf_counter() - t0:.1f}s")
+
+    substrings = ["omar", "12345", "maria.99", "corp", "lina.5000", "nosuchthing"]
+    prefixes = ["sara.1", "peter.777", "alex.4242"]
+    results = {
+        "bench": "search",
+        "users": conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+        "limit": args.limit,
+        "like_scan": timeit(like_scan, conn, substrings, args.limit, args.repeat),
+        "trigram_substring": timeit(indexed, conn, substrings, args.limit, args.repeat),
+        "trigram_prefix": timeit(indexed_prefix, conn, prefixes, args.limit, args.repeat),
+    }
+    for q in substrings:
+        expected = conn.execute(
+            "SELECT id FROM users WHERE LOWER(email) LIKE ? ORDER BY id LIMIT ?",
+            ('%' + q + '%', args.limit)).fetchall()
+        assert [(r[0],) for r in indexed(conn, q, args.limit)] == expected, q
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(results) + "\n")
+    conn.close()
+    if tmp:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_async import free_port, load, seed
+from serve import APPS
+
+# ---------- WORKLOAD ----------
+# Read-only, so every worker count sees the same database: list pages at
+# varying cursors plus the status endpoint where the app has one.
+def paths_for(name, users, pages=200):
+    prefix = "" if name == "app" else "/api"
+    step = max(users // pages, 1)
+    paths = [f"{prefix}/users?limit=50&after={users - i * step}" for i in range(pages)]
+    if name in ("app", "app6"):
+        paths += [f"{prefix}/status"] * (pages // 10)
+    return paths
+
+
+def worker_counts(cpus):
+    counts = []
+    n = 1
+    while n < cpus:
+        counts.append(n)
+        n *= 2
+    return counts + [cpus]
+
+
+# ---------- SERVER ----------
+def start(name, workers, threads, workdir, port, env):
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py"),
+           name, "--workers", str(workers), "--threads", str(threads),
+           "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=workdir, env=dict(os.environ, **env))
+    # gunicorn listens before the workers have booted: wait for an answer
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{name} exited with {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", paths_for(name, 1)[0])
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{name} did not start")
+
+
+# ---------- LOAD ----------
+# Load comes from several processes, so a single client event loop is not
+# what tops out first once the server has more than one core.
+def client_process(args):
+    port, paths, concurrency, duration = args
+    return asyncio.run(load("127.0.0.1", port, paths, concurrency, duration))
+
+
+def run_load(port, paths, clients, concurrency, duration):
+    per_client = max(concurrency // clients, 1)
+    with multiprocessing.Pool(clients) as pool:
+        parts = pool.map(client_process, [(port, paths, per_client, duration)] * clients)
+    return {
+        "requests": sum(p["requests"] for p in parts),
+        "errors": sum(p["errors"] for p in parts),
+        "rps": round(sum(p["rps"] for p in parts), 1),
+        # per-client percentiles can't be merged exactly; report the worst
+        "p50_ms": max((p["p50_ms"] for p in parts if p["p50_ms"] is not None), default=None),
+        "p99_ms": max((p["p99_ms"] for p in parts if p["p99_ms"] is not None), default=None),
+    }
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    ap = argparse.ArgumentParser(description="Throughput of serve.py as the worker count grows")
+    ap.add_argument("--app", default="app1", choices=sorted(APPS))
+    ap.add_argument("--workers", default=",".join(map(str, worker_counts(cpus))),
+                    help="comma-separated worker counts (default: powers of two up to the cores)")
+    ap.add_argument("--threads", type=int, default=4, help="per worker (Flask apps)")
+    ap.add_argument("--users", type=int, default=100_000)
+    ap.add_argument("--clients", type=int, default=max(cpus // 2, 2), help="load-generating processes")
+    ap.add_argument("--concurrency", type=int, default=64, help="connections, over all clients")
+    ap.add_argument("--duration", type=float, default=10)
+    ap.add_argument("--cache", action="store_true", help="keep the result cache on")
+    ap.add_argument("--output", help="append JSON results to this file (e.g. bench_output.txt)")
+    args = ap.parse_args()
+
+    env = {"ACCESS_LOG": "", "SLOW_QUERY_MS": "0"}
+    if not args.cache:
+        # otherwise every worker answers the same few pages from memory
+        env["RESULT_CACHE_BYTES"] = "0"
+    results = {"bench": "serve", "app": args.app, "cpus": cpus, "users": args.users,
+               "clients": args.clients, "concurrency": args.concurrency,
+               "cache": args.cache, "runs": []}
+    paths = paths_for(args.app, args.users)
+    with tempfile.TemporaryDirectory() as tmp:
+        seed(os.path.join(tmp, "users.db"), args.users)
+        base = None
+        for workers in map(int, args.workers.split(",")):
+            port = free_port()
+            proc = start(args.app, workers, args.threads, tmp, port, env)
+            try:
+                run_load(port, paths, args.clients, args.clients, 1)   # warm-up
+                run = run_load(port, paths, args.clients, args.concurrency, args.duration)
+            finally:
+                proc.terminate()
+                proc.wait()
+            base = base or run["rps"] / workers
+            run.update(workers=workers, speedup=round(run["rps"] / (base or 1), 2),
+                       efficiency=round(run["rps"] / (base * workers or 1), 2))
+            results["runs"].append(run)
+            print(f"workers={workers:3d}  {run['rps']:9.1f} req/s  x{run['speedup']:<5}  "
+                  f"eff {run['efficiency']:.2f}  p99 {run['p99_ms']}ms  errors {run['errors']}",
+                  flush=True)
+
+    if cpus == 1:
+        print("only one core here: more workers can only share it", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from shards import ShardedStore, rebalance
+
+
+# ---------- LOAD ----------
+# Each process stands in for one server worker: its own store, pools and
+# group-commit writers, with `threads` request threads creating users. One
+# shard means every process's writer queues on the same file lock.
+def writer_process(args):
+    base, shards, threads, duration, proc = args
+    store = ShardedStore(base, shards)
+    deadline = time.perf_counter() + duration
+
+    def run(thread):
+        latencies = []
+        i = 0
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            store.create(f"p{proc}t{thread}n{i}@bench.com", "x")
+            latencies.append(time.perf_counter() - t0)
+            i += 1
+        return latencies
+
+    with ThreadPoolExecutor(threads) as pool:
+        return [x for part in pool.map(run, range(threads)) for x in part]
+
+
+def run(shards, procs, threads, duration, workdir):
+    base = os.path.join(workdir, f"bench{shards}.db")
+    rebalance(base, shards, log=lambda line: None)   # lays out empty shard files
+    with multiprocessing.Pool(procs) as pool:
+        parts = pool.map(writer_process, [(base, shards, threads, duration, p) for p in range(procs)])
+    latencies = sorted(x for part in parts for x in part)
+
+    def pct(q):
+        return round(latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000, 2)
+
+    store = ShardedStore(base, shards)
+    return {
+        "shards": shards,
+        "writes": len(latencies),
+        "writes_per_sec": round(len(latencies) / duration, 1),
+        "p50_ms": pct(0.50) if latencies else None,
+        "p99_ms": pct(0.99) if latencies else None,
+        "per_shard": store.stats()["per_shard"],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Insert throughput as users are spread over more SQLite files")
+    ap.add_argument("--shards", default="1,2,4,8", help="comma-separated shard counts")
+    ap.add_argument("--procs", type=int, default=4, help="writer processes (server workers)")
+    ap.add_argument("--threads", type=int, default=8, help="request threads per process")
+    ap.add_argument("--duration", type=float, default=5)
+    ap.add_argument("--output", help="append JSON results to this file (e.g. bench_output.txt)")
+    args = ap.parse_args()
+
+    results = {"bench": "shards", "cpus": os.cpu_count(), "procs": args.procs,
+               "threads": args.threads, "duration": args.duration, "runs": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        base = None
+        for shards in map(int, args.shards.split(",")):
+            result = run(shards, args.procs, args.threads, args.duration, tmp)
+            base = base or result["writes_per_sec"]
+            result["speedup"] = round(result["writes_per_sec"] / (base or 1), 2)
+            results["runs"].append(result)
+            print(f"shards={shards:3d}  {result['writes_per_sec']:9.1f} writes/s  x{result['speedup']:<5}  "
+                  f"p50 {result['p50_ms']}ms  p99 {result['p99_ms']}ms", flush=True)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+import asyncio
+import codecs
+import csv
+import io
+import json
+import os
+import time
+from collections import namedtuple
+
+from hashing import SCHEME, WRAPPED_SCHEME, is_legacy
+from pagination import fetch_page
+from search import search_users
+
+# ---------- SETTINGS ----------
+IMPORT_BATCH = int(os.environ.get("IMPORT_BATCH", "5000"))
+MAX_IMPORT_BATCH = 50_000
+
+CSV_TYPES = ("text/csv", "application/csv")
+
+
+def import_format(fmt, content_type):
+    fmt = (fmt or "").lower()
+    if fmt in ("csv", "jsonl", "ndjson"):
+        return "csv" if fmt == "csv" else "jsonl"
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    return "csv" if content_type in CSV_TYPES else "jsonl"
+
+
+def batch_size(value):
+    if not value:
+        return IMPORT_BATCH
+    return max(1, min(int(value), MAX_IMPORT_BATCH))
+
+
+def ndjson(event):
+    return json.dumps(event) + "\n"
+
+
+# ---------- PARSING ----------
+class RecordParser:
+    # Turns one line at a time into (line, email, password, password_hash)
+    # or an "invalid" event. CSV needs a header row naming the columns.
+
+    def __init__(self, fmt, lowercase=True):
+        self.fmt = fmt
+        self.lowercase = lowercase
+        self.header = None
+        self.line = 0
+
+    def feed(self, text):
+        self.line += 1
+        text = text.strip("\r\n")
+        if not text.strip():
+            return None
+        try:
+            if self.fmt == "csv":
+                fields = next(csv.reader([text]))
+                if self.header is None:
+                    self.header = [f.strip().lower() for f in fields]
+                    if "email" not in self.header:
+                        raise ValueError("CSV header must include an email column")
+                    return None
+                row = dict(zip(self.header, fields))
+            else:
+                row = json.loads(text)
+                if not isinstance(row, dict):
+                    raise ValueError("expected a JSON object")
+        except (ValueError, csv.Error) as e:
+            return self.invalid(None, str(e))
+
+        email = str(row.get("email") or "").strip()
+        password = row.get("password") or None
+        password_hash = row.get("password_hash") or None
+        if self.lowercase:
+            email = email.lower()
+        if "@" not in email:
+            return self.invalid(email, "invalid email")
+        if password is None and password_hash is None:
+            return self.invalid(email, "missing password")
+        if password_hash is not None and not _known_hash(str(password_hash)):
+            return self.invalid(email, "unsupported password_hash")
+        return (self.line, email, password and str(password), password_hash)
+
+    def invalid(self, email, error):
+        return {"line": self.line, "email": email, "status": "invalid", "error": error}
+
+
+def _known_hash(value):
+    return is_legacy(value) or value.split("$", 1)[0] in (SCHEME, WRAPPED_SCHEME)
+
+
+# ---------- BATCHES ----------
+def insert_batch(conn, rows):
+    # rows: [(line, email, hashed)] -> (inserted, [duplicate events]).
+    # The duplicate check and the INSERT share one IMMEDIATE transaction,
+    # so no other writer can slip the same email in between.
+    duplicates = []
+    seen = set()
+    fresh = []
+    for line, email, hashed in rows:
+        if email in seen:
+            duplicates.append({"line": line, "email": email, "status": "duplicate"})
+        else:
+            seen.add(email)
+            fresh.append((line, email, hashed))
+
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        existing = set()
+        emails = [email for _, email, _ in fresh]
+        for i in range(0, len(emails), 900):
+            chunk = emails[i:i + 900]
+            cur.execute(
+                f"SELECT email FROM users WHERE email IN ({','.join('?' * len(chunk))})", chunk)
+            existing.update(r[0] for r in cur.fetchall())
+        values = []
+        for line, email, hashed in fresh:
+            if email in existing:
+                duplicates.append({"line": line, "email": email, "status": "duplicate"})
+            else:
+                values.append((email, hashed))
+        cur.executemany("INSERT INTO users (email, password) VALUES (?, ?)", values)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    duplicates.sort(key=lambda d: d["line"])
+    return len(values), duplicates
+
+
+class ImportSummary:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counts = {"inserted": 0, "duplicate": 0, "invalid": 0, "batches": 0}
+
+    def add(self, inserted, events):
+        self.counts["inserted"] += inserted
+        self.counts["batches"] += 1
+        for event in events:
+            self.counts[event["status"]] += 1
+
+    def event(self):
+        seconds = time.perf_counter() - self.started
+        return {"summary": dict(self.counts, seconds=round(seconds, 3))}
+
+
+# ---------- SYNC (Flask) ----------
+def import_users(pool, lines, fmt, hasher, size=IMPORT_BATCH, lowercase=True, on_commit=None):
+    # Generator of NDJSON-able events: one per rejected row, one progress
+    # event per committed batch and a final summary. `lines` is consumed
+    # lazily, so the request body is never held in memory as a whole. A
+    # connection is checked out per batch insert only, and on_commit() runs
+    # after each batch is in (the apps wake their event hub with it).
+    parser = RecordParser(fmt, lowercase)
+    summary = ImportSummary()
+    pending = []
+
+    def flush():
+        # derive the batch's passwords in parallel, a window at a time so a
+        # large batch never overflows the hashing queue, then insert
+        rows = []
+        window = _window(hasher)
+        for i in range(0, len(pending), window):
+            futures = [(line, email, hasher.submit_hash(pw) if pw else h)
+                       for line, email, pw, h in pending[i:i + window]]
+            rows += [(line, email, h if isinstance(h, str) else h.result()[0])
+                     for line, email, h in futures]
+        pending.clear()
+        inserted, events = _insert_with_pool(pool, rows)
+        summary.add(inserted, events)
+        if on_commit is not None:
+            on_commit()
+        return events + [{"committed": summary.counts["inserted"], "line": parser.line}]
+
+    for text in lines:
+        record = parser.feed(text)
+        if record is None:
+            continue
+        if isinstance(record, dict):
+            summary.counts["invalid"] += 1
+            yield record
+            continue
+        pending.append(record)
+        if len(pending) >= size:
+            yield from flush()
+    if pending:
+        yield from flush()
+    yield summary.event()
+
+
+def text_lines(stream, encoding="utf-8"):
+    return io.TextIOWrapper(stream, encoding=encoding, newline="")
+
+
+# ---------- ASYNC (FastAPI) ----------
+async def aiter_lines(chunks, encoding="utf-8"):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def aimport_users(pool, chunks, fmt, hasher, run_sync, size=IMPORT_BATCH,
+                        lowercase=True, on_commit=None):
+    # Same events as import_users(). Hashes are awaited in parallel on the
+    # hashing pool and each batch insert is handed to `run_sync` (the
+    # threadpool), so the event loop never blocks on scrypt or SQLite.
+    parser = RecordParser(fmt, lowercase)
+    summary = ImportSummary()
+    pending = []
+
+    async def flush():
+        hashes = []
+        window = _window(hasher)
+        for i in range(0, len(pending), window):
+            hashes += await asyncio.gather(*[
+                hasher.hash_async(pw) if pw else _ready(h) for _, _, pw, h in pending[i:i + window]])
+        rows = [(line, email, hashed) for (line, email, _, _), hashed in zip(pending, hashes)]
+        pending.clear()
+        inserted, events = await run_sync(_insert_with_pool, pool, rows)
+        summary.add(inserted, events)
+        if on_commit is not None:
+            on_commit()
+        return events + [{"committed": summary.counts["inserted"], "line": parser.line}]
+
+    async for text in aiter_lines(chunks):
+        record = parser.feed(text)
+        if record is None:
+            continue
+        if isinstance(record, dict):
+            summary.counts["invalid"] += 1
+            yield record
+            continue
+        pending.append(record)
+        if len(pending) >= size:
+            for event in await flush():
+                yield event
+    if pending:
+        for event in await flush():
+            yield event
+    yield summary.event()
+
+
+def _window(hasher):
+    # leave half of the hashing queue to regular sign-ups
+    return max(1, hasher.max_pending // 2)
+
+
+async def _ready(value):
+    return value
+
+
+def _insert_with_pool(pool, rows):
+    conn = pool.connection()
+    try:
+        return insert_batch(conn, rows)
+    finally:
+        conn.close()
+
+
+def import_response(events):
+    # The report of an ASGI import, streamed while the body is still being
+    # read. Starlette's StreamingResponse also waits on the receive channel
+    # for a disconnect (under ASGI servers older than spec 2.4, uvicorn
+    # included), which would take the body's chunks from under
+    # request.stream(); this one only sends. A client that goes away is
+    # noticed by the body read.
+    from fastapi.responses import StreamingResponse
+
+    class ImportResponse(StreamingResponse):
+        async def __call__(self, scope, receive, send):
+            await self.stream_response(send)
+
+    async def lines():
+        async for event in events:
+            yield ndjson(event)
+
+    return ImportResponse(lines(), media_type="application/x-ndjson")
+
+
+# ---------- BULK DELETE / UPDATE ----------
+BULK_CHUNK = int(os.environ.get("BULK_CHUNK", "500"))
+SAMPLE_SIZE = 20
+
+
+def parse_selector(body):
+    # exactly one of {"ids": [...]}, {"id_range": [first, last]}, {"search": "..."}
+    if not isinstance(body, dict):
+        raise ValueError("the body must be a JSON object")
+    keys = [k for k in ("ids", "id_range", "search") if body.get(k) not in (None, "", [])]
+    if len(keys) != 1:
+        raise ValueError("give exactly one of ids, id_range or search")
+    key = keys[0]
+    value = body[key]
+    if key in ("ids", "id_range") and not isinstance(value, list):
+        raise ValueError(f"{key} must be a list")
+    if key == "ids":
+        return key, sorted({int(i) for i in value})
+    if key == "id_range":
+        first, last = (int(v) for v in value)
+        if first > last:
+            raise ValueError("id_range must be [first, last] with first <= last")
+        return key, (first, last)
+    return key, str(value)
+
+
+def iter_selected(conn, selector, chunk=BULK_CHUNK):
+    # Yields lists of (id, email) in id order, one keyset page at a time,
+    # re-querying after every chunk so rows changed in between are skipped
+    # rather than invalidating an open cursor.
+    kind, value = selector
+    if kind == "ids":
+        cur = conn.cursor()
+        for i in range(0, len(value), chunk):
+            ids = value[i:i + chunk]
+            cur.execute(f"SELECT id, email FROM users WHERE id IN ({','.join('?' * len(ids))})"
+                        " ORDER BY id", ids)
+            rows = cur.fetchall()
+            if rows:
+                yield rows
+        return
+    after = None
+    while True:
+        if kind == "id_range":
+            page = fetch_page(conn, chunk, after, where="id BETWEEN ? AND ?", params=value)
+        else:
+            page = search_users(conn, value, chunk, after)
+        if page.rows:
+            yield page.rows
+        if page.next_after is None:
+            return
+        after = page.next_after
+
+
+def _apply(conn, selector, dry_run, chunk, change):
+    # One IMMEDIATE transaction for the whole operation, applied chunk by
+    # chunk. A dry run does the same work and rolls back, so the counts (and
+    # any unique-email conflict) are exactly what a real run would produce.
+    result = {"matched": 0, "affected": 0, "dry_run": dry_run, "sample": []}
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        for rows in iter_selected(conn, selector, chunk):
+            result["matched"] += len(rows)
+            room = SAMPLE_SIZE - len(result["sample"])
+            result["sample"] += [{"id": r[0], "email": r[1]} for r in rows[:room]]
+            result["affected"] += change(cur, [r[0] for r in rows])
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+
+def bulk_delete(conn, selector, dry_run=False, chunk=BULK_CHUNK):
+    def change(cur, ids):
+        cur.execute(f"DELETE FROM users WHERE id IN ({','.join('?' * len(ids))})", ids)
+        return cur.rowcount
+    return _apply(conn, selector, dry_run, chunk, change)
+
+
+# The SQL bulk_update runs (SET clause and params, extra WHERE condition and
+# params), plus the same change spelled out for engines without SQL: the new
+# password hash, and ("@old.com", "@new.com") for a domain swap, or None.
+Changes = namedtuple("Changes", "sets params where where_params password domain")
+
+
+def parse_changes(body, hasher, dry_run=False):
+    # "set": {"password": ...} | {"password_hash": ...}
+    # "replace_domain": {"from": "old.com", "to": "new.com"}
+    # -> Changes
+    changes = body.get("set") or {}
+    domain = body.get("replace_domain")
+    if not isinstance(changes, dict):
+        raise ValueError("set must be an object")
+    if domain and not isinstance(domain, dict):
+        raise ValueError('replace_domain must be {"from": ..., "to": ...}')
+    sets, params = [], []
+    where, where_params = "", ()
+    password = swap = None
+    if changes.get("password"):
+        # one derivation for the whole request: every selected user gets the
+        # same (salted) hash, which is what setting a shared password means
+        sets.append("password = ?")
+        password = "dry-run" if dry_run else hasher.hash(str(changes["password"]))
+        params.append(password)
+    elif changes.get("password_hash"):
+        if not _known_hash(str(changes["password_hash"])):
+            raise ValueError("unsupported password_hash")
+        password = str(changes["password_hash"])
+        sets.append("password = ?")
+        params.append(password)
+    if domain:
+        old, new = "@" + str(domain["from"]).lower(), "@" + str(domain["to"]).lower()
+        swap = (old, new)
+        match = "LOWER(substr(email, -?)) = ?"
+        sets.append(f"email = CASE WHEN {match} "
+                    "THEN substr(email, 1, length(email) - ?) || ? ELSE email END")
+        params += [len(old), old, len(old), new]
+        if not sets[0].startswith("password"):
+            where, where_params = match, (len(old), old)
+    if not sets:
+        raise ValueError("nothing to update: give set.password, set.password_hash or replace_domain")
+    return Changes(", ".join(sets), tuple(params), where, where_params, password, swap)
+
+
+def bulk_update(conn, selector, changes, dry_run=False, chunk=BULK_CHUNK):
+    sets, params, where, where_params, _, _ = changes
+
+    def change(cur, ids):
+        sql = f"UPDATE users SET {sets} WHERE id IN ({','.join('?' * len(ids))})"
+        if where:
+            sql += f" AND {where}"
+        cur.execute(sql, (*params, *ids, *where_params))
+        return cur.rowcount
+    return _apply(conn, selector, dry_run, chunk, change)
@@ -0,0 +1,41 @@
+import os
+
+# ---------- SETTINGS ----------
+CHANGES_LIMIT = int(os.environ.get("CHANGES_LIMIT", "1000"))
+
+
+# ---------- FEED ----------
+def current_seq(conn):
+    # highest sequence number ever handed out, even if trimmed since
+    cur = conn.cursor()
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'user_changes'")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def changes_since(conn, since, limit=CHANGES_LIMIT):
+    # -> {"changes": [...], "next": seq to ask from next time,
+    #     "more": another page is waiting, "reset": the log no longer reaches
+    #     back to `since`, so the client has to reload the full listing}
+    limit = max(1, min(int(limit or CHANGES_LIMIT), CHANGES_LIMIT))
+    cur = conn.cursor()
+    if since is None:
+        return {"changes": [], "next": current_seq(conn), "more": False, "reset": False}
+
+    cur.execute("SELECT MIN(seq) FROM user_changes")
+    first = cur.fetchone()[0]
+    latest = current_seq(conn)
+    if since > latest or since < (first - 1 if first is not None else latest):
+        return {"changes": [], "next": latest, "more": False, "reset": True}
+
+    cur.execute("SELECT seq, op, user_id, email FROM user_changes "
+                "WHERE seq > ? ORDER BY seq LIMIT ?", (since, limit + 1))
+    rows = cur.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "changes": [{"seq": r[0], "op": r[1], "id": r[2], "email": r[3]} for r in rows],
+        "next": rows[-1][0] if rows else since,
+        "more": more,
+        "reset": False,
+    }
@@ -0,0 +1,98 @@
+import logging
+import os
+import threading
+import time
+
+# ---------- SETTINGS ----------
+RECONCILE_INTERVAL = float(os.environ.get("COUNT_RECONCILE_INTERVAL", "3600"))
+
+log = logging.getLogger(__name__)
+
+
+# ---------- READ ----------
+def user_count(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT value FROM user_counters WHERE name = 'users'")
+    row = cur.fetchone()
+    if row is None:
+        # schema not initialised by a current app yet
+        cur.execute("SELECT COUNT(*) FROM users")
+        row = cur.fetchone()
+    return row[0]
+
+
+def users_version(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT value FROM user_counters WHERE name = 'version'")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+# ---------- RECONCILE ----------
+def reconcile_user_count(conn):
+    # Recount under a write lock and fix the stored value. The triggers
+    # keep it exact; this only catches writes made with the triggers
+    # missing (older app versions, manual edits). -> (stored, actual)
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute("SELECT value FROM user_counters WHERE name = 'users'")
+        row = cur.fetchone()
+        stored = row[0] if row else None
+        cur.execute("SELECT COUNT(*) FROM users")
+        actual = cur.fetchone()[0]
+        if stored != actual:
+            cur.execute("INSERT OR REPLACE INTO user_counters (name, value) VALUES ('users', ?)",
+                        (actual,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return stored, actual
+
+
+_reconcilers = {}
+_reconcilers_lock = threading.Lock()
+
+def start_reconciler(pool, interval=RECONCILE_INTERVAL):
+    # one background thread per database per process; safe to call on
+    # every import (Streamlit re-runs app6.py on each interaction)
+    if interval <= 0:
+        return None
+    with _reconcilers_lock:
+        thread = _reconcilers.get(pool.path)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=_reconcile_forever, args=(pool, interval),
+                                      name="count-reconciler", daemon=True)
+            _reconcilers[pool.path] = thread
+            thread.start()
+        return thread
+
+
+def _reconcile_forever(pool, interval):
+    while True:
+        time.sleep(interval)
+        # nothing may escape: an exception here would end the thread for
+        # the rest of the process
+        conn = None
+        try:
+            conn = pool.connection()
+            reconcile_user_count(conn)
+        except Exception as e:
+            # locked, busy or no free connection: try again next round
+            log.warning("user count reconcile of %s failed: %s", pool.path, e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sqlite3
+
+    ap = argparse.ArgumentParser(description="Recount users and fix the stored counter")
+    ap.add_argument("db", nargs="?", default="users.db")
+    args = ap.parse_args()
+    conn = sqlite3.connect(args.db)
+    stored, actual = reconcile_user_count(conn)
+    print(f"stored={stored} actual={actual}" + ("" if stored == actual else " (fixed)"))
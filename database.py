@@ -0,0 +1,425 @@
+import os
+import sqlite3
+import threading
+import time
+
+import slowlog
+from metrics import observe_sql
+
+# ---------- SETTINGS ----------
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+CHANGE_LOG_RETENTION = int(os.environ.get("CHANGE_LOG_RETENTION", "100000"))
+
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", 5000),
+    ("mmap_size", 256 * 1024 * 1024),
+    ("cache_size", -16000),   # negative = KiB, so ~16MB per connection
+    ("temp_store", "MEMORY"),
+)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# ---------- CONNECTION ----------
+class TimedCursor(sqlite3.Cursor):
+    # execute() time per statement type for /metrics (see metrics.py). With
+    # the slow-query log on, it also follows each statement through its
+    # fetches to get the full time and row count (see slowlog.py).
+    _query = None
+
+    def execute(self, sql, params=()):
+        self._finish()
+        query = slowlog.start(self.connection, sql, params)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._executed(query, sql, time.perf_counter() - t0)
+
+    def executemany(self, sql, seq):
+        self._finish()
+        query = slowlog.start(self.connection, sql, None)
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            self._executed(query, sql, time.perf_counter() - t0)
+
+    def _executed(self, query, sql, elapsed):
+        observe_sql(sql, elapsed)
+        if query is not None:
+            query.add(elapsed, 0)
+            if self.description is None:   # no result rows to wait for
+                query.finish(max(self.rowcount, 0))
+            else:
+                self._query = query
+
+    def _fetched(self, t0, rows, done):
+        self._query.add(time.perf_counter() - t0, rows)
+        if done:
+            self._finish()
+
+    def _finish(self):
+        query, self._query = self._query, None
+        if query is not None:
+            query.finish()
+
+    def fetchone(self):
+        if self._query is None:
+            return super().fetchone()
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(t0, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        if self._query is None:
+            return super().fetchmany(size)
+        t0 = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(t0, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        if self._query is None:
+            return super().fetchall()
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(t0, len(rows), True)
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class TimedConnection(sqlite3.Connection):
+    # conn.execute() builds its cursor internally, so route it through ours
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+
+class PooledConnection:
+    # Behaves like a sqlite3.Connection, but close() hands it back to the pool
+    # so existing `conn = get_db() ... conn.close()` code keeps working.
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._pid = os.getpid()
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed connection.")
+        return getattr(self._raw, name)
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is None:
+            return
+        if self._pid == os.getpid():
+            self._pool._release(raw)
+        else:
+            # a checkout inherited through fork() belongs to the parent
+            _inherited.append(raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._raw is not None:
+            if exc_type is None:
+                self._raw.commit()
+            else:
+                self._raw.rollback()
+        self.close()
+        return False
+
+    def __del__(self):
+        # a handler that forgot close() must not leak a pool slot forever
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+# ---------- POOL ----------
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT, pragmas=PRAGMAS):
+        # absolute: the writer, caches and hubs are keyed by it, and a later
+        # chdir must not point the pool (or them) at another file
+        self.path = os.path.abspath(path)
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self._idle = []          # LIFO: the most recently used connection has the warmest cache
+        self._created = 0
+        self._in_use = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {"checkouts": 0, "waits": 0, "wait_time": 0.0, "timeouts": 0}
+
+    def _connect(self):
+        raw = sqlite3.connect(self.path, check_same_thread=False, timeout=self.timeout,
+                              factory=TimedConnection)
+        slowlog.attach(raw, self.path)
+        for name, value in self.pragmas:
+            raw.execute(f"PRAGMA {name}={value}")
+        return raw
+
+    def dedicated(self):
+        # a connection outside the pool's slots, for a thread that keeps one
+        # for its whole life (the group-commit writer); the caller closes it
+        return self._connect()
+
+    def connection(self):
+        deadline = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    raw = None
+                    break
+                if deadline is None:
+                    deadline = time.monotonic() + self.timeout
+                    started = time.monotonic()
+                    self._stats["waits"] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"no free connection to {self.path} after {self.timeout}s")
+                self._cond.wait(remaining)
+            if deadline is not None:
+                self._stats["wait_time"] += time.monotonic() - started
+            self._stats["checkouts"] += 1
+            self._in_use += 1
+
+        if raw is None:
+            try:
+                raw = self._connect()
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+        return PooledConnection(self, raw)
+
+    def _release(self, raw):
+        try:
+            if raw.in_transaction:
+                raw.rollback()
+        except sqlite3.Error:
+            # broken connection: drop it and let the next checkout open a fresh one
+            raw.close()
+            raw = None
+        with self._cond:
+            self._in_use -= 1
+            if raw is None:
+                self._created -= 1
+            else:
+                self._idle.append(raw)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self._stats,
+                size=self.size,
+                created=self._created,
+                in_use=self._in_use,
+                idle=len(self._idle),
+            )
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for raw in idle:
+            raw.close()
+
+    def _after_fork(self):
+        # SQLite connections must not cross fork(): the child opens its own
+        # on first use and keeps the parent's referenced, so they are never
+        # closed (and their files never touched) from this process
+        _inherited.extend(self._idle)
+        self._idle = []
+        self._created = 0
+        self._in_use = 0
+        self._cond = threading.Condition(threading.Lock())
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(path="users.db"):
+    key = os.path.abspath(path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(key)
+        return pool
+
+
+_inherited = []
+
+def _after_fork():
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    for pool in _pools.values():
+        pool._after_fork()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+# ---------- SCHEMA ----------
+def init_schema(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL
+    )
+    """)
+
+    # older databases were created without the password column
+    cur.execute("PRAGMA table_info(users)")
+    columns = [c[1] for c in cur.fetchall()]
+    if 'password' not in columns:
+        cur.execute("ALTER TABLE users ADD COLUMN password TEXT NOT NULL DEFAULT ''")
+
+    init_search_index(cur)
+    init_counters(cur)
+    init_change_log(cur)
+    conn.commit()
+
+
+def init_counters(cur):
+    # Row count kept by triggers in the same transaction as every insert
+    # and delete, so reading it is O(1) and still exact.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS user_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_count_ai AFTER INSERT ON users BEGIN
+        UPDATE user_counters SET value = value + 1 WHERE name = 'users';
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_count_ad AFTER DELETE ON users BEGIN
+        UPDATE user_counters SET value = value - 1 WHERE name = 'users';
+    END
+    """)
+    cur.execute("""
+    INSERT OR IGNORE INTO user_counters (name, value)
+    VALUES ('users', (SELECT COUNT(*) FROM users))
+    """)
+
+    # 'version' moves on every committed change to users; it is what the
+    # listing ETags are made from
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS users_version_{event[0].lower()} AFTER {event} ON users BEGIN
+            UPDATE user_counters SET value = value + 1 WHERE name = 'version';
+        END
+        """)
+    # start from the clock, so a re-created database never reuses the
+    # versions (and ETags) handed out by the one it replaced
+    cur.execute("INSERT OR IGNORE INTO user_counters (name, value) VALUES ('version', ?)",
+                (time.time_ns() // 1000,))
+
+
+def init_search_index(cur):
+    # Trigram FTS5 index over users.email (external content, so emails are
+    # not stored twice). Needs SQLite >= 3.34; older builds simply keep
+    # using the LIKE scan in search.py.
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name='users_fts'")
+    if cur.fetchone():
+        return
+    try:
+        cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            email, content='users', content_rowid='id', tokenize='trigram'
+        )
+        """)
+    except sqlite3.OperationalError:
+        return
+    cur.executescript("""
+    CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, email) VALUES (new.id, new.email);
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, email) VALUES ('delete', old.id, old.email);
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF email ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, email) VALUES ('delete', old.id, old.email);
+        INSERT INTO users_fts(rowid, email) VALUES (new.id, new.email);
+    END;
+    INSERT INTO users_fts(users_fts) VALUES ('rebuild');
+    """)
+
+
+def init_change_log(cur):
+    # Append-only feed of email-visible changes for /api/users/changes.
+    # Written by triggers, so every write path (single, bulk, other apps)
+    # lands in it; every 1000th entry trims the log to the retention window.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS user_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        op TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        email TEXT
+    )
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_changes_ai AFTER INSERT ON users BEGIN
+        INSERT INTO user_changes (op, user_id, email) VALUES ('insert', new.id, new.email);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_changes_au AFTER UPDATE OF email ON users
+    WHEN new.email IS NOT old.email BEGIN
+        INSERT INTO user_changes (op, user_id, email) VALUES ('update', new.id, new.email);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS users_changes_ad AFTER DELETE ON users BEGIN
+        INSERT INTO user_changes (op, user_id, email) VALUES ('delete', old.id, NULL);
+    END
+    """)
+    cur.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS user_changes_trim AFTER INSERT ON user_changes
+    WHEN new.seq % 1000 = 0 BEGIN
+        DELETE FROM user_changes WHERE seq <= new.seq - {int(CHANGE_LOG_RETENTION)};
+    END
+    """)
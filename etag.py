@@ -0,0 +1,26 @@
+# ---------- ETAGS ----------
+# Listing ETags come from the users change version (see counters.py), so a
+# matching If-None-Match is answered without running the listing query.
+
+def make_etag(version):
+    return f'W/"users-{version}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison: W/"x" and "x" are the same validator
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == wanted:
+            return True
+    return False
+
+
+def etag_headers(etag):
+    # no-cache lets browsers keep the body but revalidate it every time,
+    # which is what makes a plain fetch() send If-None-Match
+    return {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
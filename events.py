@@ -0,0 +1,321 @@
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+
+from changes import CHANGES_LIMIT, changes_since, current_seq
+
+# ---------- SETTINGS ----------
+EVENT_BUFFER = int(os.environ.get("EVENT_BUFFER", "256"))           # events per client
+EVENT_POLL_INTERVAL = float(os.environ.get("EVENT_POLL_INTERVAL", "1.0"))
+EVENT_KEEPALIVE = float(os.environ.get("EVENT_KEEPALIVE", "15"))
+# A blocking stream (sse_stream, the Flask apps) holds a server thread for as
+# long as its client stays connected; past this many per process the next
+# one is turned away (StreamsFull) so the rest of the API keeps its threads.
+# serve.py sets it to half of each worker's threads. asyncio streams and the
+# hub's other subscribers (the suggest index) hold no request thread and are
+# not counted. A client that goes away keeps its slot until a keepalive
+# write fails, which can take two EVENT_KEEPALIVE intervals.
+SSE_MAX_STREAMS = int(os.environ.get("SSE_MAX_STREAMS", "4"))
+SSE_BUSY_RETRY = int(os.environ.get("SSE_BUSY_RETRY", "30"))       # seconds, Retry-After
+SSE = "text/event-stream"
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+class StreamsFull(Exception):
+    pass
+
+
+# ---------- SUBSCRIBER ----------
+class Subscriber:
+    # One connected client. The hub thread appends to a bounded buffer and
+    # never waits on a client; a client that falls `maxsize` events behind
+    # is evicted and reconnects with Last-Event-ID (replayed from the change
+    # log) instead of holding up everyone else.
+
+    def __init__(self, maxsize, loop=None):
+        self.maxsize = maxsize
+        self.closed = False
+        self.evicted = False
+        self._buffer = deque()
+        self._cond = threading.Condition(threading.Lock())
+        self._loop = loop
+        self._ready = asyncio.Event() if loop is not None else None
+
+    def push(self, event):
+        with self._cond:
+            if self.closed:
+                return False
+            if len(self._buffer) >= self.maxsize:
+                self.closed = self.evicted = True
+                self._buffer.clear()
+            else:
+                self._buffer.append(event)
+            self._cond.notify()
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:   # loop already closed
+                self.closed = True
+        return not self.closed
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:
+                pass
+
+    def _drain(self):
+        events = list(self._buffer)
+        self._buffer.clear()
+        return events
+
+    def get(self, timeout=None):
+        # -> buffered events ([] on timeout), or None once closed
+        with self._cond:
+            if not self._buffer and not self.closed:
+                self._cond.wait(timeout)
+            if self.closed and not self._buffer:
+                return None
+            return self._drain()
+
+    async def aget(self, timeout=None):
+        with self._cond:
+            if self._buffer or self.closed:
+                return None if self.closed and not self._buffer else self._drain()
+            self._ready.clear()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._cond:
+            if self.closed and not self._buffer:
+                return None
+            return self._drain()
+
+
+# ---------- HUB ----------
+class EventHub:
+    # Fans user_changes rows out to every subscriber. The change log is
+    # filled by triggers, so one tailing thread per process sees writes from
+    # every handler, bulk job and other app on the same database; handlers
+    # call notify() after a write so local changes go out without waiting
+    # for the next poll.
+
+    def __init__(self, pool, buffer=EVENT_BUFFER, interval=EVENT_POLL_INTERVAL,
+                 max_streams=SSE_MAX_STREAMS):
+        self.pool = pool
+        self.buffer = buffer
+        self.interval = interval
+        self.max_streams = max_streams
+        self.seq = None
+        self._subs = set()
+        self._blocking = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stats = {"published": 0, "delivered": 0, "evicted": 0, "refused": 0}
+
+    def subscribe(self, loop=None, stream=False):
+        # stream: the subscriber holds a server thread for its client
+        # (sse_stream); only those count towards max_streams
+        sub = Subscriber(self.buffer, loop)
+        with self._lock:
+            if stream:
+                if len(self._blocking) >= self.max_streams:
+                    self._stats["refused"] += 1
+                    raise StreamsFull(f"{self.max_streams} event streams already open")
+                self._blocking.add(sub)
+            self._subs.add(sub)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="event-hub", daemon=True)
+                self._thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+            self._blocking.discard(sub)
+        sub.close()
+
+    def resume(self, seq):
+        # Called by a new subscriber once it knows how far it has read. An
+        # idle hub picks up from there, so nothing between the subscriber's
+        # read and the hub's first poll falls through the gap.
+        with self._lock:
+            if self.seq is None:
+                self.seq = seq
+
+    def notify(self):
+        self._wake.set()
+
+    def publish(self, events):
+        with self._lock:
+            subs = list(self._subs)
+            self._stats["published"] += len(events)
+        for sub in subs:
+            for event in events:
+                if not sub.push(event):
+                    with self._lock:
+                        self._subs.discard(sub)
+                        if sub.evicted:
+                            self._stats["evicted"] += 1
+                    break
+            else:
+                with self._lock:
+                    self._stats["delivered"] += len(events)
+
+    def _poll(self, conn):
+        while True:
+            feed = changes_since(conn, self.seq, CHANGES_LIMIT)
+            if feed["reset"]:
+                self.publish([{"seq": feed["next"], "op": "reset"}])
+            elif feed["changes"]:
+                self.publish(feed["changes"])
+            self.seq = feed["next"]
+            if not feed["more"]:
+                return
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            with self._lock:
+                if not self._subs:
+                    # nobody listening: forget the position rather than
+                    # replaying everything to the next subscriber
+                    self.seq = None
+                if self.seq is None:
+                    continue
+            conn = self.pool.connection()
+            try:
+                self._poll(conn)
+            except Exception:
+                pass
+            finally:
+                conn.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, subscribers=len(self._subs),
+                        streams=len(self._blocking), seq=self.seq)
+
+    def _after_fork(self):
+        # subscribers and the tailing thread stay with the parent
+        self.seq = None
+        self._subs = set()
+        self._blocking = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+def get_hub(pool):
+    with _hubs_lock:
+        hub = _hubs.get(pool.path)
+        if hub is None:
+            hub = _hubs[pool.path] = EventHub(pool)
+        return hub
+
+
+def _after_fork():
+    global _hubs_lock
+    _hubs_lock = threading.Lock()
+    for hub in _hubs.values():
+        hub._after_fork()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+# ---------- SSE ----------
+def sse_message(event):
+    return f"id: {event['seq']}\nevent: {event['op']}\ndata: {json.dumps(event)}\n\n"
+
+
+def _backlog(conn, last_id):
+    # events a reconnecting client missed, or a single reset event when the
+    # log no longer covers them
+    feed = changes_since(conn, last_id, CHANGES_LIMIT)
+    if feed["reset"] or feed["more"]:
+        latest = current_seq(conn)
+        return [{"seq": latest, "op": "reset"}], latest
+    return feed["changes"], feed["next"]
+
+
+def _last_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _opening(backlog, seen):
+    # reconnect delay plus the missed events; with nothing missed, an empty
+    # event that only moves the client's Last-Event-ID to `seen`
+    if backlog:
+        return "retry: 2000\n\n" + "".join(sse_message(e) for e in backlog)
+    return f"retry: 2000\nid: {seen}\n\n"
+
+
+def sse_stream(hub, last_event_id=None, keepalive=EVENT_KEEPALIVE):
+    # Blocking stream for threaded servers (Flask): one thread per client.
+    # The slot is taken here, before the response starts, so a full process
+    # can still answer with a 503 (StreamsFull); the generator is started so
+    # that closing it, or dropping it unread, gives the slot back.
+    sub = hub.subscribe(stream=True)
+    stream = _sse(hub, sub, last_event_id, keepalive)
+    next(stream)
+    return stream
+
+
+def _sse(hub, sub, last_event_id, keepalive):
+    try:
+        yield
+        conn = hub.pool.connection()
+        try:
+            last_id = _last_id(last_event_id)
+            backlog, seen = _backlog(conn, last_id) if last_id is not None else ([], current_seq(conn))
+        finally:
+            conn.close()
+        hub.resume(seen)
+        yield _opening(backlog, seen)
+        while True:
+            events = sub.get(keepalive)
+            if events is None:
+                return
+            # subscribed before the backlog was read, so anything up to
+            # `seen` may arrive twice; it has already been sent
+            events = [e for e in events if e["seq"] > seen]
+            yield "".join(sse_message(e) for e in events) if events else ": ping\n\n"
+    finally:
+        hub.unsubscribe(sub)
+
+
+async def asse_stream(hub, run, last_event_id=None, keepalive=EVENT_KEEPALIVE):
+    # Same stream for asyncio servers; `run(fn, *args)` executes fn(conn, ...)
+    # off the event loop (AsyncDB.run)
+    sub = hub.subscribe(asyncio.get_running_loop())
+    try:
+        last_id = _last_id(last_event_id)
+        if last_id is not None:
+            backlog, seen = await run(_backlog, last_id)
+        else:
+            backlog, seen = [], await run(current_seq)
+        hub.resume(seen)
+        yield _opening(backlog, seen)
+        while True:
+            events = await sub.aget(keepalive)
+            if events is None:
+                return
+            events = [e for e in events if e["seq"] > seen]
+            yield "".join(sse_message(e) for e in events) if events else ": ping\n\n"
+    finally:
+        hub.unsubscribe(sub)
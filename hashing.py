@@ -0,0 +1,295 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from metrics import HASH_LATENCY, HASH_WAIT
+
+# ---------- SETTINGS ----------
+# scrypt cost: N=2**14, r=8 needs 16MB per derivation and ~30-60ms of CPU
+SCRYPT_N = int(os.environ.get("SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("SCRYPT_P", "1"))
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", str(os.cpu_count() or 2)))
+HASH_MAX_PENDING = int(os.environ.get("HASH_MAX_PENDING", "256"))
+HASH_QUEUE_TIMEOUT = float(os.environ.get("HASH_QUEUE_TIMEOUT", "10"))
+
+SCHEME = "scrypt"
+WRAPPED_SCHEME = "scrypt-sha256"   # scrypt over an old sha256 hex digest
+
+
+class HashQueueFull(Exception):
+    pass
+
+
+# ---------- FORMAT ----------
+def is_legacy(stored):
+    return len(stored) == 64 and all(c in "0123456789abcdef" for c in stored)
+
+
+def needs_rehash(stored, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return True
+    return (int(parts[1]), int(parts[2]), int(parts[3])) != (n, r, p)
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def legacy_digest(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+# ---------- WORKER ----------
+# Runs inside the process pool, so it only gets plain str/int arguments
+def derive(scheme, secret, n, r, p, salt=None):
+    t0 = time.perf_counter()
+    salt = _unb64(salt) if salt else os.urandom(16)
+    key = hashlib.scrypt(secret.encode(), salt=salt, n=n, r=r, p=p,
+                         maxmem=256 * n * r + 1024 * 1024, dklen=32)
+    encoded = f"{scheme}${n}${r}${p}${_b64(salt)}${_b64(key)}"
+    return encoded, time.perf_counter() - t0
+
+
+# ---------- SERVICE ----------
+class PasswordHasher:
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING,
+                 n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, queue_timeout=HASH_QUEUE_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.n, self.r, self.p = n, r, p
+        self.queue_timeout = queue_timeout
+        self._executor = None
+        self._start_lock = threading.Lock()
+        self._cond = threading.Condition(threading.Lock())
+        self._pending = 0
+        self._latencies = deque(maxlen=1024)
+        self._stats = {"submitted": 0, "completed": 0, "rejected": 0,
+                       "hash_seconds": 0.0, "wait_seconds": 0.0}
+
+    def start(self):
+        # Start the worker processes early, before the web server spins up
+        # its threads, so the pool is forked from a quiet process.
+        if self.workers and self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._executor.submit(int).result()
+        return self
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _after_fork(self):
+        # the parent's worker processes are not ours to use; the first hash
+        # in this process starts a fresh pool
+        self._executor = None
+        self._start_lock = threading.Lock()
+        self._cond = threading.Condition(threading.Lock())
+        self._pending = 0
+
+    # -- bounded queue --
+    def _try_acquire(self):
+        with self._cond:
+            if self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+            self._stats["submitted"] += 1
+            return True
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.queue_timeout
+        with self._cond:
+            while self._pending >= self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["rejected"] += 1
+                    raise HashQueueFull(f"{self._pending} password hashes already queued")
+                self._cond.wait(remaining)
+            self._pending += 1
+            self._stats["submitted"] += 1
+
+    def _done(self, submitted, future):
+        with self._cond:
+            self._pending -= 1
+            self._cond.notify()
+            if future.exception() is None:
+                elapsed = time.perf_counter() - submitted
+                spent = future.result()[1]
+                self._stats["completed"] += 1
+                self._stats["hash_seconds"] += spent
+                self._stats["wait_seconds"] += max(elapsed - spent, 0.0)
+                self._latencies.append(elapsed)
+        if future.exception() is None:
+            HASH_LATENCY.observe(spent)
+            HASH_WAIT.observe(max(elapsed - spent, 0.0))
+
+    def _submit(self, scheme, secret, salt=None, cost=None):
+        n, r, p = cost or (self.n, self.r, self.p)
+        submitted = time.perf_counter()
+        if self._executor is None and self.workers:
+            with self._start_lock:
+                self.start()
+        if self._executor is None:
+            # HASH_WORKERS=0: derive inline (tests, single-shot scripts)
+            future = Future()
+            try:
+                future.set_result(derive(scheme, secret, n, r, p, salt))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = self._executor.submit(derive, scheme, secret, n, r, p, salt)
+        future.add_done_callback(lambda f: self._done(submitted, f))
+        return future
+
+    def submit_hash(self, password):
+        self._acquire()
+        return self._submit(SCHEME, password)
+
+    async def _submit_async(self, scheme, secret, salt=None, cost=None):
+        # never block the event loop on a full queue; poll until the deadline
+        deadline = time.monotonic() + self.queue_timeout
+        while not self._try_acquire():
+            if time.monotonic() >= deadline:
+                with self._cond:
+                    self._stats["rejected"] += 1
+                raise HashQueueFull(f"{self.max_pending} password hashes already queued")
+            await asyncio.sleep(0.005)
+        result = await asyncio.wrap_future(self._submit(scheme, secret, salt, cost))
+        return result[0]
+
+    # -- public API --
+    def hash(self, password):
+        return self.submit_hash(password).result()[0]
+
+    async def hash_async(self, password):
+        return await self._submit_async(SCHEME, password)
+
+    def _check(self, password, stored):
+        # returns (scheme, secret, salt, cost) to re-derive and compare with,
+        # None for a legacy sha256 digest, or False for an unusable value
+        if is_legacy(stored):
+            return None
+        parts = stored.split("$")
+        if len(parts) != 6 or parts[0] not in (SCHEME, WRAPPED_SCHEME):
+            return False
+        scheme, n, r, p, salt, _ = parts
+        if scheme == WRAPPED_SCHEME:
+            password = legacy_digest(password)
+        return scheme, password, salt, (int(n), int(r), int(p))
+
+    def verify(self, password, stored):
+        # -> (ok, replacement); replacement is a fresh hash to store when the
+        # old one is a legacy/wrapped digest or uses outdated cost settings
+        check = self._check(password, stored)
+        if check is False:
+            return False, None
+        if check is None:
+            ok = hmac.compare_digest(legacy_digest(password), stored)
+        else:
+            scheme, secret, salt, cost = check
+            self._acquire()
+            encoded = self._submit(scheme, secret, salt, cost).result()[0]
+            ok = hmac.compare_digest(encoded, stored)
+        if ok and needs_rehash(stored, self.n, self.r, self.p):
+            return True, self.hash(password)
+        return ok, None
+
+    async def verify_async(self, password, stored):
+        check = self._check(password, stored)
+        if check is False:
+            return False, None
+        if check is None:
+            ok = hmac.compare_digest(legacy_digest(password), stored)
+        else:
+            scheme, secret, salt, cost = check
+            encoded = await self._submit_async(scheme, secret, salt, cost)
+            ok = hmac.compare_digest(encoded, stored)
+        if ok and needs_rehash(stored, self.n, self.r, self.p):
+            return True, await self.hash_async(password)
+        return ok, None
+
+    def wrap_legacy(self, digest):
+        # scrypt over the stored sha256 hex: upgrades old rows without the password
+        self._acquire()
+        return self._submit(WRAPPED_SCHEME, digest)
+
+    def stats(self):
+        with self._cond:
+            latencies = sorted(self._latencies)
+            out = dict(self._stats, workers=self.workers, max_pending=self.max_pending,
+                       queue_depth=self._pending)
+        if latencies:
+            out["latency_p50"] = latencies[len(latencies) // 2]
+            out["latency_p99"] = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+            out["latency_max"] = latencies[-1]
+        return out
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+def get_hasher():
+    global _hasher
+    with _hasher_lock:
+        if _hasher is None:
+            _hasher = PasswordHasher()
+        return _hasher
+
+
+def _after_fork():
+    global _hasher_lock
+    _hasher_lock = threading.Lock()
+    if _hasher is not None:
+        _hasher._after_fork()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+# ---------- LEGACY UPGRADE ----------
+# verify() hands back a plain scrypt hash to store whenever a password
+# checks out against an old format; this wraps every sha256 row still left
+# in scrypt-sha256 without needing the password: python hashing.py users.db
+def upgrade_legacy_hashes(conn, hasher=None, batch=500):
+    hasher = hasher or get_hasher()
+    # a batch is queued all at once, so it must fit the hasher's queue
+    batch = max(1, min(batch, hasher.max_pending))
+    cur = conn.cursor()
+    upgraded = 0
+    last_id = 0
+    while True:
+        cur.execute("SELECT id, password FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch))
+        rows = cur.fetchall()
+        if not rows:
+            return upgraded
+        last_id = rows[-1][0]
+        futures = [(uid, hasher.wrap_legacy(pw)) for uid, pw in rows if is_legacy(pw)]
+        updates = [(f.result()[0], uid) for uid, f in futures]
+        cur.executemany("UPDATE users SET password=? WHERE id=?", updates)
+        conn.commit()
+        upgraded += len(updates)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sqlite3
+
+    ap = argparse.ArgumentParser(description="Wrap legacy sha256 password hashes in scrypt")
+    ap.add_argument("db", nargs="?", default="users.db")
+    args = ap.parse_args()
+    conn = sqlite3.connect(args.db)
+    count = upgrade_legacy_hashes(conn, get_hasher().start())
+    print(f"upgraded {count} legacy hashes")
+    print(get_hasher().stats())
@@ -0,0 +1,272 @@
+import bisect
+import functools
+import os
+import threading
+import time
+
+# ---------- SETTINGS ----------
+METRICS_ENABLED = os.environ.get("METRICS", "1").lower() not in ("0", "false", "no")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5, 1.0)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+SQL_KINDS = frozenset(("SELECT", "INSERT", "UPDATE", "DELETE", "BEGIN", "COMMIT",
+                       "ROLLBACK", "PRAGMA", "CREATE", "WITH"))
+
+
+# ---------- PRIMITIVES ----------
+# Plain dicts keyed by label tuples under one lock each: an observation is a
+# bisect and two additions, cheap enough to leave on in production.
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, value=1):
+        self.inc(*labels, value=-value)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = buckets
+        self._values = {}    # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(row)) for labels, row in self._values.items()]
+        for labels, row in items:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), row[:-1]):
+                total += count
+                names = self.labels + ("le",)
+                yield self.name + "_bucket", _labels(names, labels + (bound,)), total
+            yield self.name + "_sum", _labels(self.labels, labels), row[-1]
+            yield self.name + "_count", _labels(self.labels, labels), total
+
+
+# ---------- REGISTRY ----------
+REGISTRY = []
+_collectors = {}
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+HTTP_REQUESTS = _register(Counter(
+    "http_requests_total", "Requests handled", ("method", "route", "status")))
+HTTP_LATENCY = _register(Histogram(
+    "http_request_duration_seconds", "Time from request start to response",
+    ("method", "route")))
+HTTP_SIZE = _register(Histogram(
+    "http_response_size_bytes", "Response body size", ("route",), SIZE_BUCKETS))
+HTTP_IN_FLIGHT = _register(Gauge(
+    "http_requests_in_flight", "Requests being handled right now"))
+SQL_LATENCY = _register(Histogram(
+    "db_statement_duration_seconds", "SQL execute() time by statement type",
+    ("statement",), SQL_BUCKETS))
+HASH_LATENCY = _register(Histogram(
+    "password_hash_duration_seconds", "scrypt derivation time in the worker"))
+HASH_WAIT = _register(Histogram(
+    "password_hash_queue_seconds", "Time a hash waited before a worker picked it up"))
+WRITE_BATCH = _register(Histogram(
+    "db_write_batch_size", "Mutations per group-commit transaction", (), BATCH_BUCKETS))
+CACHE_LOOKUPS = _register(Counter(
+    "cache_lookups_total", "In-process cache lookups", ("cache", "result")))
+
+
+def add_collector(key, fn):
+    # fn() -> iterable of (name{labels}, type, help, value), sampled on each scrape;
+    # one per key, so instrumenting the same pool twice does not double up
+    _collectors[key] = fn
+
+
+def pool_collector(pool):
+    db = _labels(("db",), (os.path.basename(pool.path),))
+
+    def collect():
+        stats = pool.stats()
+        yield "db_pool_in_use" + db, "gauge", "Connections checked out", stats["in_use"]
+        yield "db_pool_idle" + db, "gauge", "Connections open and idle", stats["idle"]
+        yield "db_pool_waits_total" + db, "counter", "Checkouts that had to wait", stats["waits"]
+        yield "db_pool_timeouts_total" + db, "counter", "Checkouts that timed out", stats["timeouts"]
+    return collect
+
+
+def hasher_collector(hasher):
+    def collect():
+        stats = hasher.stats()
+        yield "password_hash_queue_depth", "gauge", "Hashes queued or running", stats["queue_depth"]
+        yield "password_hash_rejected_total", "counter", "Hashes refused with 503", stats["rejected"]
+    return collect
+
+
+def _after_fork():
+    # a lock some other thread held at fork() would stay locked in the child
+    for metric in REGISTRY:
+        metric._lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+@functools.lru_cache(maxsize=1024)   # the same few SQL strings, over and over
+def statement_kind(sql):
+    head = sql[:16].split(None, 1)
+    kind = head[0].upper() if head else ""
+    return kind if kind in SQL_KINDS else "OTHER"
+
+
+def observe_sql(sql, seconds):
+    if METRICS_ENABLED:
+        SQL_LATENCY.observe(seconds, statement_kind(sql))
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {value}")
+    # samples grouped by family, since several collectors (one per pool or
+    # shard) can report the same metric
+    families = {}
+    for collect in list(_collectors.values()):
+        for name, kind, help, value in collect():
+            base = name.split("{", 1)[0]
+            if base not in families:
+                families[base] = (kind, help, [])
+            families[base][2].append(f"{name} {value}")
+    for base, (kind, help, samples) in families.items():
+        lines.append(f"# HELP {base} {help}")
+        lines.append(f"# TYPE {base} {kind}")
+        lines += samples
+    return "\n".join(lines) + "\n"
+
+
+# ---------- FLASK ----------
+def instrument_flask(app, pool=None, hasher=None):
+    # before/after-request hooks plus GET /metrics
+    from flask import Response, g, request
+
+    if pool is not None:
+        add_collector(("pool", pool.path), pool_collector(pool))
+    if hasher is not None:
+        add_collector(("hasher", id(hasher)), hasher_collector(hasher))
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render(), mimetype=None, content_type=CONTENT_TYPE)
+
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def record(response):
+        started = g.get("metrics_started")
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_REQUESTS.inc(request.method, route, response.status_code)
+            HTTP_LATENCY.observe(time.perf_counter() - started, request.method, route)
+            if response.content_length is not None:   # streamed bodies have none
+                HTTP_SIZE.observe(response.content_length, route)
+        return response
+
+    @app.teardown_request
+    def done(exc):
+        if g.pop("metrics_started", None) is not None:
+            HTTP_IN_FLIGHT.dec()
+
+
+# ---------- ASGI ----------
+class MetricsMiddleware:
+    # Pure ASGI middleware (BaseHTTPMiddleware would buffer streamed bodies).
+    # Latency runs until the last body chunk is sent, so streaming responses
+    # are measured end to end; the route is the matched path template.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        state = {"status": 500, "size": 0}
+        HTTP_IN_FLIGHT.inc()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["size"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method, route, state["status"])
+            HTTP_LATENCY.observe(time.perf_counter() - started, method, route)
+            HTTP_SIZE.observe(state["size"], route)
+
+
+def instrument_asgi(app, pool=None, hasher=None, path="/metrics"):
+    # middleware plus GET /metrics on a FastAPI app
+    from fastapi.responses import Response
+
+    if pool is not None:
+        add_collector(("pool", pool.path), pool_collector(pool))
+    if hasher is not None:
+        add_collector(("hasher", id(hasher)), hasher_collector(hasher))
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get(path, include_in_schema=False)
+    async def metrics():
+        return Response(render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,84 @@
+from collections import namedtuple
+from urllib.parse import urlencode
+
+# ---------- SETTINGS ----------
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# rows in listing order; next_after / prev_before are the cursors for the
+# neighbouring pages, or None when there is nothing more in that direction
+Page = namedtuple("Page", "rows next_after prev_before")
+
+
+def clamp_limit(limit):
+    if not limit:
+        return DEFAULT_LIMIT
+    return max(1, min(int(limit), MAX_LIMIT))
+
+
+# ---------- KEYSET QUERY ----------
+def fetch_page(conn, limit, after=None, before=None, descending=False,
+               where="", params=(), columns="id, email", table="users", key="id"):
+    # Cursors are ids in listing order: `after` continues past the last row
+    # of a page, `before` walks back from the first one. Both are plain
+    # range seeks on the primary key, so every page costs O(limit).
+    limit = clamp_limit(limit)
+    backward = before is not None
+    forward_op, forward_dir = ("<", "DESC") if descending else (">", "ASC")
+    backward_op, backward_dir = ("<", "DESC") if not descending else (">", "ASC")
+
+    clauses = [where] if where else []
+    args = list(params)
+    if backward:
+        clauses.append(f"{key} {backward_op} ?")
+        args.append(before)
+        order = backward_dir
+    else:
+        if after is not None:
+            clauses.append(f"{key} {forward_op} ?")
+            args.append(after)
+        order = forward_dir
+
+    sql = f"SELECT {columns} FROM {table}"
+    if clauses:
+        sql += " WHERE " + " AND ".join(f"({c})" for c in clauses)
+    sql += f" ORDER BY {key} {order} LIMIT ?"
+    args.append(limit + 1)
+
+    cur = conn.cursor()
+    cur.execute(sql, args)
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if not rows:
+        return Page([], None, None)
+    if backward:
+        rows.reverse()
+        return Page(rows, rows[-1][0], rows[0][0] if has_more else None)
+    return Page(rows, rows[-1][0] if has_more else None,
+                rows[0][0] if after is not None else None)
+
+
+# ---------- LINKS ----------
+def page_url(path, query, **cursor):
+    params = {k: v for k, v in query.items() if k not in ("after", "before")}
+    params.update(cursor)
+    return path + ("?" + urlencode(params) if params else "")
+
+
+def page_headers(path, query, page):
+    # `query` is the incoming query-string mapping, so filters such as
+    # ?search= and ?limit= are carried over into the next/prev links
+    query = dict(query.items())
+    links = []
+    headers = {}
+    if page.next_after is not None:
+        links.append(f'<{page_url(path, query, after=page.next_after)}>; rel="next"')
+        headers["X-Next-Cursor"] = str(page.next_after)
+    if page.prev_before is not None:
+        links.append(f'<{page_url(path, query, before=page.prev_before)}>; rel="prev"')
+        headers["X-Prev-Cursor"] = str(page.prev_before)
+    if links:
+        headers["Link"] = ", ".join(links)
+    return headers
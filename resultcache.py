@@ -0,0 +1,155 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from metrics import CACHE_LOOKUPS, add_collector
+
+# ---------- SETTINGS ----------
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", str(32 * 1024 * 1024)))  # 0 turns it off
+ENTRY_OVERHEAD = 200   # rough per-entry cost of the key, tuple and dict slot
+
+
+def request_key(path, items):
+    # the same query string in any order maps to one entry
+    return (path, tuple(sorted(items)))
+
+
+# ---------- CACHE ----------
+class ResultCache:
+    # Serialized list/search responses keyed by (users_version, path, query),
+    # LRU-evicted by size. The version moves on every write (a trigger bumps
+    # it), so an entry can never be stale, only unreachable; entries for older
+    # versions are dropped as soon as a newer one is seen.
+    #
+    # Misses are single-flight: the first request for a key computes it and
+    # every identical request arriving meanwhile waits on the same Future
+    # (threads block on it, coroutines await it) instead of querying again.
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.version = None
+        self._entries = OrderedDict()   # (version, path, query) -> (body, headers, size)
+        self._bytes = 0
+        self._flights = {}              # key -> Future
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def _lookup(self, key, version):
+        # -> ("hit", value) | ("wait", future) | ("lead", future)
+        key = (version,) + key
+        with self._lock:
+            if self.version is None or version > self.version:
+                self._advance(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                CACHE_LOOKUPS.inc("results", "hit")
+                return "hit", entry[:2]
+            future = self._flights.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                CACHE_LOOKUPS.inc("results", "coalesced")
+                return "wait", future
+            future = self._flights[key] = Future()
+            self._stats["misses"] += 1
+        CACHE_LOOKUPS.inc("results", "miss")
+        return "lead", future
+
+    def _land(self, key, version, future, result=None, error=None):
+        # store the result and release the flight in one step, so no
+        # request sees neither an entry nor a flight for the key
+        key = (version,) + key
+        with self._lock:
+            if error is None and version >= self.version:
+                self._put(key, result)
+            self._flights.pop(key, None)
+        if error is None:
+            future.set_result(result)
+        else:
+            # followers of a cancelled or interrupted leader get an error too,
+            # rather than waiting forever
+            if not isinstance(error, Exception):
+                error = RuntimeError("result computation was interrupted")
+            future.set_exception(error)
+
+    def get(self, key, version, compute):
+        # compute() -> (body bytes, headers dict), run once per key and version
+        if self.max_bytes <= 0:
+            return compute()
+        state, value = self._lookup(key, version)
+        if state == "hit":
+            return value
+        if state == "wait":
+            return value.result()
+        try:
+            result = compute()
+        except BaseException as e:
+            self._land(key, version, value, error=e)
+            raise
+        self._land(key, version, value, result)
+        return result
+
+    async def aget(self, key, version, compute):
+        # same, for asyncio handlers: compute() -> awaitable
+        if self.max_bytes <= 0:
+            return await compute()
+        state, value = self._lookup(key, version)
+        if state == "hit":
+            return value
+        if state == "wait":
+            return await asyncio.shield(asyncio.wrap_future(value))
+        try:
+            result = await compute()
+        except BaseException as e:
+            self._land(key, version, value, error=e)
+            raise
+        self._land(key, version, value, result)
+        return result
+
+    def _advance(self, version):
+        self.version = version
+        for key in [k for k in self._entries if k[0] < version]:
+            self._bytes -= self._entries.pop(key)[2]
+
+    def _put(self, key, result):
+        body, headers = result
+        size = len(body) + sum(len(k) + len(v) for k, v in headers.items()) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (body, headers, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, _, old) = self._entries.popitem(last=False)
+            self._bytes -= old
+            self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes,
+                        in_flight=len(self._flights), version=self.version)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_result_cache(path):
+    # one per database per process, whatever engine stores it
+    key = os.path.abspath(path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ResultCache()
+            add_collector(("result_cache", key), result_cache_collector(cache))
+        return cache
+
+
+def result_cache_collector(cache):
+    def collect():
+        stats = cache.stats()
+        yield "result_cache_bytes", "gauge", "Serialized responses held by the result cache", stats["bytes"]
+        yield "result_cache_entries", "gauge", "Responses held by the result cache", stats["entries"]
+        yield "result_cache_evictions_total", "counter", "Responses evicted to stay under the size limit", stats["evictions"]
+    return collect
@@ -0,0 +1,59 @@
+from pagination import clamp_limit, fetch_page, Page
+
+# Trigram tokens are 3 characters, so shorter queries cannot use the index
+MIN_INDEXED_LEN = 3
+
+
+def has_search_index(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name='users_fts'")
+    return cur.fetchone() is not None
+
+
+def _like_pattern(q, prefix):
+    q = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return q + "%" if prefix else "%" + q + "%"
+
+
+def _fts_phrase(q):
+    return '"' + q.replace('"', '""') + '"'
+
+
+# ---------- SEARCH ----------
+def search_clause(conn, q, prefix=False):
+    # fetch_page()/stream_users() keyword arguments for a substring (or
+    # prefix) match. Served from the trigram index when possible, otherwise
+    # by the old LIKE scan, which a LIMIT at least cuts short.
+    q = q.lower()
+    if len(q) >= MIN_INDEXED_LEN and has_search_index(conn):
+        where, params = "users_fts MATCH ?", (_fts_phrase(q),)
+        if prefix:
+            # the index narrows to rows containing q, LIKE keeps the ones starting with it
+            where += " AND users.email LIKE ? ESCAPE '\\'"
+            params += (_like_pattern(q, True),)
+        return dict(where=where, params=params,
+                    columns="users.id, users.email",
+                    table="users_fts JOIN users ON users.id = users_fts.rowid",
+                    key="users_fts.rowid")
+    return dict(where="LOWER(email) LIKE ? ESCAPE '\\'", params=(_like_pattern(q, prefix),))
+
+
+def search_users(conn, q, limit, after=None, before=None, descending=False, prefix=False):
+    # substring (or prefix) search in id order, paginated like the plain listing
+    return fetch_page(conn, limit, after, before, descending, **search_clause(conn, q, prefix))
+
+
+def ranked_search(conn, q, limit):
+    # Best matches first (bm25 over trigrams favours short, dense matches).
+    # Ranked results have no stable keyset, so they come back as one page.
+    q = q.lower()
+    limit = clamp_limit(limit)
+    if len(q) < MIN_INDEXED_LEN or not has_search_index(conn):
+        return search_users(conn, q, limit)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT users.id, users.email FROM users_fts
+        JOIN users ON users.id = users_fts.rowid
+        WHERE users_fts MATCH ? ORDER BY rank LIMIT ?
+    """, (_fts_phrase(q), limit))
+    return Page(cur.fetchall(), None, None)
@@ -0,0 +1,110 @@
+import argparse
+import importlib
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+# ---------- SETTINGS ----------
+SERVE_BIND = os.environ.get("SERVE_BIND", "0.0.0.0:8000")
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", str(os.cpu_count() or 1)))
+SERVE_THREADS = int(os.environ.get("SERVE_THREADS", "8"))       # per Flask worker
+SERVE_TIMEOUT = int(os.environ.get("SERVE_TIMEOUT", "60"))
+SERVE_BACKLOG = int(os.environ.get("SERVE_BACKLOG", "2048"))
+
+# ---------- APPS ----------
+# name -> "module:WSGI/ASGI object in it"; app6.py is the Streamlit page,
+# its API lives in app6_api.py
+APPS = {
+    "app": "app:app",
+    "app1": "app1:app",
+    "app2": "app2:app",
+    "app3": "app3:app",
+    "app4": "app4:app",
+    "app5": "app5:app",
+    "app6": "app6_api:api",
+}
+ASGI_APPS = ("app", "app6")
+
+
+def asgi_worker():
+    # the worker moved out of uvicorn into its own package
+    try:
+        import uvicorn_worker  # noqa: F401
+        return "uvicorn_worker.UvicornWorker"
+    except ImportError:
+        return "uvicorn.workers.UvicornWorker"
+
+
+# ---------- SERVER ----------
+class Server(BaseApplication):
+    # gunicorn with preload_app: the master imports the app once, so schema
+    # setup, migrations and the suggest-index load run a single time and the
+    # workers fork with it all in place (shared copy-on-write). Everything
+    # that holds threads, connections or processes resets itself in each
+    # child through os.register_at_fork; see database.py, hashing.py and
+    # friends.
+
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        module, obj = APPS[self.name].split(":")
+        return getattr(importlib.import_module(module), obj)
+
+
+def when_ready(server):
+    # The master never hashes a password; its scrypt pool (started at import)
+    # would only be forked into every worker. Each worker starts its own.
+    from hashing import get_hasher
+    get_hasher().shutdown()
+
+
+def options(args):
+    asgi = args.app in ASGI_APPS
+    return {
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": 1 if asgi else args.threads,
+        "worker_class": asgi_worker() if asgi else "gthread",
+        "timeout": args.timeout,
+        "backlog": SERVE_BACKLOG,
+        "preload_app": True,
+        "when_ready": when_ready,
+        "accesslog": None,   # accesslog.py already records every request
+        "loglevel": args.log_level,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve one of the apps with preforked gunicorn workers")
+    ap.add_argument("app", choices=sorted(APPS))
+    ap.add_argument("--bind", default=SERVE_BIND)
+    ap.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    ap.add_argument("--threads", type=int, default=SERVE_THREADS, help="per worker (Flask apps)")
+    ap.add_argument("--timeout", type=int, default=SERVE_TIMEOUT)
+    ap.add_argument("--log-level", default="info")
+    args = ap.parse_args()
+
+    # read at import, so set before the app loads: split the cores between
+    # the workers' scrypt pools instead of giving each worker all of them
+    os.environ.setdefault("HASH_WORKERS", str(max(1, (os.cpu_count() or 1) // args.workers)))
+    # A Flask worker serves each /api/users/events client from one of its
+    # gthread threads for the whole connection. Half of them at most: past
+    # that the worker answers 503 and the dashboards fall back to polling
+    # the changes feed, so open dashboards can never take every thread the
+    # API needs. A worker holds SSE_MAX_STREAMS live dashboards, the server
+    # workers times that; the ASGI apps stream from the event loop instead.
+    os.environ.setdefault("SSE_MAX_STREAMS", str(max(1, args.threads // 2)))
+    sys.path.insert(0, os.getcwd())
+    Server(args.app, options(args)).run()
+
+
+if __name__ == "__main__":
+    main()
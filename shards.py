@@ -0,0 +1,518 @@
+"""Users spread over several SQLite files by a hash of the email.
+
+Ids are unique across shards without a shared counter: each shard only
+issues ids congruent to its index modulo MAX_SHARDS (256). Consecutive
+users on one shard are 256 apart, so ids grow about 256 times faster than
+the user count (300 users reach ids around 19000). The gaps are expected
+and nothing reads meaning into them. `python shards.py status` shows the
+layout and `rebalance` changes it; every app gets sharding with SHARDS=N
+through backends.get_backend().
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import threading
+import urllib.request
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from backends import stream_pages
+from bulk import SAMPLE_SIZE, bulk_delete, bulk_update
+from counters import user_count, users_version
+from database import get_pool, init_schema
+from metrics import add_collector, pool_collector
+from pagination import Page, clamp_limit, fetch_page
+from search import ranked_search, search_users
+from suggest import MAX_SUGGEST_LIMIT, SUGGEST_LIMIT, normalize
+from writer import get_writer
+
+# ---------- SETTINGS ----------
+# 0 or 1: the single users.db. N > 1: users.000.db ... users.<N-1>.db
+SHARDS = int(os.environ.get("SHARDS", "0"))
+# New ids satisfy id % MAX_SHARDS == the issuing shard, so ids stay unique
+# across files without a shared counter (see INSERT_SQL)
+MAX_SHARDS = 256
+REBALANCE_BATCH = int(os.environ.get("REBALANCE_BATCH", "1000"))
+
+
+class ShardLayoutError(Exception):
+    pass
+
+
+def shard_path(base, index):
+    # users.db -> users.000.db
+    root, ext = os.path.splitext(base)
+    return f"{root}.{index:03d}{ext}"
+
+
+def shard_for(email, count):
+    # stable across processes and restarts, unlike hash()
+    digest = hashlib.blake2b(normalize(email).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+# ---------- SCHEMA ----------
+def init_shard(conn, index, count):
+    # the usual schema plus which shard of how many this file is, so an app
+    # started with a different SHARDS refuses instead of misrouting
+    init_schema(conn)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS shard_meta (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO shard_meta (name, value) VALUES ('index', ?), ('count', ?)",
+                 (index, count))
+    # suggestions: emails written by older app versions may not be lowercased
+    conn.execute("CREATE INDEX IF NOT EXISTS users_email_lower ON users (LOWER(email), id)")
+    conn.commit()
+    meta = dict(conn.execute("SELECT name, value FROM shard_meta").fetchall())
+    if (meta["index"], meta["count"]) != (index, count):
+        raise ShardLayoutError(
+            f"shard file {index} was laid out as shard {meta['index']} of {meta['count']}, "
+            f"not of {count}: run python shards.py rebalance --to {count}")
+
+
+def legacy_users(path):
+    # users in an unsharded database, 0 if there is none
+    if not os.path.exists(path):
+        return 0
+    conn = _connect(path, readonly=True)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
+
+# ---------- OPS ----------
+# Next id in a shard: the smallest one above the shard's AUTOINCREMENT high
+# mark that is congruent to the shard index. The high mark also moves for
+# rows inserted with an explicit id (moved in from another shard), and the
+# rebalancer raises it past every id in use, so a shard never re-issues one.
+INSERT_SQL = f"""
+INSERT INTO users (id, email, password)
+SELECT next + ((? - next) % {MAX_SHARDS} + {MAX_SHARDS}) % {MAX_SHARDS}, ?, ?
+FROM (SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'users'), 0) + 1 AS next)
+"""
+
+
+def _insert(conn, index, email, password):
+    return conn.execute(INSERT_SQL, (index, email, password)).lastrowid
+
+
+def _insert_with_id(conn, user_id, email, password):
+    conn.execute("INSERT INTO users (id, email, password) VALUES (?, ?, ?)",
+                 (user_id, email, password))
+
+
+def _update(conn, user_id, email, password):
+    if password is None:
+        return conn.execute("UPDATE users SET email = ? WHERE id = ?", (email, user_id)).rowcount
+    return conn.execute("UPDATE users SET email = ?, password = ? WHERE id = ?",
+                        (email, password, user_id)).rowcount
+
+
+def _by_id(conn, user_id):
+    return conn.execute("SELECT id, email FROM users WHERE id = ?", (user_id,)).fetchone()
+
+
+def _by_email(conn, email):
+    return conn.execute("SELECT id, email FROM users WHERE email = ?", (email,)).fetchone()
+
+
+def _password(conn, user_id):
+    row = conn.execute("SELECT password FROM users WHERE id = ?", (user_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _prefix(conn, prefix, limit):
+    # `prefix` is normalized (lowercase); the LOWER(email) index serves the
+    # range whatever case a row was written in
+    return conn.execute("SELECT id, email FROM users WHERE LOWER(email) >= ? AND LOWER(email) < ? "
+                        "ORDER BY LOWER(email), id LIMIT ?",
+                        (prefix, prefix + "\U0010ffff", limit)).fetchall()
+
+
+# ---------- MERGE ----------
+def merge_pages(pages, limit, after=None, before=None, descending=False):
+    # Each shard's page holds its own first `limit` rows past the cursor, so
+    # the first `limit` of their merge are the global ones. Cursors come out
+    # as fetch_page would give them for one file holding every row.
+    rows = sorted((r for p in pages for r in p.rows), key=lambda r: r[0], reverse=descending)
+    if before is not None:
+        more = len(rows) > limit or any(p.prev_before is not None for p in pages)
+        rows = rows[-limit:]   # the ones nearest the cursor
+        if not rows:
+            return Page([], None, None)
+        return Page(rows, rows[-1][0], rows[0][0] if more else None)
+    more = len(rows) > limit or any(p.next_after is not None for p in pages)
+    rows = rows[:limit]
+    if not rows:
+        return Page([], None, None)
+    return Page(rows, rows[-1][0] if more else None, rows[0][0] if after is not None else None)
+
+
+def merge_bulk(results, dry_run):
+    sample = sorted((s for r in results for s in r["sample"]), key=lambda s: s["id"])
+    return {"matched": sum(r["matched"] for r in results),
+            "affected": sum(r["affected"] for r in results),
+            "dry_run": dry_run, "sample": sample[:SAMPLE_SIZE]}
+
+
+# ---------- STORE ----------
+class ShardedStore:
+    # Users spread over `count` SQLite files by a hash of the normalized
+    # email, each with its own pool and group-commit writer, so writes to
+    # different shards take different file locks instead of all queueing on
+    # one. A lookup by email reads one shard; by id, the shard that issued
+    # it first (id % MAX_SHARDS), then the rest, since a changed email or a
+    # rebalance can move a row. Listings, search, counts and bulk operations
+    # run on every shard in parallel and are merged.
+    #
+    # Each shard keeps its own triggers, counters, FTS index and change log;
+    # the change feed does not span shards.
+    pool = None
+
+    def __init__(self, base, count):
+        if not 1 <= count <= MAX_SHARDS:
+            raise ValueError(f"shard count must be between 1 and {MAX_SHARDS}")
+        self.base = base
+        self.shards = count
+        self.paths = [shard_path(base, i) for i in range(count)]
+        if not any(os.path.exists(p) for p in self.paths):
+            users = legacy_users(base)
+            if users:
+                raise ShardLayoutError(
+                    f"{base} holds {users} users and there are no shard files yet: "
+                    f"run python shards.py rebalance --from {base} --to {count}")
+        self.pools = [get_pool(p) for p in self.paths]
+        for i, pool in enumerate(self.pools):
+            conn = pool.connection()
+            try:
+                init_shard(conn, i, count)
+            finally:
+                conn.close()
+            add_collector(("pool", pool.path), pool_collector(pool))
+        self.writers = [get_writer(pool) for pool in self.pools]
+        self._executor = ThreadPoolExecutor(max_workers=count, thread_name_prefix="shard")
+        _stores.add(self)
+
+    def shard_of(self, email):
+        return shard_for(email, self.shards)
+
+    def _read(self, index, fn, *args):
+        conn = self.pools[index].connection()
+        try:
+            return fn(conn, *args)
+        finally:
+            conn.close()
+
+    def _gather(self, fn, *args):
+        # fn(conn, *args) on every shard at once -> results in shard order
+        futures = [self._executor.submit(self._read, i, fn, *args) for i in range(self.shards)]
+        return [f.result() for f in futures]
+
+    # -- single users --
+    def find_email(self, email):
+        # -> (id, email), or None
+        return self._read(self.shard_of(email), _by_email, email)
+
+    def get(self, user_id):
+        # -> (id, email), or None
+        return self._locate(user_id)[0]
+
+    def _locate(self, user_id):
+        # -> ((id, email), shard index), or (None, None)
+        home = user_id % MAX_SHARDS
+        order = ([home] if home < self.shards else []) + [i for i in range(self.shards) if i != home]
+        for i in order:
+            row = self._read(i, _by_id, user_id)
+            if row is not None:
+                return row, i
+        return None, None
+
+    def create(self, email, password):
+        # -> the new id; IntegrityError if the email is taken
+        index = self.shard_of(email)
+        return self.writers[index].submit(_insert, index, email, password).result()
+
+    def update(self, user_id, email, password=None):
+        # -> rows changed. A new email that hashes to another shard moves the
+        # row there under the same id: inserted first, then deleted here, so
+        # a crash in between leaves a duplicate (which a rebalance clears)
+        # rather than losing the user.
+        _, source = self._locate(user_id)
+        if source is None:
+            return 0
+        target = self.shard_of(email)
+        if target == source:
+            return self.writers[source].submit(_update, user_id, email, password).result()
+        if password is None:
+            password = self._read(source, _password, user_id)
+        self.writers[target].submit(_insert_with_id, user_id, email, password).result()
+        self.writers[source].execute("DELETE FROM users WHERE id = ?", (user_id,))
+        return 1
+
+    def delete(self, user_id):
+        _, index = self._locate(user_id)
+        if index is None:
+            return 0
+        return self.writers[index].execute("DELETE FROM users WHERE id = ?", (user_id,))
+
+    async def acreate(self, email, password):
+        index = self.shard_of(email)
+        return await self.writers[index].asubmit(_insert, index, email, password)
+
+    # finding the user's shard is a read first; both run off the event loop
+    async def aupdate(self, user_id, email, password=None):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, partial(self.update, user_id, email, password))
+
+    async def adelete(self, user_id):
+        return await asyncio.get_running_loop().run_in_executor(None, self.delete, user_id)
+
+    # -- scatter-gather --
+    def page(self, limit, after=None, before=None, descending=False):
+        limit = clamp_limit(limit)
+        pages = self._gather(fetch_page, limit, after, before, descending)
+        return merge_pages(pages, limit, after, before, descending)
+
+    def search(self, q, limit, after=None, before=None, descending=False, prefix=False):
+        limit = clamp_limit(limit)
+        pages = self._gather(search_users, q, limit, after, before, descending, prefix)
+        return merge_pages(pages, limit, after, before, descending)
+
+    def ranked(self, q, limit):
+        # bm25 scores come from per-shard statistics and do not compare
+        # across files, so rankings are interleaved: every shard's best
+        # match, then every shard's second...
+        limit = clamp_limit(limit)
+        pages = self._gather(ranked_search, q, limit)
+        rows = [r for group in itertools.zip_longest(*(p.rows for p in pages))
+                for r in group if r is not None]
+        return Page(rows[:limit], None, None)
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        # same answers as SuggestIndex.suggest, straight from the email indexes
+        prefix = normalize(prefix or "")
+        limit = max(1, min(int(limit or SUGGEST_LIMIT), MAX_SUGGEST_LIMIT))
+        rows = sorted((r for part in self._gather(_prefix, prefix, limit) for r in part),
+                      key=lambda r: (r[1].lower(), r[0]))[:limit]
+        return [{"id": r[0], "email": r[1]} for r in rows]
+
+    def stream(self, after=None, q="", prefix=False, descending=False):
+        # a merged page at a time
+        return stream_pages(self, after, q, prefix, descending)
+
+    def count(self):
+        return sum(self._gather(user_count))
+
+    def version(self):
+        # every shard's version only goes up, so their sum moves on any write
+        return sum(self._gather(users_version))
+
+    def change_seq(self):
+        return None
+
+    # -- bulk --
+    # One transaction per shard: a failure on one shard (a unique-email
+    # conflict) leaves the shards that already committed as they are.
+    def bulk_delete(self, selector, dry_run=False):
+        return merge_bulk(self._gather(bulk_delete, selector, dry_run), dry_run)
+
+    def bulk_update(self, selector, changes, dry_run=False):
+        if changes.domain:
+            # new emails would belong on other shards; that is a rebalance's job
+            raise ValueError("replace_domain is not available with sharded storage")
+        return merge_bulk(self._gather(bulk_update, selector, changes, dry_run), dry_run)
+
+    def stats(self):
+        counts = self._gather(user_count)
+        return {"shards": self.shards, "users": sum(counts), "per_shard": counts}
+
+
+_stores = weakref.WeakSet()
+_by_base = {}
+_by_base_lock = threading.Lock()
+
+def get_store(base, count=SHARDS):
+    # None while sharding is off
+    if count <= 1:
+        return None
+    key = (os.path.abspath(base), count)
+    with _by_base_lock:
+        store = _by_base.get(key)
+        if store is None:
+            store = _by_base[key] = ShardedStore(base, count)
+        return store
+
+
+def _after_fork():
+    global _by_base_lock
+    _by_base_lock = threading.Lock()
+    for store in _stores:
+        store._executor = ThreadPoolExecutor(max_workers=store.shards, thread_name_prefix="shard")
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+# ---------- REBALANCE ----------
+def existing_shards(base):
+    return [p for p in (shard_path(base, i) for i in range(MAX_SHARDS)) if os.path.exists(p)]
+
+
+def _connect(path, readonly=False):
+    if readonly:
+        # the database being copied from is left exactly as it was
+        uri = "file:" + urllib.request.pathname2url(os.path.abspath(path)) + "?mode=ro"
+        return sqlite3.connect(uri, uri=True, timeout=30)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _high_mark(conn):
+    row = conn.execute("SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'users'), 0), "
+                       "COALESCE((SELECT MAX(id) FROM users), 0))").fetchone()
+    return row[0]
+
+
+def rebalance(base, count, source=None, batch=REBALANCE_BATCH, log=print):
+    # Offline: stop the apps first. Every user ends up in
+    # shard_for(email, count) under the id it already had. Rows are moved
+    # out of existing shard files (a target commits before its source
+    # deletes, so a crash leaves duplicates that the next run removes);
+    # with `source`, the unsharded database, rows are copied and the source
+    # is left as it was. Also the fix after a crash mid-move: rebalance to
+    # the same count. -> report dict
+    if not 1 <= count <= MAX_SHARDS:
+        raise ValueError(f"shard count must be between 1 and {MAX_SHARDS}")
+    report = {"shards": count, "moved": 0, "copied": 0, "conflicts": [], "removed": []}
+    old = existing_shards(base)
+    sources = [source] if source else old
+    targets = [shard_path(base, i) for i in range(count)]
+    conns = {}
+    try:
+        for path in set(sources) | set(targets):
+            conns[path] = _connect(path, readonly=path == source)
+        for path in targets:
+            init_schema(conns[path])
+        # every target starts issuing ids above all ids in use anywhere
+        high = max(_high_mark(conns[p]) for p in conns)
+
+        for path in sources:
+            src = conns[path]
+            copy = path == source
+            after = 0
+            while True:
+                rows = src.execute("SELECT id, email, password FROM users WHERE id > ? "
+                                   "ORDER BY id LIMIT ?", (after, batch)).fetchall()
+                if not rows:
+                    break
+                after = rows[-1][0]
+                groups = {}
+                for row in rows:
+                    target = targets[shard_for(row[1], count)]
+                    if target != path:
+                        groups.setdefault(target, []).append(row)
+                done = []
+                for target, group in groups.items():
+                    dst = conns[target]
+                    dst.executemany("INSERT OR IGNORE INTO users (id, email, password) "
+                                    "VALUES (?, ?, ?)", group)
+                    dst.commit()
+                    # present under its own id: moved now or by an earlier run;
+                    # otherwise another user already has the email there
+                    ids = [r[0] for r in group]
+                    present = {r[0] for r in dst.execute(
+                        f"SELECT id FROM users WHERE id IN ({','.join('?' * len(ids))})", ids)}
+                    for row in group:
+                        if row[0] in present:
+                            done.append(row[0])
+                        else:
+                            report["conflicts"].append({"id": row[0], "email": row[1], "file": path})
+                if copy:
+                    report["copied"] += len(done)
+                elif done:
+                    src.execute(f"DELETE FROM users WHERE id IN ({','.join('?' * len(done))})", done)
+                    src.commit()
+                    report["moved"] += len(done)
+            log(f"{path}: done")
+
+        for i, path in enumerate(targets):
+            conn = conns[path]
+            conn.execute("CREATE TABLE IF NOT EXISTS shard_meta (name TEXT PRIMARY KEY, "
+                         "value INTEGER NOT NULL)")
+            conn.execute("INSERT OR REPLACE INTO shard_meta (name, value) VALUES ('index', ?), ('count', ?)",
+                         (i, count))
+            if conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'users'",
+                            (high,)).rowcount == 0:
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('users', ?)", (high,))
+            conn.commit()
+
+        # shard files beyond the new count go once they are empty
+        for path in old:
+            if path in targets:
+                continue
+            left = conns[path].execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            if left:
+                log(f"{path}: {left} users could not move, kept")
+                continue
+            conns.pop(path).close()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            report["removed"].append(path)
+        report["per_shard"] = [conns[p].execute("SELECT COUNT(*) FROM users").fetchone()[0]
+                               for p in targets]
+    finally:
+        for conn in conns.values():
+            conn.close()
+    return report
+
+
+def status(base):
+    out = []
+    for path in existing_shards(base):
+        # a report: opened read-only, like a rebalance's source
+        conn = _connect(path, readonly=True)
+        try:
+            meta = dict(conn.execute("SELECT name, value FROM shard_meta").fetchall())
+            out.append({"file": path, "index": meta.get("index"), "count": meta.get("count"),
+                        "users": user_count(conn)})
+        except sqlite3.OperationalError:
+            out.append({"file": path, "index": None, "count": None, "users": None})
+        finally:
+            conn.close()
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Sharded user storage: layout and rebalancing")
+    ap.add_argument("--base", default="users.db", help="unsharded path the shard names derive from")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="shard files, their layout and user counts")
+    rb = sub.add_parser("rebalance", help="move users to their shards for a new shard count")
+    rb.add_argument("--to", type=int, required=True, help="shard count to end up with")
+    rb.add_argument("--from", dest="source", help="copy users in from this unsharded database")
+    rb.add_argument("--batch", type=int, default=REBALANCE_BATCH)
+    args = ap.parse_args()
+
+    if args.command == "status":
+        for s in status(args.base):
+            print(f"{s['file']:24} shard {s['index']} of {s['count']}  {s['users']} users")
+    else:
+        report = rebalance(args.base, args.to, args.source, args.batch,
+                           log=lambda line: print(line, file=sys.stderr))
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,191 @@
+import json
+import logging
+import logging.handlers
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# ---------- SETTINGS ----------
+# 0 turns the slow-query log (and the per-connection hooks) off
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", "slow_queries.jsonl")
+SLOW_QUERY_LOG_BYTES = int(os.environ.get("SLOW_QUERY_LOG_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get("SLOW_QUERY_LOG_BACKUPS", "5"))
+PROGRESS_STEPS = 1000   # VM instructions between progress-handler calls
+
+PLANNABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_TARGET = re.compile(r"^\s*(INSERT|REPLACE|UPDATE|DELETE)(?:\s+OR\s+\w+)?(?:\s+INTO|\s+FROM)?"
+                     r"\s+[\"`\[]?(\w+)", re.IGNORECASE)
+_EVENT = re.compile(r"\b(?:BEFORE|AFTER|OF)\s+(INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    # literals -> ?, whitespace collapsed, so the same query groups together
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(?, ...)", sql)   # chunked IN lists of any length group as one
+    return _SPACE.sub(" ", sql).strip()
+
+
+# ---------- OUTPUT ----------
+_logger = None
+_logger_lock = threading.Lock()
+
+def _log():
+    # one rotating JSONL file per process, opened on the first slow query
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            handler = logging.handlers.RotatingFileHandler(
+                SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_BYTES,
+                backupCount=SLOW_QUERY_LOG_BACKUPS, delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _logger = logging.getLogger("slow_queries")
+            _logger.setLevel(logging.INFO)
+            _logger.propagate = False
+            _logger.addHandler(handler)
+        return _logger
+
+
+# ---------- HOOKS ----------
+class ConnectionTrace:
+    # Per-connection counters fed by sqlite3's callbacks: the progress handler
+    # counts VM instructions (in PROGRESS_STEPS units) and the trace callback
+    # counts statement starts. sqlite3 reports a trigger sub-program as
+    # another start of the outer statement, so more than one means triggers ran.
+
+    def __init__(self):
+        self.steps = 0
+        self.starts = 0
+
+    def progress(self):
+        self.steps += 1
+
+    def trace(self, statement):
+        self.starts += 1
+
+
+def attach(raw, path):
+    if SLOW_QUERY_MS <= 0:
+        return
+    state = raw.slow_trace = ConnectionTrace()
+    raw.db_path = path
+    raw.set_progress_handler(state.progress, PROGRESS_STEPS)
+    raw.set_trace_callback(state.trace)
+
+
+class Query:
+    # One statement's lifetime: execute() plus every fetch until the cursor
+    # is exhausted, closed or re-used.
+
+    __slots__ = ("conn", "state", "sql", "params", "seconds", "rows", "steps", "starts")
+
+    def __init__(self, conn, sql, params):
+        self.conn = conn
+        self.state = conn.slow_trace
+        self.sql = sql
+        self.params = params
+        self.seconds = 0.0
+        self.rows = 0
+        self.steps = self.state.steps
+        self.starts = self.state.starts
+
+    def add(self, seconds, rows):
+        self.seconds += seconds
+        self.rows += rows
+
+    def finish(self, rows=None):
+        if rows is not None:
+            self.rows = rows
+        ms = self.seconds * 1000
+        if ms < SLOW_QUERY_MS:
+            return
+        record = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "db": os.path.basename(getattr(self.conn, "db_path", "")),
+            "sql": normalize_sql(self.sql),
+            "ms": round(ms, 3),
+            "rows": self.rows,
+            "vm_steps": (self.state.steps - self.steps) * PROGRESS_STEPS,
+            "triggers": self.triggers(),
+            "plan": self.plan(),
+        }
+        _log().info(json.dumps(record))
+
+    def triggers(self):
+        # the write target's triggers for this statement's event, when the
+        # trace saw sub-programs run
+        match = _TARGET.match(self.sql)
+        if match is None or self.state.starts - self.starts <= 1:
+            return []
+        verb = match.group(1).upper()
+        events = ("INSERT", "DELETE") if verb == "REPLACE" else (verb,)
+        cur = sqlite3.Cursor(self.conn)
+        cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? "
+                    "ORDER BY name", (match.group(2),))
+        out = []
+        for name, sql in cur.fetchall():
+            event = _EVENT.search(sql or "")
+            if event and event.group(1).upper() in events:
+                out.append(name)
+        return out
+
+    def plan(self):
+        head = self.sql.lstrip()[:8].upper()
+        if not head.startswith(PLANNABLE) or not isinstance(self.params, (tuple, list, dict)):
+            return None
+        # a plain cursor, so the EXPLAIN itself is neither timed nor logged
+        try:
+            cur = sqlite3.Cursor(self.conn)
+            cur.execute("EXPLAIN QUERY PLAN " + self.sql, self.params)
+            return [row[3] for row in cur.fetchall()]
+        except sqlite3.Error as e:
+            return [f"unavailable: {e}"]
+
+
+def start(conn, sql, params=()):
+    if getattr(conn, "slow_trace", None) is None:
+        return None
+    return Query(conn, sql, params)
+
+
+# ---------- REPORT ----------
+def summarize(path=SLOW_QUERY_LOG, top=20):
+    # group the log by normalized SQL: count, total and worst time, last plan
+    groups = {}
+    for name in [f"{path}.{i}" for i in range(SLOW_QUERY_LOG_BACKUPS, 0, -1)] + [path]:
+        if not os.path.exists(name):
+            continue
+        with open(name) as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                g = groups.setdefault(rec["sql"], {"sql": rec["sql"], "count": 0,
+                                                   "total_ms": 0.0, "max_ms": 0.0})
+                g["count"] += 1
+                g["total_ms"] += rec["ms"]
+                g["max_ms"] = max(g["max_ms"], rec["ms"])
+                g["plan"] = rec.get("plan")
+    return sorted(groups.values(), key=lambda g: g["total_ms"], reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Summarize the slow-query log by statement")
+    ap.add_argument("log", nargs="?", default=SLOW_QUERY_LOG)
+    ap.add_argument("--top", type=int, default=20)
+    args = ap.parse_args()
+    for g in summarize(args.log, args.top):
+        print(f"{g['count']:6d}x  total {g['total_ms']:10.1f}ms  max {g['max_ms']:8.1f}ms  {g['sql']}")
+        for step in g.get("plan") or ():
+            print(f"{'':10}{step}")
@@ -0,0 +1,44 @@
+import json
+import os
+
+# ---------- SETTINGS ----------
+STREAM_BATCH = int(os.environ.get("STREAM_BATCH", "1000"))
+NDJSON = "application/x-ndjson"
+
+
+def wants_stream(accept, stream_arg):
+    return NDJSON in (accept or "") or (stream_arg or "").lower() in ("1", "true", "yes")
+
+
+# ---------- NDJSON ----------
+def stream_users(pool, after=None, descending=False, where="", params=(),
+                 columns="id, email", table="users", key="id", batch=STREAM_BATCH):
+    # Generator of NDJSON chunks, one keyset query of `batch` rows each, so
+    # memory stays at one batch of rows however large the table is. A pooled
+    # connection is held only while a batch is read, never while a slow
+    # client drains the response; each batch sees the rows committed by then.
+    op, order = ("<", "DESC") if descending else (">", "ASC")
+    dumps = json.dumps
+    while True:
+        clauses = [where] if where else []
+        args = list(params)
+        if after is not None:
+            clauses.append(f"{key} {op} ?")
+            args.append(after)
+        sql = f"SELECT {columns} FROM {table}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(f"({c})" for c in clauses)
+        sql += f" ORDER BY {key} {order} LIMIT ?"
+        args.append(batch)
+
+        conn = pool.connection()
+        try:
+            rows = conn.execute(sql, args).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            return
+        yield "".join(dumps({"id": r[0], "email": r[1]}) + "\n" for r in rows)
+        if len(rows) < batch:
+            return
+        after = rows[-1][0]
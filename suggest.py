@@ -0,0 +1,180 @@
+import bisect
+import os
+import sys
+import threading
+import time
+
+from changes import current_seq
+from events import get_hub
+
+# ---------- SETTINGS ----------
+SUGGEST_LIMIT = int(os.environ.get("SUGGEST_LIMIT", "10"))
+MAX_SUGGEST_LIMIT = 100
+
+
+def normalize(email):
+    return email.strip().lower()
+
+
+# ---------- INDEX ----------
+class SuggestIndex:
+    # Every email, lowercased, in one sorted list (with ids in a parallel
+    # list, ties ordered by id), so a prefix lookup is a bisect plus a short
+    # slice and never touches SQLite. It loads once and then follows the
+    # event hub, so every write path keeps it current.
+
+    def __init__(self, pool, hub=None):
+        self.pool = pool
+        self.hub = hub or get_hub(pool)
+        self.seq = 0
+        self.load_seconds = 0.0
+        self._keys = []
+        self._ids = []
+        self._emails = {}
+        self._lock = threading.Lock()
+        self._sub = None
+        self._thread = None
+
+    def start(self):
+        self._subscribe()
+        self._thread = threading.Thread(target=self._follow, name="suggest-index", daemon=True)
+        self._thread.start()
+        return self
+
+    def _subscribe(self):
+        # subscribe before loading, so nothing written in between is missed
+        self._sub = self.hub.subscribe()
+        self.load()
+        self.hub.resume(self.seq)
+
+    def load(self):
+        t0 = time.perf_counter()
+        conn = self.pool.connection()
+        try:
+            # seq and rows from the same snapshot
+            conn.execute("BEGIN")
+            seq = current_seq(conn)
+            rows = conn.execute("SELECT id, email FROM users").fetchall()
+            conn.rollback()
+        finally:
+            conn.close()
+        entries = sorted((normalize(email), uid, email) for uid, email in rows)
+        keys = [key for key, _, _ in entries]
+        ids = [uid for _, uid, _ in entries]
+        # share the key string when the stored email is already normalized
+        emails = {uid: key if key == email else email for key, uid, email in entries}
+        with self._lock:
+            self._keys, self._ids, self._emails = keys, ids, emails
+            self.seq = seq
+        self.load_seconds = time.perf_counter() - t0
+
+    def _follow(self):
+        while True:
+            events = self._sub.get()
+            if events is None:
+                # evicted (or the hub lost track): reload from the database
+                self._subscribe()
+                continue
+            for event in events:
+                if event["op"] == "reset":
+                    self.load()
+                elif event["seq"] > self.seq:
+                    self.apply(event)
+
+    # -- updates --
+    def _position(self, key, uid):
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_right(self._keys, key, lo)
+        return bisect.bisect_left(self._ids, uid, lo, hi)
+
+    def _remove(self, uid):
+        email = self._emails.pop(uid, None)
+        if email is None:
+            return
+        i = self._position(normalize(email), uid)
+        del self._keys[i]
+        del self._ids[i]
+
+    def _add(self, uid, email):
+        key = normalize(email)
+        i = self._position(key, uid)
+        self._keys.insert(i, key)
+        self._ids.insert(i, uid)
+        self._emails[uid] = key if key == email else email
+
+    def apply(self, change):
+        # one user_changes entry: {"seq", "op", "id", "email"}
+        with self._lock:
+            self._remove(change["id"])
+            if change["op"] != "delete":
+                self._add(change["id"], change["email"])
+            self.seq = max(self.seq, change["seq"])
+
+    # -- lookups --
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        prefix = normalize(prefix or "")
+        limit = max(1, min(int(limit or SUGGEST_LIMIT), MAX_SUGGEST_LIMIT))
+        out = []
+        with self._lock:
+            keys, ids, emails = self._keys, self._ids, self._emails
+            i = bisect.bisect_left(keys, prefix)
+            for j in range(i, min(i + limit, len(keys))):
+                if not keys[j].startswith(prefix):
+                    break
+                out.append({"id": ids[j], "email": emails[ids[j]]})
+        return out
+
+    def memory(self):
+        # bytes held by the index: both lists, the id map and every string
+        # and int they own (shared key/email strings counted once)
+        getsizeof = sys.getsizeof
+        with self._lock:
+            size = getsizeof(self._keys) + getsizeof(self._ids) + getsizeof(self._emails)
+            for key, uid in zip(self._keys, self._ids):
+                size += getsizeof(key) + getsizeof(uid)
+                email = self._emails[uid]
+                if email is not key:
+                    size += getsizeof(email)
+        return size
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._keys)
+        return {"entries": entries, "bytes": self.memory(), "seq": self.seq,
+                "load_seconds": round(self.load_seconds, 4)}
+
+    def _after_fork(self):
+        # The entries came across copy-on-write; follow the (reset) hub again
+        # from where the parent had got to. Caught mid-update, reload instead.
+        torn = self._lock.locked()
+        self._lock = threading.Lock()
+        if self._thread is None:
+            return
+        if torn:
+            self._subscribe()
+        else:
+            self._sub = self.hub.subscribe()
+            self.hub.resume(self.seq)
+        self._thread = threading.Thread(target=self._follow, name="suggest-index", daemon=True)
+        self._thread.start()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_suggest_index(pool):
+    with _indexes_lock:
+        index = _indexes.get(pool.path)
+        if index is None:
+            index = _indexes[pool.path] = SuggestIndex(pool).start()
+        return index
+
+
+def _after_fork():
+    # registered after events.py's hook, so the hubs are already reset
+    global _indexes_lock
+    _indexes_lock = threading.Lock()
+    for index in _indexes.values():
+        index._after_fork()
+
+os.register_at_fork(after_in_child=_after_fork)
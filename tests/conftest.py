@@ -0,0 +1,34 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# the modules live flat in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# read at import time: derive hashes inline, and keep the apps' access log
+# out of the working directory
+os.environ.setdefault("HASH_WORKERS", "0")
+os.environ.setdefault("ACCESS_LOG", "")
+
+
+def import_app(name, tmp_path_factory):
+    # imported once per run, against a users.db of its own (the apps open it
+    # in the working directory)
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp(name))
+    try:
+        return importlib.import_module(name)
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def app3(tmp_path_factory):
+    return import_app("app3", tmp_path_factory)
+
+
+@pytest.fixture(scope="session")
+def app6_api(tmp_path_factory):
+    return import_app("app6_api", tmp_path_factory)
@@ -0,0 +1,103 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from flask import Flask, Response
+
+from accesslog import AccessLog, RouteStats, access_log_flask, analyze, entry, get_access_log, log_files
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def records(*paths):
+    return [json.loads(line) for p in paths for line in open(p)]
+
+
+# ---------- WRITER ----------
+def test_records_reach_the_file(tmp_path):
+    path = str(tmp_path / "access.jsonl")
+    log = AccessLog(path)
+    for i in range(50):
+        log.record(entry("GET", "/api/users/<int:user_id>", 200, 0.002, 10, str(i)))
+    log.close()
+    written = records(path)
+    assert len(written) == 50 == log.stats()["written"]
+    assert written[7] == dict(written[7], method="GET", ms=2.0, bytes=10, target_id=7)
+
+
+def test_rotation_keeps_every_record(tmp_path):
+    path = str(tmp_path / "access.jsonl")
+    log = AccessLog(path, max_bytes=2000, backups=3)
+    for i in range(40):
+        log.record(entry("GET", "/x", 200, 0.001, 1, i))
+        if i % 10 == 9:
+            log.close()   # flush this batch before the next, so each write can rotate
+            log = AccessLog(path, max_bytes=2000, backups=3)
+    log.close()
+    files = log_files(path)
+    assert files[-1] == path and len(files) > 1
+    assert [r["target_id"] for r in records(*files)] == list(range(40))
+
+
+# ---------- HTTP ----------
+def test_flask_requests_are_logged_in_full(tmp_path):
+    path = str(tmp_path / "flask.jsonl")
+    app = Flask("logged")
+    access_log_flask(app, path)
+
+    @app.route("/users/<int:user_id>")
+    def user(user_id):
+        return {"id": user_id}
+
+    @app.route("/stream")
+    def stream():
+        return Response(iter(["a" * 100, "b" * 50]), mimetype="text/plain")
+
+    client = app.test_client()
+    for url in ("/users/5", "/stream", "/nowhere"):
+        with client.get(url) as r:   # records are queued when the body is closed
+            r.get_data()
+    get_access_log(path).close()
+    by_route = {r["route"]: r for r in records(path)}
+    assert by_route["/users/<int:user_id>"]["target_id"] == 5
+    assert by_route["/stream"]["bytes"] == 150
+    assert by_route["unmatched"]["status"] == 404
+
+
+# ---------- ANALYZER ----------
+def test_percentiles_within_the_bucket_error():
+    stats = RouteStats()
+    for ms in range(1, 1001):
+        stats.add(float(ms), 500 if ms % 100 == 0 else 200, 10)
+    assert stats.count == 1000 and stats.errors == 10 and stats.bytes == 10_000
+    assert stats.percentile(0.5) == pytest.approx(500, rel=0.02)
+    assert stats.percentile(0.99) == pytest.approx(990, rel=0.02)
+    assert stats.percentile(1.0) <= stats.max_ms == 1000
+
+
+@pytest.fixture
+def logfile(tmp_path):
+    path = tmp_path / "access.jsonl"
+    lines = [json.dumps({"method": "GET", "route": "/a", "status": 200, "ms": ms, "bytes": 1})
+             for ms in (1, 2, 3, 40)]
+    lines += [json.dumps({"method": "POST", "route": "/b", "status": 503, "ms": 7}), "garbage", "{}"]
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+def test_analyze(logfile):
+    routes, slowest = analyze([str(logfile)], top=2)
+    assert sorted(routes) == ["GET /a", "POST /b"]
+    assert (routes["GET /a"].count, routes["POST /b"].errors) == (4, 1)
+    assert [r["ms"] for r in slowest] == [40, 7]
+    routes, _ = analyze([str(logfile)], route="/b")
+    assert list(routes) == ["POST /b"]
+
+
+def test_cli(logfile):
+    out = subprocess.run([sys.executable, os.path.join(ROOT, "accesslog.py"), str(logfile), "--top", "1"],
+                         capture_output=True, text=True, check=True, timeout=60).stdout
+    assert "GET /a" in out and "POST /b" in out
+    assert "slowest 1 requests" in out
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from async_db import AsyncDB
+from database import ConnectionPool, init_schema
+
+
+@pytest.fixture
+def adb(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "users.db"), size=2)
+    conn = pool.connection()
+    init_schema(conn)
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, 'x')",
+                     [(f"u{i}@example.com",) for i in range(5)])
+    conn.commit()
+    conn.close()
+    adb = AsyncDB(pool, workers=2)
+    yield adb
+    adb.shutdown()
+
+
+def count(conn):
+    return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+
+def test_run_lends_a_connection(adb):
+    assert asyncio.run(adb.run(count)) == 5
+    assert adb.pool.stats()["in_use"] == 0
+
+
+def test_calls_run_on_the_db_threads(adb):
+    name = asyncio.run(adb.call(lambda: threading.current_thread().name))
+    assert name.startswith("db")
+
+
+def test_the_loop_keeps_running(adb):
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await adb.call(time.sleep, 0.2)   # a slow query, say
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(main()) >= 5
+
+
+def test_iterate_closes_what_it_drives(adb):
+    closed = []
+
+    def rows():
+        try:
+            for i in range(10):
+                yield i
+        finally:
+            closed.append(threading.current_thread().name)
+
+    async def main():
+        seen = []
+        async for row in adb.iterate(rows()):
+            seen.append(row)
+            if row == 2:
+                break
+        return seen
+
+    assert asyncio.run(main()) == [0, 1, 2]
+    assert closed and closed[0].startswith("db")
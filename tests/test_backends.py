@@ -0,0 +1,82 @@
+import sqlite3
+
+import pytest
+
+from backends import MemoryBackend, SQLiteBackend
+from bulk import parse_changes
+from database import ConnectionPool, init_schema
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "users.db"))
+    conn = pool.connection()
+    init_schema(conn)
+    conn.commit()
+    conn.close()
+    return SQLiteBackend(pool)
+
+
+def test_duplicate_check_sees_other_processes(sqlite_backend):
+    store = sqlite_backend
+    uid = store.create("gone@example.com", "x")
+    assert store.get(uid) == (uid, "gone@example.com")   # now cached
+    # another worker deletes it; this process's cache has not heard yet
+    other = sqlite3.connect(store.pool.path)
+    other.execute("DELETE FROM users WHERE id = ?", (uid,))
+    other.commit()
+    other.close()
+    assert store.find_email("gone@example.com") is None
+    assert store.create("gone@example.com", "x") > uid
+
+
+# ---------- PARITY ----------
+# the same calls against users.db and against the in-memory engine give the
+# same answers, cursors, errors and reports
+
+EMAILS = ["ann@example.com", "bob@example.org", "Mixed@Example.org", "annie@example.com",
+          "carl@test.io", "dana@example.org", "ann.b@example.net", "eve@test.io"]
+
+
+def transcript(store):
+    out = []
+    ids = [store.create(e, "x") for e in EMAILS]
+    out.append(ids)
+    with pytest.raises(sqlite3.IntegrityError):
+        store.create("bob@example.org", "x")
+    out += [store.get(3), store.get(99), store.find_email("carl@test.io"), store.find_email("nobody@test.io")]
+
+    version = store.version()
+    out.append(store.update(4, "annie@example.net"))
+    out.append(store.version() != version)
+    with pytest.raises(sqlite3.IntegrityError):
+        store.update(4, "ann@example.com")
+    out += [store.update(99, "x@example.com"), store.get(4)]
+    out += [store.delete(2), store.delete(2), store.create("new@example.com", "x"), store.count()]
+
+    # keyset pages, both ways, and back again from a cursor
+    first = store.page(3)
+    second = store.page(3, after=first.next_after)
+    out += [first, second, store.page(3, before=second.prev_before), store.page(3, descending=True),
+            store.page(3, after=second.next_after, descending=True)]
+    for q, prefix in (("example", False), ("ann", True), ("ann", False), ("mixed", False), ("zzz", False)):
+        found = store.search(q, 2, prefix=prefix)
+        out += [found, store.search(q, 2, after=found.next_after, prefix=prefix)]
+    out.append(b"".join(c if isinstance(c, bytes) else c.encode() for c in store.stream(q="example")))
+
+    out.append(store.bulk_delete(("search", "test.io"), dry_run=True))
+    out.append(store.bulk_delete(("id_range", (5, 6))))
+    out.append(store.bulk_delete(("ids", [1, 5, 99])))
+    swap = parse_changes({"replace_domain": {"from": "example.org", "to": "example.net"}}, None)
+    out.append(store.bulk_update(("search", "example"), swap, dry_run=True))
+    out.append(store.bulk_update(("search", "example"), swap))
+    clash = parse_changes({"replace_domain": {"from": "example.net", "to": "example.com"}}, None)
+    store.create("ann.b@example.com", "x")
+    with pytest.raises(sqlite3.IntegrityError):
+        store.bulk_update(("ids", [3, 7]), clash)
+    out += [store.page(20), store.count()]
+    return out
+
+
+def test_memory_backend_matches_sqlite(sqlite_backend):
+    assert transcript(MemoryBackend()) == transcript(sqlite_backend)
@@ -0,0 +1,77 @@
+import json
+import os
+import subprocess
+import sys
+
+from bench_apps import compare, load_runs, report, run_operation, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(results, users=1000, mode="inprocess"):
+    return {"bench": "apps", "users": users, "mode": mode, "results": results}
+
+
+# ---------- MEASURE ----------
+def test_summary():
+    summary = summarize([i / 1000 for i in range(100, 0, -1)], 3, 2.0)
+    assert summary == {"requests": 100, "errors": 3, "rps": 50.0,
+                       "p50_ms": 51.0, "p95_ms": 96.0, "p99_ms": 100.0}
+    assert summarize([], 0, 0)["p95_ms"] is None
+
+
+def test_run_operation_counts_every_call():
+    class Client:
+        def request(self, method, path, body):
+            return 500 if path.endswith("/3") else 200
+
+        def close(self):
+            pass
+
+    seen = []
+    summary = run_operation(Client, lambda i, n: seen.append(i) or ("GET", f"/x/{i}", None),
+                            users=10, requests=20, concurrency=4, start=1)
+    assert (summary["requests"], summary["errors"]) == (20, 1)
+    assert sorted(seen) == list(range(1, 21))
+
+
+# ---------- COMPARE ----------
+def test_regressions_past_the_threshold():
+    base = run({"app3": {"list": {"rps": 1000, "p95_ms": 2.0}, "create": None}})
+    new = run({"app3": {"list": {"rps": 850, "p95_ms": 2.1}, "create": {"rps": 1, "p95_ms": 1}},
+               "app": {"list": {"rps": 1, "p95_ms": 1}}})
+    assert compare(base, new, 0.10) == [("app3", "list", "rps", 1000, 850)]
+    assert compare(base, new, 0.20) == []
+
+
+def test_report_exit_code(capsys):
+    base = run({"app3": {"list": {"rps": 1000, "p95_ms": 2.0}}})
+    assert report(base, run({"app3": {"list": {"rps": 1000, "p95_ms": 3.0}}}, users=10), 0.10) == 1
+    out = capsys.readouterr().out
+    assert "warning: comparing 1000/inprocess/sqlite against 10/inprocess/sqlite" in out
+    assert "REGRESSION app3 list p95_ms: 2.0 -> 3.0" in out
+    assert report(base, base, 0.10) == 0
+
+
+def test_load_runs_skips_other_benches(tmp_path):
+    path = tmp_path / "out.txt"
+    path.write_text("\n".join(json.dumps(r) for r in [run({}), {"bench": "serve"}, run({}, 5)]) + "\n\n")
+    assert [r["users"] for r in load_runs(path)] == [1000, 5]
+
+
+# ---------- CLI ----------
+def test_two_runs_then_compare(tmp_path):
+    env = dict(os.environ, HASH_WORKERS="0", ACCESS_LOG="")
+    bench = [sys.executable, os.path.join(ROOT, "bench_apps.py"), "--output", "out.txt"]
+    for _ in range(2):
+        subprocess.run(bench + ["--apps", "app3,app", "--users", "50", "--requests", "5",
+                                "--warmup", "1", "--ops", "list,create", "--scrypt-n", "256"],
+                       cwd=tmp_path, env=env, check=True, capture_output=True, timeout=120)
+    runs = load_runs(tmp_path / "out.txt")
+    assert len(runs) == 2
+    assert runs[-1]["results"]["app3"]["list"]["errors"] == 0
+    assert runs[-1]["results"]["app"]["create"]["requests"] == 5
+    done = subprocess.run(bench + ["--compare", "--threshold", "100"], cwd=tmp_path, env=env,
+                          capture_output=True, text=True, timeout=60)
+    assert done.returncode == 0, done.stdout + done.stderr
+    assert "no regressions" in done.stdout
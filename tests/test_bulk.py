@@ -0,0 +1,105 @@
+import sqlite3
+
+import pytest
+
+from bulk import bulk_delete, bulk_update, parse_changes, parse_selector
+from database import ConnectionPool, init_schema
+from hashing import PasswordHasher
+
+hasher = PasswordHasher(workers=0, n=2 ** 8)
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = ConnectionPool(str(tmp_path / "users.db")).connection()
+    init_schema(conn)
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, 'x')",
+                     [(f"u{i}@old.com",) for i in range(1, 11)] + [("keep@other.com",)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def emails(conn):
+    return [e for (e,) in conn.execute("SELECT email FROM users ORDER BY id")]
+
+
+# ---------- PARSING ----------
+def test_selectors():
+    assert parse_selector({"ids": [3, "1", 3]}) == ("ids", [1, 3])
+    assert parse_selector({"id_range": [2, 5]}) == ("id_range", (2, 5))
+    assert parse_selector({"search": "old", "ids": []}) == ("search", "old")
+
+
+@pytest.mark.parametrize("body", [
+    [1, 2], "ids", {}, {"ids": [1], "search": "x"}, {"ids": 1}, {"id_range": "12"},
+    {"id_range": [5, 2]},
+])
+def test_bad_selectors(body):
+    with pytest.raises(ValueError):
+        parse_selector(body)
+
+
+@pytest.mark.parametrize("body", [
+    {"set": "x"}, {"set": ["password"]}, {"replace_domain": "new.com"}, {},
+    {"set": {"password_hash": "plain"}},
+])
+def test_bad_changes(body):
+    with pytest.raises(ValueError):
+        parse_changes(body, hasher)
+
+
+def test_dry_run_skips_the_hash():
+    changes = parse_changes({"set": {"password": "pw"}}, hasher, dry_run=True)
+    assert changes.password == "dry-run"
+
+
+# ---------- APPLY ----------
+def test_delete_dry_run_then_apply(conn):
+    dry = bulk_delete(conn, ("id_range", (2, 4)), dry_run=True)
+    assert (dry["matched"], dry["affected"], dry["dry_run"]) == (3, 3, True)
+    assert len(emails(conn)) == 11
+    done = bulk_delete(conn, ("id_range", (2, 4)))
+    assert done["affected"] == 3
+    assert [s["id"] for s in done["sample"]] == [2, 3, 4]
+    assert len(emails(conn)) == 8
+
+
+def test_domain_swap(conn):
+    changes = parse_changes({"replace_domain": {"from": "OLD.com", "to": "new.com"}}, hasher)
+    result = bulk_update(conn, ("ids", [1, 2, 11]), changes)
+    # matched by the selector, changed only where the domain is the old one
+    assert (result["matched"], result["affected"]) == (3, 2)
+    assert emails(conn)[:3] == ["u1@new.com", "u2@new.com", "u3@old.com"]
+    assert emails(conn)[-1] == "keep@other.com"
+
+
+def test_password_for_a_search(conn):
+    changes = parse_changes({"set": {"password": "pw"}}, hasher)
+    assert bulk_update(conn, ("search", "u1"), changes)["affected"] == 2   # u1, u10
+    stored = dict(conn.execute("SELECT email, password FROM users"))
+    assert hasher.verify("pw", stored["u10@old.com"])[0]
+    assert stored["u2@old.com"] == "x"
+
+
+def test_conflict_changes_nothing(conn):
+    conn.execute("INSERT INTO users (email, password) VALUES ('u1@new.com', 'x')")
+    conn.commit()
+    changes = parse_changes({"replace_domain": {"from": "old.com", "to": "new.com"}}, hasher)
+    with pytest.raises(sqlite3.IntegrityError):
+        bulk_update(conn, ("id_range", (1, 10)), changes)
+    assert emails(conn)[:10] == [f"u{i}@old.com" for i in range(1, 11)]
+
+
+# ---------- HTTP ----------
+@pytest.mark.parametrize("route, body", [
+    ("bulk-update", {"set": "x", "ids": [1]}),
+    ("bulk-update", [1]),
+    ("bulk-update", {"replace_domain": "new.com", "ids": [1]}),
+    ("bulk-delete", [1]),
+    ("bulk-delete", {"ids": "1"}),
+])
+def test_bad_bodies_are_400(app3, route, body):
+    r = app3.app.test_client().post(f"/api/users/{route}", json=body)
+    assert r.status_code == 400
+    assert "error" in r.get_json()
@@ -0,0 +1,68 @@
+import pytest
+
+from changes import changes_since, current_seq
+from database import ConnectionPool, init_schema
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = ConnectionPool(str(tmp_path / "users.db")).connection()
+    init_schema(conn)
+    yield conn
+    conn.close()
+
+
+def write(conn, sql, *params):
+    conn.execute(sql, params)
+    conn.commit()
+
+
+def test_feed_records_every_visible_change(conn):
+    start = current_seq(conn)
+    write(conn, "INSERT INTO users (email, password) VALUES ('a@example.com', 'x')")
+    write(conn, "UPDATE users SET password = 'y' WHERE id = 1")   # not visible in listings
+    write(conn, "UPDATE users SET email = 'b@example.com' WHERE id = 1")
+    write(conn, "DELETE FROM users WHERE id = 1")
+    feed = changes_since(conn, start)
+    assert [(c["op"], c["id"], c["email"]) for c in feed["changes"]] == [
+        ("insert", 1, "a@example.com"), ("update", 1, "b@example.com"), ("delete", 1, None)]
+    assert (feed["next"], feed["more"], feed["reset"]) == (current_seq(conn), False, False)
+    # caught up: nothing new, same position
+    assert changes_since(conn, feed["next"]) == {
+        "changes": [], "next": feed["next"], "more": False, "reset": False}
+
+
+def test_no_position_starts_at_the_head(conn):
+    write(conn, "INSERT INTO users (email, password) VALUES ('a@example.com', 'x')")
+    assert changes_since(conn, None) == {"changes": [], "next": 1, "more": False, "reset": False}
+
+
+def test_pages(conn):
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, 'x')",
+                     [(f"u{i}@example.com",) for i in range(5)])
+    conn.commit()
+    first = changes_since(conn, 0, limit=2)
+    assert [c["seq"] for c in first["changes"]] == [1, 2]
+    assert first["more"]
+    second = changes_since(conn, first["next"], limit=2)
+    assert [c["seq"] for c in second["changes"]] == [3, 4]
+    assert not changes_since(conn, second["next"], limit=2)["more"]
+
+
+def test_reset_when_the_log_no_longer_reaches_back(conn):
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, 'x')",
+                     [(f"u{i}@example.com",) for i in range(5)])
+    write(conn, "DELETE FROM user_changes WHERE seq <= 3")   # as the retention trim does
+    assert changes_since(conn, 3)["changes"][0]["seq"] == 4
+    assert changes_since(conn, 2) == {"changes": [], "next": 5, "more": False, "reset": True}
+    # a position from the future (another database, a restored backup)
+    assert changes_since(conn, 99)["reset"]
+
+
+def test_sync_from_the_listing(app3):
+    client = app3.app.test_client()
+    seq = int(client.get("/api/users?limit=1").headers["X-Change-Seq"])
+    client.post("/api/users", json={"email": "feed@example.com", "password": "pw"})
+    feed = client.get(f"/api/users/changes?since={seq}").get_json()
+    assert [(c["op"], c["email"]) for c in feed["changes"]] == [("insert", "feed@example.com")]
+    assert feed["next"] == seq + 1
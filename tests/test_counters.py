@@ -0,0 +1,76 @@
+import sqlite3
+import time
+
+import pytest
+
+from counters import reconcile_user_count, start_reconciler, user_count, users_version
+from database import ConnectionPool, init_schema
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "users.db"), size=1, timeout=0.05)
+    conn = pool.connection()
+    init_schema(conn)
+    conn.commit()
+    conn.close()
+    return pool
+
+
+def test_triggers_keep_count_and_version(pool):
+    conn = pool.connection()
+    try:
+        v0 = users_version(conn)
+        conn.executemany("INSERT INTO users (email, password) VALUES (?, 'x')",
+                         [(f"u{i}@example.com",) for i in range(5)])
+        conn.execute("DELETE FROM users WHERE id = 2")
+        conn.commit()
+        assert user_count(conn) == 4
+        v1 = users_version(conn)
+        assert v1 > v0
+        conn.execute("UPDATE users SET email = 'x@example.com' WHERE id = 1")
+        conn.commit()
+        assert users_version(conn) > v1
+        assert user_count(conn) == 4
+    finally:
+        conn.close()
+
+
+def drift(pool, value):
+    conn = pool.connection()
+    try:
+        conn.execute("UPDATE user_counters SET value = ? WHERE name = 'users'", (value,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_reconcile_fixes_drift(pool):
+    drift(pool, 42)
+    conn = pool.connection()
+    try:
+        assert reconcile_user_count(conn) == (42, 0)
+        assert reconcile_user_count(conn) == (0, 0)
+        assert user_count(conn) == 0
+    finally:
+        conn.close()
+
+
+def test_reconciler_survives_a_busy_pool(pool):
+    drift(pool, 7)
+    held = pool.connection()   # the only slot: the next rounds time out
+    thread = start_reconciler(pool, interval=0.02)
+    time.sleep(0.2)
+    assert thread.is_alive()
+    assert pool.stats()["timeouts"] > 0
+    held.close()
+    # watched outside the pool, which the reconciler has to itself now
+    conn = sqlite3.connect(pool.path)
+    try:
+        deadline = time.monotonic() + 5
+        while user_count(conn) != 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert user_count(conn) == 0
+    finally:
+        conn.close()
+    assert thread.is_alive()
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from database import ConnectionPool, PoolTimeout, get_pool, init_schema
+
+
+@pytest.fixture
+def pool(tmp_path):
+    return ConnectionPool(str(tmp_path / "users.db"), size=2, timeout=0.1)
+
+
+# ---------- POOL ----------
+def test_connections_are_tuned(pool):
+    conn = pool.connection()
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1   # NORMAL
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+    finally:
+        conn.close()
+
+
+def test_close_returns_the_connection(pool):
+    a = pool.connection()
+    raw = a.raw
+    a.close()
+    a.close()   # twice is harmless
+    b = pool.connection()
+    assert b.raw is raw
+    b.close()
+    assert pool.stats()["created"] == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        a.execute("SELECT 1")
+
+
+def test_full_pool_waits_then_times_out(pool):
+    held = [pool.connection(), pool.connection()]
+    with pytest.raises(PoolTimeout):
+        pool.connection()
+    # a slot freed while waiting is handed over
+    threading.Timer(0.02, held.pop().close).start()
+    pool.connection().close()
+    stats = pool.stats()
+    assert (stats["waits"], stats["timeouts"], stats["in_use"]) == (2, 1, 1)
+    held[0].close()
+
+
+def test_release_rolls_back_an_open_transaction(pool):
+    conn = pool.connection()
+    init_schema(conn)
+    conn.execute("INSERT INTO users (email, password) VALUES ('a@example.com', 'x')")
+    conn.close()
+    conn = pool.connection()
+    try:
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_with_block_commits_or_rolls_back(pool):
+    with pool.connection() as conn:
+        init_schema(conn)
+        conn.execute("INSERT INTO users (email, password) VALUES ('a@example.com', 'x')")
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO users (email, password) VALUES ('b@example.com', 'x')")
+            raise RuntimeError
+    assert pool.stats()["in_use"] == 0
+    with pool.connection() as conn:
+        assert [e for (e,) in conn.execute("SELECT email FROM users")] == ["a@example.com"]
+
+
+def test_one_pool_per_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert get_pool("users.db") is get_pool(str(tmp_path / "users.db"))
+    assert get_pool("users.db").path == str(tmp_path / "users.db")
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork()")
+def test_forked_child_opens_its_own(tmp_path):
+    pool = get_pool(str(tmp_path / "users.db"))   # registered pools reset on fork
+    parent = pool.connection()
+    parent_raw = parent.raw
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            child = pool.connection()
+            ok = child.raw is not parent_raw and pool.stats()["in_use"] == 1
+            child.close()
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    parent.close()
+    assert pool.stats()["in_use"] == 0
+
+
+# ---------- SCHEMA ----------
+def test_old_databases_get_the_password_column(tmp_path):
+    path = tmp_path / "old.db"
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE NOT NULL)")
+    old.execute("INSERT INTO users (email) VALUES ('a@example.com')")
+    old.commit()
+    old.close()
+    conn = ConnectionPool(str(path)).connection()
+    try:
+        init_schema(conn)
+        init_schema(conn)   # and again, as every app start does
+        assert conn.execute("SELECT email, password FROM users").fetchall() == [("a@example.com", "")]
+        assert conn.execute("SELECT value FROM user_counters WHERE name = 'users'").fetchone()[0] == 1
+    finally:
+        conn.close()
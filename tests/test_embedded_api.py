@@ -0,0 +1,47 @@
+import socket
+import threading
+import urllib.request
+
+import pytest
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_started_once_it_answers(app6_api, monkeypatch):
+    monkeypatch.setattr(app6_api, "API_PORT", free_port())
+    server = app6_api.start_server()
+    try:
+        url = f"http://127.0.0.1:{app6_api.API_PORT}/api/health"
+        with urllib.request.urlopen(url, timeout=1) as r:
+            assert r.status == 200
+    finally:
+        server.should_exit = True
+
+
+# uvicorn's thread exits through SystemExit when it cannot bind
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_port_in_use_fails_fast(app6_api, monkeypatch):
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        monkeypatch.setattr(app6_api, "API_PORT", taken.getsockname()[1])
+        with pytest.raises(RuntimeError, match="in use"):
+            app6_api.start_server()
+
+
+def test_gives_up_after_the_timeout(app6_api):
+    class Server:
+        started = False
+
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait, daemon=True)
+    thread.start()
+    try:
+        with pytest.raises(RuntimeError, match="not ready"):
+            app6_api.wait_ready(Server(), thread, "http://127.0.0.1:9/", timeout=0.05)
+    finally:
+        stop.set()
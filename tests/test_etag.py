@@ -0,0 +1,34 @@
+import pytest
+
+from etag import etag_headers, etag_matches, make_etag
+
+TAG = make_etag(42)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ('W/"users-42"', True), ('"users-42"', True), ('"other", W/"users-42"', True), ("*", True),
+    ('W/"users-41"', False), ("", False), (None, False), ("users-42", False),
+])
+def test_matching(header, expected):
+    assert etag_matches(header, TAG) is expected
+
+
+def test_headers_make_browsers_revalidate():
+    headers = etag_headers(TAG)
+    assert headers["ETag"] == 'W/"users-42"'
+    assert headers["Cache-Control"] == "no-cache"
+
+
+def test_conditional_listing(app3):
+    client = app3.app.test_client()
+    first = client.get("/api/users?limit=5")
+    tag = first.headers["ETag"]
+    again = client.get("/api/users?limit=5", headers={"If-None-Match": tag})
+    assert again.status_code == 304
+    assert again.get_data() == b""
+    assert again.headers["ETag"] == tag
+    # any write moves the version, so the old tag no longer matches
+    client.post("/api/users", json={"email": "etag@example.com", "password": "pw"})
+    changed = client.get("/api/users?limit=5", headers={"If-None-Match": tag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != tag
@@ -0,0 +1,112 @@
+import asyncio
+import gc
+
+import pytest
+
+from database import ConnectionPool, init_schema
+from events import EventHub, StreamsFull, sse_stream
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "users.db"))
+    conn = pool.connection()
+    init_schema(conn)
+    conn.commit()
+    conn.close()
+    return pool
+
+
+def insert(pool, *emails):
+    conn = pool.connection()
+    try:
+        conn.executemany("INSERT INTO users (email, password) VALUES (?, 'x')",
+                         [(e,) for e in emails])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# ---------- STREAM ----------
+def test_fresh_client_starts_at_the_head(pool):
+    insert(pool, "a@example.com", "b@example.com")
+    stream = sse_stream(EventHub(pool), keepalive=0.05)
+    try:
+        assert next(stream) == "retry: 2000\nid: 2\n\n"
+    finally:
+        stream.close()
+
+
+def test_reconnect_replays_from_last_event_id(pool):
+    insert(pool, "a@example.com", "b@example.com", "c@example.com")
+    stream = sse_stream(EventHub(pool), last_event_id="1", keepalive=0.05)
+    try:
+        opening = next(stream)
+    finally:
+        stream.close()
+    assert opening.startswith("retry: 2000\n")
+    assert "id: 1\n" not in opening
+    assert "id: 2\nevent: insert\n" in opening
+    assert '"email": "c@example.com"' in opening
+
+
+def test_unknown_last_event_id_resets(pool):
+    insert(pool, "a@example.com")
+    stream = sse_stream(EventHub(pool), last_event_id="99", keepalive=0.05)
+    try:
+        assert "event: reset" in next(stream)
+    finally:
+        stream.close()
+
+
+def test_live_events_follow_the_opening(pool):
+    hub = EventHub(pool, interval=0.05)
+    stream = sse_stream(hub, keepalive=0.05)
+    try:
+        next(stream)
+        insert(pool, "new@example.com")
+        hub.notify()
+        for chunk in stream:
+            if chunk != ": ping\n\n":
+                break
+        assert chunk.startswith("id: 1\nevent: insert\n")
+    finally:
+        stream.close()
+
+
+# ---------- STREAM SLOTS ----------
+def test_blocking_streams_are_capped(pool):
+    hub = EventHub(pool, max_streams=2)
+    a, b = sse_stream(hub), sse_stream(hub)
+    with pytest.raises(StreamsFull):
+        sse_stream(hub)
+    a.close()
+    c = sse_stream(hub)
+    # a stream dropped without being read gives its slot back too
+    del b
+    gc.collect()
+    d = sse_stream(hub)
+    assert hub.stats()["streams"] == 2
+    assert hub.stats()["refused"] == 1
+    c.close()
+    d.close()
+    assert hub.stats()["streams"] == 0
+
+
+def test_only_streams_are_capped(pool):
+    hub = EventHub(pool, max_streams=0)
+    loop = asyncio.new_event_loop()
+    try:
+        hub.unsubscribe(hub.subscribe(loop))   # asse_stream
+    finally:
+        loop.close()
+    hub.unsubscribe(hub.subscribe())           # the suggest index
+    with pytest.raises(StreamsFull):
+        sse_stream(hub)
+
+
+def test_full_worker_answers_503(app3, monkeypatch):
+    monkeypatch.setattr(app3.hub, "max_streams", 0)
+    r = app3.app.test_client().get("/api/users/events")
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "30"
@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import sqlite3
+
+import pytest
+
+from hashing import SCHEME, WRAPPED_SCHEME, PasswordHasher, is_legacy, upgrade_legacy_hashes
+
+LOW_COST = {"n": 2 ** 8, "r": 8, "p": 1}
+
+
+@pytest.fixture
+def hasher():
+    return PasswordHasher(workers=0, **LOW_COST)
+
+
+def sha256(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+# ---------- FORMATS ----------
+def test_hash_is_salted_scrypt(hasher):
+    a, b = hasher.hash("pw"), hasher.hash("pw")
+    assert a.startswith(f"{SCHEME}$256$8$1$")
+    assert a != b
+    assert hasher.verify("pw", a) == (True, None)
+    assert hasher.verify("other", a) == (False, None)
+
+
+def test_legacy_sha256_verifies_and_upgrades(hasher):
+    ok, replacement = hasher.verify("pw", sha256("pw"))
+    assert ok
+    assert replacement.startswith(SCHEME + "$")
+    assert hasher.verify("pw", replacement) == (True, None)
+    assert hasher.verify("other", sha256("pw")) == (False, None)
+
+
+def test_wrapped_legacy_verifies_and_upgrades(hasher):
+    wrapped = hasher.wrap_legacy(sha256("pw")).result()[0]
+    assert wrapped.startswith(WRAPPED_SCHEME + "$")
+    ok, replacement = hasher.verify("pw", wrapped)
+    assert ok and replacement.startswith(SCHEME + "$")
+    assert hasher.verify("other", wrapped) == (False, None)
+
+
+def test_outdated_cost_is_rehashed(hasher):
+    old = PasswordHasher(workers=0, n=2 ** 7, r=8, p=1).hash("pw")
+    ok, replacement = hasher.verify("pw", old)
+    assert ok
+    assert replacement.startswith(f"{SCHEME}$256$")
+
+
+@pytest.mark.parametrize("stored", ["", "plain", "bcrypt$1$2$3$4$5", "scrypt$1$2"])
+def test_unknown_format_fails(hasher, stored):
+    assert hasher.verify("pw", stored) == (False, None)
+
+
+def test_verify_async(hasher):
+    stored = hasher.hash("pw")
+    assert asyncio.run(hasher.verify_async("pw", stored)) == (True, None)
+    ok, replacement = asyncio.run(hasher.verify_async("pw", sha256("pw")))
+    assert ok and replacement.startswith(SCHEME + "$")
+
+
+# ---------- LEGACY UPGRADE ----------
+def test_upgrade_fits_the_queue(tmp_path):
+    # a queue of 4 that never waits: a batch bigger than it would be refused
+    hasher = PasswordHasher(workers=1, max_pending=4, queue_timeout=0, **LOW_COST)
+    conn = sqlite3.connect(tmp_path / "users.db")
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT, password TEXT)")
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, ?)",
+                     [(f"u{i}@example.com", sha256(f"pw{i}")) for i in range(10)])
+    conn.execute("INSERT INTO users (email, password) VALUES ('new@example.com', ?)",
+                 (hasher.hash("new"),))
+    conn.commit()
+    try:
+        assert upgrade_legacy_hashes(conn, hasher, batch=500) == 10
+        rows = conn.execute("SELECT email, password FROM users ORDER BY id").fetchall()
+    finally:
+        hasher.shutdown()
+        conn.close()
+    assert not any(is_legacy(pw) for _, pw in rows)
+    assert rows[3][1].startswith(WRAPPED_SCHEME + "$")
+    assert hasher.verify("pw3", rows[3][1])[0]
+    assert rows[10][1].startswith(SCHEME + "$")
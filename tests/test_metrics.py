@@ -0,0 +1,78 @@
+import re
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import metrics
+from metrics import Histogram, add_collector, instrument_asgi, render, statement_kind
+
+
+def sample(text, name):
+    # value of one exposition line, by its full name{labels}
+    match = re.search("^" + re.escape(name) + r" (\S+)$", text, re.M)
+    return float(match.group(1)) if match else None
+
+
+# ---------- PRIMITIVES ----------
+def test_histogram_buckets_are_cumulative():
+    h = Histogram("t_seconds", "test", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        h.observe(value, "/x")
+    samples = {name + labels: value for name, labels, value in h.samples()}
+    assert samples['t_seconds_bucket{route="/x",le="0.1"}'] == 2
+    assert samples['t_seconds_bucket{route="/x",le="1.0"}'] == 3
+    assert samples['t_seconds_bucket{route="/x",le="+Inf"}'] == 4
+    assert samples['t_seconds_count{route="/x"}'] == 4
+    assert samples['t_seconds_sum{route="/x"}'] == 3.65
+
+
+def test_statement_kinds():
+    assert statement_kind("  select 1") == "SELECT"
+    assert statement_kind("INSERT INTO users VALUES (?)") == "INSERT"
+    assert statement_kind("VACUUM") == "OTHER"
+    assert statement_kind("") == "OTHER"
+
+
+def test_collectors_are_grouped_by_family(monkeypatch):
+    monkeypatch.setattr(metrics, "_collectors", dict(metrics._collectors))
+    for shard in ("a", "b"):
+        add_collector(("test", shard), lambda shard=shard: [
+            (f'test_shard_rows{{shard="{shard}"}}', "gauge", "Rows per shard", 1)])
+    text = render()
+    assert text.count("# TYPE test_shard_rows gauge") == 1
+    assert sample(text, 'test_shard_rows{shard="a"}') == sample(text, 'test_shard_rows{shard="b"}') == 1
+
+
+# ---------- HTTP ----------
+def test_flask_routes_by_template(app3):
+    client = app3.app.test_client()
+    name = 'http_requests_total{method="GET",route="/api/users/<int:user_id>",status="404"}'
+    before = sample(client.get("/metrics").get_data(as_text=True), name) or 0
+    client.get("/api/users/987654")
+    client.get("/api/users/987655")
+    r = client.get("/metrics")
+    assert r.content_type.startswith("text/plain; version=0.0.4")
+    text = r.get_data(as_text=True)
+    assert sample(text, name) == before + 2
+    assert 'db_pool_in_use{db="users.db"}' in text
+    assert sample(text, 'db_statement_duration_seconds_count{statement="SELECT"}') > 0
+
+
+def test_asgi_measures_streamed_bodies():
+    api = FastAPI()
+    instrument_asgi(api)
+
+    @api.get("/test/stream/{n}")
+    async def stream(n: int):
+        async def chunks():
+            for _ in range(n):
+                yield b"x" * 100
+        return StreamingResponse(chunks())
+
+    client = TestClient(api)
+    client.get("/test/stream/3")
+    text = client.get("/metrics").text
+    assert sample(text, 'http_requests_total{method="GET",route="/test/stream/{n}",status="200"}') == 1
+    assert sample(text, 'http_response_size_bytes_sum{route="/test/stream/{n}"}') == 300
+    assert sample(text, 'http_request_duration_seconds_count{method="GET",route="/test/stream/{n}"}') == 1
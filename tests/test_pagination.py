@@ -0,0 +1,83 @@
+import re
+
+import pytest
+
+from database import ConnectionPool, init_schema
+from pagination import MAX_LIMIT, Page, clamp_limit, fetch_page, page_headers
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = ConnectionPool(str(tmp_path / "users.db")).connection()
+    init_schema(conn)
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, 'x')",
+                     [(f"u{i}@example.com",) for i in range(1, 11)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def ids(page):
+    return [r[0] for r in page.rows]
+
+
+# ---------- KEYSET QUERY ----------
+def test_limits():
+    assert clamp_limit(None) == clamp_limit(0) == 100
+    assert clamp_limit(-5) == 1
+    assert clamp_limit(10 ** 6) == MAX_LIMIT
+
+
+def test_walk_forward_and_back(conn):
+    first = fetch_page(conn, 4)
+    assert (ids(first), first.next_after, first.prev_before) == ([1, 2, 3, 4], 4, None)
+    second = fetch_page(conn, 4, after=4)
+    assert (ids(second), second.next_after, second.prev_before) == ([5, 6, 7, 8], 8, 5)
+    last = fetch_page(conn, 4, after=8)
+    assert (ids(last), last.next_after, last.prev_before) == ([9, 10], None, 9)
+    back = fetch_page(conn, 4, before=9)
+    assert back == second
+    assert fetch_page(conn, 4, before=5) == Page(first.rows, 4, None)
+
+
+def test_descending(conn):
+    first = fetch_page(conn, 4, descending=True)
+    assert (ids(first), first.next_after) == ([10, 9, 8, 7], 7)
+    second = fetch_page(conn, 4, after=7, descending=True)
+    assert (ids(second), second.prev_before) == ([6, 5, 4, 3], 6)
+    assert fetch_page(conn, 4, before=6, descending=True) == Page(first.rows, 7, None)
+
+
+def test_filtered(conn):
+    page = fetch_page(conn, 2, where="id % 2 = ?", params=(0,))
+    assert (ids(page), page.next_after) == ([2, 4], 4)
+    assert ids(fetch_page(conn, 2, after=8, where="id % 2 = ?", params=(0,))) == [10]
+
+
+def test_past_the_end(conn):
+    assert fetch_page(conn, 4, after=10) == Page([], None, None)
+
+
+# ---------- LINKS ----------
+def test_links_keep_the_filters():
+    headers = page_headers("/api/users", {"search": "ex", "limit": "2", "after": "3"},
+                           Page([(4, "a"), (5, "b")], 5, 4))
+    assert headers["Link"] == ('</api/users?search=ex&limit=2&after=5>; rel="next", '
+                               '</api/users?search=ex&limit=2&before=4>; rel="prev"')
+    assert (headers["X-Next-Cursor"], headers["X-Prev-Cursor"]) == ("5", "4")
+    assert page_headers("/api/users", {}, Page([(1, "a")], None, None)) == {}
+
+
+# ---------- HTTP ----------
+def test_follow_next_links(app3):
+    client = app3.app.test_client()
+    for i in range(5):
+        client.post("/api/users", json={"email": f"page{i}@example.com", "password": "pw"})
+    url, seen = "/api/users?limit=2&search=page", []
+    while url:
+        r = client.get(url)
+        seen += [u["email"] for u in r.get_json()]
+        link = re.search(r'<([^>]+)>; rel="next"', r.headers.get("Link", ""))
+        url = link and link.group(1)
+    assert sorted(seen) == [f"page{i}@example.com" for i in range(5)]
+    assert len(seen) == 5
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from resultcache import ENTRY_OVERHEAD, ResultCache, request_key
+
+
+def renderer(body=b"[]"):
+    calls = []
+
+    def render():
+        calls.append(1)
+        return body, {"X-Total-Count": "0"}
+    return render, calls
+
+
+# ---------- CACHE ----------
+def test_request_key_ignores_parameter_order():
+    assert request_key("/api/users", [("search", "a"), ("limit", "5")]) == \
+        request_key("/api/users", [("limit", "5"), ("search", "a")])
+
+
+def test_hits_until_the_version_moves():
+    cache = ResultCache()
+    render, calls = renderer()
+    key = request_key("/api/users", [])
+    assert cache.get(key, 1, render) == (b"[]", {"X-Total-Count": "0"})
+    cache.get(key, 1, render)
+    assert len(calls) == 1
+    cache.get(key, 2, render)
+    assert len(calls) == 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["version"]) == (1, 2, 1, 2)
+
+
+def test_older_versions_are_not_kept():
+    cache = ResultCache()
+    key = request_key("/api/users", [])
+    cache.get(key, 5, renderer()[0])
+    render, calls = renderer()
+    cache.get(key, 4, render)   # a request that read the version before a write
+    cache.get(key, 4, render)
+    assert len(calls) == 2 and cache.stats()["entries"] == 1
+
+
+def test_lru_eviction_by_size():
+    body = b"x" * 100
+    cache = ResultCache(max_bytes=2 * (100 + len("X-Total-Count") + 1 + ENTRY_OVERHEAD))
+    for q in ("a", "b", "a", "c"):   # "a" is used again, so "b" goes
+        cache.get(request_key("/", [("q", q)]), 1, renderer(body)[0])
+    render, calls = renderer(body)
+    cache.get(request_key("/", [("q", "a")]), 1, render)
+    cache.get(request_key("/", [("q", "b")]), 1, render)
+    assert len(calls) == 1
+    assert cache.stats()["evictions"] == 2
+
+
+def test_turned_off():
+    cache = ResultCache(max_bytes=0)
+    render, calls = renderer()
+    cache.get(("/",), 1, render)
+    cache.get(("/",), 1, render)
+    assert len(calls) == 2
+
+
+# ---------- SINGLE-FLIGHT ----------
+def test_concurrent_misses_run_once():
+    cache = ResultCache()
+    release = threading.Event()
+    calls = []
+
+    def render():
+        calls.append(1)
+        release.wait(5)
+        return b"[1]", {}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(("/",), 1, render)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + 5
+    while cache.stats()["coalesced"] < 7 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert results == [(b"[1]", {})] * 8
+    assert cache.stats()["in_flight"] == 0
+
+
+def test_followers_share_the_leaders_error():
+    cache = ResultCache()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            cache.get(("/",), 1, fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    while cache.stats()["coalesced"] < 1:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 2
+    # nothing is cached for a failure: the next request tries again
+    render, calls = renderer()
+    cache.get(("/",), 1, render)
+    assert len(calls) == 1
+
+
+def test_async_misses_run_once():
+    cache = ResultCache()
+    calls = []
+
+    async def render():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return b"[2]", {}
+
+    async def main():
+        return await asyncio.gather(*(cache.aget(("/",), 1, render) for _ in range(5)))
+
+    assert asyncio.run(main()) == [(b"[2]", {})] * 5
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+# ---------- HTTP ----------
+@pytest.mark.parametrize("url", ["/api/users?limit=3", "/api/users?search=example&limit=3"])
+def test_listing_is_served_from_the_cache(app3, url):
+    client = app3.app.test_client()
+    first = client.get(url)
+    hits = app3.results.stats()["hits"]
+    again = client.get(url)
+    assert again.get_data() == first.get_data()
+    assert again.headers.get("Link") == first.headers.get("Link")
+    assert app3.results.stats()["hits"] == hits + 1
+    client.post("/api/users", json={"email": f"cached{time.monotonic_ns()}@example.com", "password": "pw"})
+    client.get(url)
+    assert app3.results.stats()["hits"] == hits + 1   # a new version is a miss
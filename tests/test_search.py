@@ -0,0 +1,72 @@
+import pytest
+
+from database import ConnectionPool, init_schema
+from search import has_search_index, ranked_search, search_clause, search_users
+
+EMAILS = ["alice@example.com", "bob@example.org", "carol_1@test.io", "dave%x@example.com",
+          'eve"q@example.com', "alicia@sample.net", "Mallory@Example.com", "zed@ex.io"]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = ConnectionPool(str(tmp_path / "users.db")).connection()
+    init_schema(conn)
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, 'x')", [(e,) for e in EMAILS])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def emails(page):
+    return [r[1] for r in page.rows]
+
+
+def scan(conn, q, prefix=False):
+    # what the old full scan would answer
+    rows = conn.execute("SELECT email FROM users ORDER BY id").fetchall()
+    return [e for (e,) in rows if (e.lower().startswith(q.lower()) if prefix else q.lower() in e.lower())]
+
+
+@pytest.mark.parametrize("q", ["ali", "EXAMPLE", "example.com", "_1@", "%x", 'e"q', "a", "io", "zzz"])
+@pytest.mark.parametrize("prefix", [False, True])
+def test_same_answers_as_a_scan(conn, q, prefix):
+    assert emails(search_users(conn, q, 100, prefix=prefix)) == scan(conn, q, prefix)
+
+
+def test_long_queries_use_the_index(conn):
+    clause = search_clause(conn, "example")
+    assert "users_fts" in clause["table"]
+    plan = " ".join(str(r) for r in conn.execute(
+        f"EXPLAIN QUERY PLAN SELECT {clause['columns']} FROM {clause['table']} "
+        f"WHERE {clause['where']}", clause["params"]))
+    assert "users_fts" in plan and "SCAN users " not in plan
+    # two characters cannot make a trigram
+    assert "users_fts" not in search_clause(conn, "ex").get("table", "")
+
+
+def test_index_follows_writes(conn):
+    conn.execute("UPDATE users SET email = 'renamed@other.net' WHERE email = 'alice@example.com'")
+    conn.execute("DELETE FROM users WHERE email = 'alicia@sample.net'")
+    conn.commit()
+    assert emails(search_users(conn, "ali", 100)) == []
+    assert emails(search_users(conn, "renamed", 100)) == ["renamed@other.net"]
+
+
+def test_search_pages(conn):
+    first = search_users(conn, "example", 2)
+    assert emails(first) == ["alice@example.com", "bob@example.org"]
+    rest = search_users(conn, "example", 2, after=first.next_after)
+    assert emails(rest) == ["dave%x@example.com", 'eve"q@example.com']
+
+
+def test_ranked_search(conn):
+    page = ranked_search(conn, "example.com", 10)
+    assert sorted(emails(page)) == sorted(scan(conn, "example.com"))
+    assert page.next_after is None
+
+
+def test_without_the_index(conn):
+    conn.execute("DROP TABLE users_fts")
+    conn.commit()
+    assert not has_search_index(conn)
+    assert emails(search_users(conn, "example", 100)) == scan(conn, "example")
@@ -0,0 +1,118 @@
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from serve import APPS, ASGI_APPS, Server, options
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def args(app, **kw):
+    return argparse.Namespace(**dict(dict(app=app, bind="127.0.0.1:0", workers=2, threads=8,
+                                          timeout=30, log_level="warning"), **kw))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ---------- CONFIG ----------
+def test_flask_apps_get_threads():
+    opts = options(args("app3"))
+    assert (opts["worker_class"], opts["threads"], opts["workers"]) == ("gthread", 8, 2)
+    assert opts["preload_app"] and opts["accesslog"] is None
+
+
+def test_asgi_apps_get_one_loop_per_worker():
+    for name in ASGI_APPS:
+        opts = options(args(name))
+        assert opts["worker_class"].endswith("UvicornWorker") and opts["threads"] == 1
+
+
+def test_every_app_names_a_module_in_the_repo():
+    for target in APPS.values():
+        module, obj = target.split(":")
+        assert os.path.exists(os.path.join(ROOT, module + ".py")) and obj
+
+
+def test_load_returns_the_app_object(app3):
+    assert Server("app3", {"bind": "127.0.0.1:0"}).load() is app3.app
+
+
+# ---------- LIVE ----------
+@pytest.fixture
+def served(tmp_path):
+    port = free_port()
+    # short keepalives, so a stream notices its client is gone (and the
+    # worker can stop) right after the test closes it
+    env = dict(os.environ, ACCESS_LOG="", EVENT_KEEPALIVE="0.2")
+    env.pop("SSE_MAX_STREAMS", None)
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "serve.py"), "app3", "--bind", f"127.0.0.1:{port}",
+                             "--workers", "1", "--threads", "2", "--log-level", "warning"],
+                            cwd=tmp_path, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/api/users")
+            conn.getresponse().read()
+            conn.close()
+            break
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                pytest.fail(proc.stderr.read().decode())
+            time.sleep(0.1)
+    yield port, tmp_path
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def request(port, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request(method, path, body=json.dumps(body) if body else None,
+                     headers={"Content-Type": "application/json"})
+        r = conn.getresponse()
+        return r.status, r.read()
+    finally:
+        conn.close()
+
+
+def test_serves_app3(served):
+    port, cwd = served
+    assert request(port, "POST", "/api/users", {"email": "served@example.com", "password": "pw"})[0] == 200
+    status, body = request(port, "GET", "/api/users?search=served")
+    assert status == 200 and [u["email"] for u in json.loads(body)] == ["served@example.com"]
+    assert (cwd / "users.db").exists()
+
+
+def test_event_streams_take_half_the_threads(served):
+    # --threads 2: one stream, and the other thread stays free for the API
+    port, _ = served
+    stream = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    stream.request("GET", "/api/users/events")
+    try:
+        assert stream.getresponse().status == 200
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.request("GET", "/api/users/events")
+        busy = conn.getresponse()
+        assert busy.status == 503 and busy.getheader("Retry-After")
+        conn.close()
+        assert request(port, "GET", "/api/users")[0] == 200
+    finally:
+        stream.close()
@@ -0,0 +1,127 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from database import ConnectionPool, init_schema
+from pagination import Page, fetch_page
+from shards import MAX_SHARDS, ShardedStore, merge_pages
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ---------- MERGE ----------
+def test_merge_orders_across_pages():
+    pages = [Page([(3, "c"), (9, "i")], None, None),
+             Page([(1, "a"), (4, "d"), (7, "g")], None, None),
+             Page([], None, None)]
+    merged = merge_pages(pages, 10)
+    assert [r[0] for r in merged.rows] == [1, 3, 4, 7, 9]
+    assert merged.next_after is None and merged.prev_before is None
+
+
+def test_merge_truncates_and_points_past_the_page():
+    pages = [Page([(2, "b"), (5, "e")], None, None),
+             Page([(1, "a"), (3, "c")], None, None)]
+    merged = merge_pages(pages, 3)
+    assert [r[0] for r in merged.rows] == [1, 2, 3]
+    assert merged.next_after == 3
+
+
+def test_merge_keeps_a_shards_more():
+    # every row fits, but one shard still has rows past its page
+    pages = [Page([(2, "b")], 2, None), Page([(1, "a")], None, None)]
+    assert merge_pages(pages, 5).next_after == 2
+
+
+def test_merge_backward_keeps_rows_nearest_the_cursor():
+    pages = [Page([(4, "d"), (8, "h")], 8, None),
+             Page([(6, "f"), (9, "i")], 9, 6)]
+    merged = merge_pages(pages, 3, before=10)
+    assert [r[0] for r in merged.rows] == [6, 8, 9]
+    assert merged.next_after == 9
+    assert merged.prev_before == 6
+
+
+def test_merge_descending():
+    pages = [Page([(9, "i"), (4, "d")], None, None),
+             Page([(7, "g"), (1, "a")], 1, None)]
+    merged = merge_pages(pages, 3, descending=True)
+    assert [r[0] for r in merged.rows] == [9, 7, 4]
+    assert merged.next_after == 4
+
+
+# ---------- STORE ----------
+@pytest.fixture
+def stores(tmp_path):
+    # 3 shards, and one file holding the same rows to compare pages against
+    store = ShardedStore(str(tmp_path / "users.db"), 3)
+    for i in range(40):
+        store.create(f"user{i}@example.com", "x")
+    rows = sorted(row for shard in range(3) for row in store._read(shard, _all))
+
+    single = ConnectionPool(str(tmp_path / "single.db")).connection()
+    init_schema(single)
+    single.executemany("INSERT INTO users (id, email, password) VALUES (?, ?, 'x')", rows)
+    single.commit()
+    yield store, single, rows
+    single.close()
+
+
+def _all(conn):
+    return conn.execute("SELECT id, email FROM users").fetchall()
+
+
+def test_rows_spread_over_shards(stores):
+    store, _, rows = stores
+    assert len(rows) == 40
+    assert len({uid % MAX_SHARDS for uid, _ in rows}) == 3
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_pages_match_one_file(stores, descending):
+    store, single, rows = stores
+    seen = []
+    after = None
+    while True:
+        page = store.page(7, after=after, descending=descending)
+        assert page == fetch_page(single, 7, after=after, descending=descending)
+        seen += page.rows
+        if page.next_after is None:
+            break
+        after = page.next_after
+    assert seen == sorted(rows, reverse=descending)
+
+    # and back again from the last page
+    last = page.rows
+    back = []
+    before = page.prev_before
+    while before is not None:
+        page = store.page(7, before=before, descending=descending)
+        assert page == fetch_page(single, 7, before=before, descending=descending)
+        back = page.rows + back
+        before = page.prev_before
+    assert back + last == seen
+
+
+def test_suggest_ignores_case(tmp_path):
+    # rows written before emails were lowercased on the way in
+    store = ShardedStore(str(tmp_path / "users.db"), 3)
+    for email in ["Bob@example.com", "alice@example.com", "ALINA@example.com", "al@Example.com"]:
+        store.create(email, "x")
+    assert [s["email"] for s in store.suggest("AL")] == \
+        ["al@Example.com", "alice@example.com", "ALINA@example.com"]
+    assert [s["email"] for s in store.suggest("bob@")] == ["Bob@example.com"]
+
+
+# ---------- APPS ----------
+def test_sharded_app_leaves_the_single_file_alone(tmp_path):
+    env = dict(os.environ, SHARDS="3", HASH_WORKERS="0", ACCESS_LOG="")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    script = ("import app3; c = app3.app.test_client(); "
+              "assert c.post('/api/users', json={'email': 'A@example.com', 'password': 'pw'}).status_code == 200; "
+              "assert [u['email'] for u in c.get('/api/users').get_json()] == ['a@example.com']")
+    subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=env, check=True, timeout=60)
+    assert not (tmp_path / "users.db").exists()
+    assert (tmp_path / "users.000.db").exists()
@@ -0,0 +1,85 @@
+import json
+import logging
+
+import pytest
+
+import slowlog
+from database import ConnectionPool, init_schema
+
+
+@pytest.fixture
+def log(tmp_path, monkeypatch):
+    # every statement counts as slow, into a file of this test's own
+    path = tmp_path / "slow.jsonl"
+    handler = logging.FileHandler(path)
+    logger = logging.getLogger(f"slow_queries.{tmp_path.name}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(handler)
+    monkeypatch.setattr(slowlog, "_logger", logger)
+    monkeypatch.setattr(slowlog, "SLOW_QUERY_MS", 1e-9)
+    yield path
+    logger.removeHandler(handler)
+    handler.close()
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = ConnectionPool(str(tmp_path / "users.db")).connection()
+    init_schema(conn)
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, 'x')",
+                     [(f"u{i}@example.com",) for i in range(30)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_normalize():
+    assert slowlog.normalize_sql("SELECT *  FROM users\n WHERE id = 42 AND email = 'a''b'") == \
+        "SELECT * FROM users WHERE id = ? AND email = ?"
+    assert slowlog.normalize_sql("DELETE FROM users WHERE id IN (?, ?,?)") == \
+        slowlog.normalize_sql("DELETE FROM users WHERE id IN (?,?)") == \
+        "DELETE FROM users WHERE id IN (?, ...)"
+
+
+def test_query_is_followed_through_its_fetches(conn, log):
+    cur = conn.cursor()
+    cur.execute("SELECT id, email FROM users WHERE id > ? ORDER BY id", (5,))
+    while cur.fetchmany(10):
+        pass
+    rec = [r for r in records(log) if r["sql"].startswith("SELECT id, email")][-1]
+    assert rec["rows"] == 25
+    assert rec["db"] == "users.db"
+    assert any("users" in step for step in rec["plan"])
+
+
+def test_writes_name_their_triggers(conn, log):
+    conn.execute("DELETE FROM users WHERE id = ?", (3,))
+    conn.commit()
+    rec = [r for r in records(log) if r["sql"].startswith("DELETE FROM users")][-1]
+    assert rec["rows"] == 1
+    assert "users_count_ad" in rec["triggers"]
+    assert "users_count_ai" not in rec["triggers"]
+
+
+def test_fast_queries_are_not_logged(conn, log, monkeypatch):
+    monkeypatch.setattr(slowlog, "SLOW_QUERY_MS", 60_000)
+    before = len(records(log))
+    conn.execute("SELECT COUNT(*) FROM users").fetchall()
+    assert len(records(log)) == before
+
+
+def test_summary_groups_by_statement(tmp_path):
+    path = tmp_path / "slow.jsonl"
+    lines = [{"sql": "SELECT ?", "ms": 150.0}, {"sql": "DELETE FROM users", "ms": 120.0, "plan": ["p"]},
+             {"sql": "SELECT ?", "ms": 300.0}]
+    path.write_text("\n".join(json.dumps(rec) for rec in lines) + "\nnot json\n")
+    (tmp_path / "slow.jsonl.1").write_text(json.dumps({"sql": "DELETE FROM users", "ms": 10.0}) + "\n")
+    summary = slowlog.summarize(str(path))
+    assert [(g["sql"], g["count"], g["total_ms"], g["max_ms"]) for g in summary] == [
+        ("SELECT ?", 2, 450.0, 300.0), ("DELETE FROM users", 2, 130.0, 120.0)]
+    assert summary[1]["plan"] == ["p"]   # the newest one
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from database import ConnectionPool, init_schema
+from streaming import NDJSON, stream_users, wants_stream
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "users.db"), size=1, timeout=0.2)
+    conn = pool.connection()
+    init_schema(conn)
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, 'x')",
+                     [(f"u{i}@example.com",) for i in range(25)])
+    conn.commit()
+    conn.close()
+    return pool
+
+
+def ids(chunks):
+    return [json.loads(line)["id"] for chunk in chunks for line in chunk.splitlines()]
+
+
+def test_batches_hold_no_connection(pool):
+    stream = stream_users(pool, batch=10)
+    first = next(stream)
+    # a slow client between batches leaves the pool free for everyone else
+    assert pool.stats()["in_use"] == 0
+    conn = pool.connection()
+    conn.close()
+    assert ids([first] + list(stream)) == list(range(1, 26))
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_cursor_and_order(pool, descending):
+    expected = [i for i in sorted(range(1, 26), reverse=descending) if (i < 20 if descending else i > 5)]
+    assert ids(stream_users(pool, after=20 if descending else 5, descending=descending, batch=4)) == expected
+
+
+def test_filtered(pool):
+    chunks = stream_users(pool, where="email LIKE ?", params=("u1%",), batch=3)
+    assert ids(chunks) == [2] + list(range(11, 21))
+
+
+@pytest.mark.parametrize("accept, arg, expected", [
+    (NDJSON, None, True), ("application/json, application/x-ndjson;q=0.9", None, True),
+    ("application/json", None, False), (None, "1", True), (None, "TRUE", True),
+    (None, "0", False), (None, None, False),
+])
+def test_wants_stream(accept, arg, expected):
+    assert wants_stream(accept, arg) is expected
+
+
+def test_listing_streams_on_request(app3):
+    client = app3.app.test_client()
+    for i in range(3):
+        client.post("/api/users", json={"email": f"ndjson{i}@example.com", "password": "pw"})
+    r = client.get("/api/users?search=ndjson", headers={"Accept": NDJSON})
+    assert r.mimetype == NDJSON
+    assert r.headers["ETag"]
+    rows = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert [u["email"] for u in rows] == [f"ndjson{i}@example.com" for i in range(3)]
+    # or asked for in the query string
+    assert client.get("/api/users?search=ndjson&stream=1").get_data() == r.get_data()
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from database import ConnectionPool, init_schema
+from events import EventHub
+from suggest import SuggestIndex
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "users.db"))
+    conn = pool.connection()
+    init_schema(conn)
+    conn.executemany("INSERT INTO users (email, password) VALUES (?, 'x')",
+                     [(e,) for e in ["bob@example.com", "Alice@example.com", "al@example.com",
+                                     "alan@example.com", "carol@example.com"]])
+    conn.commit()
+    conn.close()
+    return pool
+
+
+def write(pool, sql, *params):
+    conn = pool.connection()
+    try:
+        conn.execute(sql, params)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def emails(results):
+    return [r["email"] for r in results]
+
+
+def test_prefix_lookup(pool):
+    index = SuggestIndex(pool, EventHub(pool))
+    index.load()
+    assert emails(index.suggest("AL")) == ["al@example.com", "alan@example.com", "Alice@example.com"]
+    assert emails(index.suggest("al", limit=2)) == ["al@example.com", "alan@example.com"]
+    assert index.suggest("zz") == []
+    assert len(index.suggest("")) == 5
+    assert index.stats()["entries"] == 5
+
+
+def test_apply_keeps_the_order(pool):
+    index = SuggestIndex(pool, EventHub(pool))
+    index.load()
+    index.apply({"seq": 100, "op": "insert", "id": 9, "email": "Alba@example.com"})
+    index.apply({"seq": 101, "op": "update", "id": 1, "email": "alf@example.com"})   # was bob
+    index.apply({"seq": 102, "op": "delete", "id": 4, "email": None})                # alan
+    assert emails(index.suggest("al")) == ["al@example.com", "Alba@example.com",
+                                           "alf@example.com", "Alice@example.com"]
+    assert index.suggest("bob") == []
+    assert index.seq == 102
+
+
+def test_follows_writes(pool):
+    index = SuggestIndex(pool, EventHub(pool, interval=0.02)).start()
+    write(pool, "INSERT INTO users (email, password) VALUES ('alma@example.com', 'x')")
+    write(pool, "DELETE FROM users WHERE email = 'al@example.com'")
+    index.hub.notify()
+    deadline = time.monotonic() + 5
+    while index.seq < 7 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert emails(index.suggest("al")) == ["alan@example.com", "Alice@example.com", "alma@example.com"]
+
+
+def test_endpoint(app3):
+    client = app3.app.test_client()
+    client.post("/api/users", json={"email": "Suggest.Me@example.com", "password": "pw"})
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        found = client.get("/api/users/suggest?prefix=SUGGEST.").get_json()
+        if found:
+            break
+        time.sleep(0.01)
+    assert emails(found) == ["suggest.me@example.com"]
+    assert client.get("/api/users/suggest/stats").get_json()["entries"] >= 1
@@ -0,0 +1,110 @@
+import sqlite3
+
+import pytest
+
+from database import ConnectionPool
+from writer import GroupCommitWriter, WriteQueueFull
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "writer.db"))
+    conn = pool.connection()
+    conn.execute("CREATE TABLE t (k TEXT UNIQUE)")
+    conn.commit()
+    conn.close()
+    return pool
+
+
+def keys(pool):
+    conn = pool.connection()
+    try:
+        return sorted(k for (k,) in conn.execute("SELECT k FROM t"))
+    finally:
+        conn.close()
+
+
+def insert(conn, k):
+    return conn.execute("INSERT INTO t (k) VALUES (?)", (k,)).rowcount
+
+
+def insert_then_fail(conn, k):
+    conn.execute("INSERT INTO t (k) VALUES (?)", (k,))
+    raise RuntimeError("op failed after writing")
+
+
+# ---------- GROUP COMMIT ----------
+def test_failed_op_rolls_back_alone(pool):
+    writer = GroupCommitWriter(pool)
+    # queued before the thread starts, so they all land in one batch
+    futures = [writer.submit(insert, "a"),
+               writer.submit(insert, "a"),
+               writer.submit(insert_then_fail, "c"),
+               writer.submit(insert, "b")]
+    writer.start()
+
+    assert futures[0].result(5) == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        futures[1].result(5)
+    with pytest.raises(RuntimeError):
+        futures[2].result(5)
+    assert futures[3].result(5) == 1
+    # "c" was written inside its SAVEPOINT and rolled back with it
+    assert keys(pool) == ["a", "b"]
+    stats = writer.stats()
+    assert stats["batches"] == 1
+    assert stats["ops"] == 4
+    assert stats["failed"] == 0
+
+
+def test_execute_returns_rowcount(pool):
+    writer = GroupCommitWriter(pool).start()
+    assert writer.execute("INSERT INTO t (k) VALUES (?)", ("x",)) == 1
+    assert writer.execute("DELETE FROM t WHERE k = ?", ("nope",)) == 0
+    assert keys(pool) == ["x"]
+
+
+def test_cancelled_op_is_skipped(pool):
+    writer = GroupCommitWriter(pool)
+    skipped = writer.submit(insert, "a")
+    kept = writer.submit(insert, "b")
+    assert skipped.cancel()
+    writer.start()
+    assert kept.result(5) == 1
+    assert keys(pool) == ["b"]
+
+
+# ---------- BACKPRESSURE ----------
+def test_full_queue_rejects(pool):
+    writer = GroupCommitWriter(pool, maxsize=1)
+    writer.submit(insert, "a")
+    with pytest.raises(WriteQueueFull):
+        writer.submit(insert, "b")
+    assert writer.stats()["rejected"] == 1
+
+
+def test_full_queue_is_503(app3, monkeypatch):
+    full = GroupCommitWriter(app3.store.pool, maxsize=1)
+    full.submit(insert, "queued")
+    monkeypatch.setattr(app3.store, "writes", full)
+
+    client = app3.app.test_client()
+    r = client.post("/api/users", json={"email": "busy@example.com", "password": "pw"})
+    assert r.status_code == 503
+    assert r.get_json() == {"error": "Server busy, try again"}
+    assert app3.store.find_email("busy@example.com") is None
+
+
+def test_writes_do_not_wait_for_the_pool(tmp_path):
+    # readers holding every pooled connection must not hold up a write
+    pool = ConnectionPool(str(tmp_path / "busy.db"), size=1, timeout=0.2)
+    conn = pool.connection()
+    conn.execute("CREATE TABLE t (k TEXT UNIQUE)")
+    conn.commit()
+    writer = GroupCommitWriter(pool).start()
+    try:
+        assert writer.submit(insert, "a").result(5) == 1
+    finally:
+        conn.close()
+    assert keys(pool) == ["a"]
+    assert pool.stats()["timeouts"] == 0
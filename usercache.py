@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from changes import CHANGES_LIMIT, changes_since, current_seq
+from metrics import CACHE_LOOKUPS, add_collector
+
+# ---------- SETTINGS ----------
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))     # rows; 0 turns it off
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "300"))
+# how stale another process's writes may be seen; 0 checks on every lookup
+USER_CACHE_CHECK = float(os.environ.get("USER_CACHE_CHECK", "0.5"))
+
+
+# ---------- CACHE ----------
+class UserCache:
+    # (id, email) rows by id, with an email -> id map over the same rows, in
+    # one LRU with a TTL. Handlers in this process invalidate on write; writes
+    # from other processes are picked up from the user_changes log, read at
+    # most every USER_CACHE_CHECK seconds, so only the ids that changed drop
+    # out. Only rows that exist are cached, so a miss always asks SQLite.
+
+    def __init__(self, pool, size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, check=USER_CACHE_CHECK):
+        self.pool = pool
+        self.size = size
+        self.ttl = ttl
+        self.check = check
+        self.seq = None
+        self._rows = OrderedDict()    # id -> (id, email, expires)
+        self._by_email = {}           # email -> id
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._checked = 0.0
+        self._generation = 0          # bumped on every invalidation
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "resets": 0}
+
+    # -- lookups --
+    def get(self, user_id):
+        # -> (id, email), or None when there is no such user
+        row = self._cached(user_id, "id")
+        if row is not False:
+            return row
+        return self._load("SELECT id, email FROM users WHERE id = ?", user_id)
+
+    def id_for_email(self, email):
+        # -> id of the user with exactly this stored email, or None
+        row = self._cached(email, "email")
+        if row is not False:
+            return row[0]
+        row = self._load("SELECT id, email FROM users WHERE email = ?", email)
+        return row[0] if row else None
+
+    def _cached(self, key, kind):
+        # -> the cached row, or False on a miss
+        if self.size <= 0:
+            return False
+        self._sync()
+        now = time.monotonic()
+        with self._lock:
+            uid = self._by_email.get(key) if kind == "email" else key
+            entry = self._rows.get(uid) if uid is not None else None
+            if entry is not None and entry[2] > now:
+                self._rows.move_to_end(uid)
+                self._stats["hits"] += 1
+                CACHE_LOOKUPS.inc("user_" + kind, "hit")
+                return entry[:2]
+            self._stats["misses"] += 1
+        CACHE_LOOKUPS.inc("user_" + kind, "miss")
+        return False
+
+    def _load(self, sql, key):
+        generation = self._generation
+        conn = self.pool.connection()
+        try:
+            row = conn.execute(sql, (key,)).fetchone()
+        finally:
+            conn.close()
+        if row is not None:
+            self._put(row[0], row[1], generation)
+        return row
+
+    def _put(self, uid, email, generation):
+        with self._lock:
+            # something was invalidated while we read: the row may be older
+            if generation != self._generation or self.size <= 0:
+                return
+            self._drop(uid)
+            self._rows[uid] = (uid, email, time.monotonic() + self.ttl)
+            self._by_email[email] = uid
+            while len(self._rows) > self.size:
+                _, (old, old_email, _) = self._rows.popitem(last=False)
+                if self._by_email.get(old_email) == old:
+                    del self._by_email[old_email]
+
+    def _drop(self, uid):
+        entry = self._rows.pop(uid, None)
+        if entry is not None and self._by_email.get(entry[1]) == uid:
+            del self._by_email[entry[1]]
+
+    # -- invalidation --
+    def invalidate(self):
+        # after a write in this process: the next lookup reads the change log
+        # first, and rows being loaded right now are not kept
+        with self._lock:
+            self._generation += 1
+            self._stats["invalidations"] += 1
+            self._checked = 0.0
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._stats["resets"] += 1
+            self._rows.clear()
+            self._by_email.clear()
+
+    def _sync(self):
+        if time.monotonic() - self._checked < self.check:
+            return
+        # one reader at a time; whoever waited re-checks, since the read that
+        # just finished may already cover it
+        with self._sync_lock:
+            now = time.monotonic()
+            if now - self._checked < self.check:
+                return
+            self._checked = now
+            self._read_changes()
+
+    def _read_changes(self):
+        conn = self.pool.connection()
+        try:
+            latest = current_seq(conn)
+            if latest == self.seq:
+                return
+            feed = None if self.seq is None else changes_since(conn, self.seq, CHANGES_LIMIT)
+        finally:
+            conn.close()
+        if feed is None or feed["reset"] or feed["more"]:
+            # first check, or too far behind to replay: start over
+            self.clear()
+            self.seq = latest
+            return
+        with self._lock:
+            self._generation += 1
+            for change in feed["changes"]:
+                self._drop(change["id"])
+                if change["email"] in self._by_email:
+                    self._drop(self._by_email[change["email"]])
+            self.seq = feed["next"]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._rows), seq=self.seq)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_user_cache(pool):
+    with _caches_lock:
+        cache = _caches.get(pool.path)
+        if cache is None:
+            cache = _caches[pool.path] = UserCache(pool)
+            add_collector(("user_cache", pool.path), user_cache_collector(cache))
+        return cache
+
+
+def user_cache_collector(cache):
+    def collect():
+        stats = cache.stats()
+        yield "user_cache_entries", "gauge", "Rows in the user entity cache", stats["entries"]
+        yield "user_cache_invalidations_total", "counter", "Write-through invalidations", stats["invalidations"]
+    return collect
@@ -0,0 +1,208 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import WRITE_BATCH, add_collector
+
+# ---------- SETTINGS ----------
+WRITE_BATCH_MAX = int(os.environ.get("WRITE_BATCH_MAX", "256"))          # ops per transaction
+WRITE_BATCH_DELAY = float(os.environ.get("WRITE_BATCH_DELAY_MS", "2")) / 1000   # wait for company
+WRITE_QUEUE_SIZE = int(os.environ.get("WRITE_QUEUE_SIZE", "10000"))
+
+
+class WriteQueueFull(Exception):
+    pass
+
+
+# ---------- OPS ----------
+def execute(conn, sql, params=()):
+    # the common op: one statement -> its rowcount
+    return conn.execute(sql, params).rowcount
+
+
+# ---------- WRITER ----------
+class GroupCommitWriter:
+    # Group commit: request threads and coroutines put mutations on a queue
+    # and wait on a Future; one writer thread takes up to WRITE_BATCH_MAX of
+    # them (waiting WRITE_BATCH_DELAY for more after the first) and runs them
+    # all in a single BEGIN IMMEDIATE ... COMMIT. Each op runs inside its own
+    # SAVEPOINT, so a constraint failure rolls back only that op and its
+    # Future gets the IntegrityError while the rest of the batch commits.
+    #
+    # Ops are fn(conn, *args) and must not commit. Only this thread writes
+    # through it, so writers no longer queue on SQLite's lock or pay one
+    # fsync each.
+
+    def __init__(self, pool, batch=WRITE_BATCH_MAX, delay=WRITE_BATCH_DELAY,
+                 maxsize=WRITE_QUEUE_SIZE):
+        self.pool = pool
+        self.batch = batch
+        self.delay = delay
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._stats = {"ops": 0, "batches": 0, "failed": 0, "rejected": 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, fn, *args):
+        # -> Future of fn's return value (or its exception)
+        future = Future()
+        try:
+            self._queue.put_nowait((fn, args, future))
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise WriteQueueFull("write queue is full")
+        return future
+
+    def execute(self, sql, params=()):
+        # blocking: -> rowcount once the batch holding it has committed
+        return self.submit(execute, sql, params).result()
+
+    async def aexecute(self, sql, params=()):
+        return await asyncio.wrap_future(self.submit(execute, sql, params))
+
+    async def asubmit(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _collect(self):
+        ops = [self._queue.get()]
+        deadline = time.monotonic() + self.delay
+        while len(ops) < self.batch:
+            try:
+                ops.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                ops.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return ops
+
+    def _run(self):
+        # The writer keeps a connection of its own rather than taking a pool
+        # slot per batch, so readers holding every pooled connection can
+        # never hold up (or time out) a write.
+        while True:
+            ops = self._collect()
+            if self._conn is None:
+                try:
+                    self._conn = self.pool.dedicated()
+                except Exception as e:
+                    for _, _, future in ops:
+                        # skips ones the caller cancelled meanwhile; setting
+                        # those would raise and kill the writer thread
+                        if future.set_running_or_notify_cancel():
+                            future.set_exception(e)
+                    continue
+            if not self._commit(self._conn, ops):
+                # start the next batch on a fresh connection
+                self._conn.close()
+                self._conn = None
+
+    def _commit(self, conn, ops):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in ops:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT op")
+                try:
+                    value = fn(conn, *args)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    results.append((future, None, e))
+                else:
+                    conn.execute("RELEASE op")
+                    results.append((future, value, None))
+            conn.commit()
+        except Exception as e:
+            # BEGIN or COMMIT failed (locked past the busy timeout, disk
+            # full...): nothing in this batch was written
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            for _, _, future in ops:
+                if not future.done():
+                    future.set_exception(e)
+            with self._lock:
+                self._stats["failed"] += len(ops)
+            return False
+        WRITE_BATCH.observe(len(ops))
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["ops"] += len(ops)
+        # resolved only after COMMIT, so a caller never sees its write
+        # succeed and then disappear
+        for future, value, error in results:
+            if error is None:
+                future.set_result(value)
+            else:
+                future.set_exception(error)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, queue_depth=self._queue.qsize())
+
+    def _after_fork(self):
+        # the writer thread and its connection stay with the parent; this
+        # process gets its own (the parent's is kept, never closed from here)
+        if self._conn is not None:
+            _inherited.append(self._conn)
+            self._conn = None
+        self._queue = queue.Queue(self._queue.maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.start()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+_inherited = []
+
+def get_writer(pool):
+    with _writers_lock:
+        writer = _writers.get(pool.path)
+        if writer is None:
+            writer = _writers[pool.path] = GroupCommitWriter(pool).start()
+            add_collector(("writer", pool.path), writer_collector(writer))
+        return writer
+
+
+def _after_fork():
+    global _writers_lock
+    _writers_lock = threading.Lock()
+    for writer in _writers.values():
+        writer._after_fork()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def writer_collector(writer):
+    db = f'{{db="{os.path.basename(writer.pool.path)}"}}'
+
+    def collect():
+        stats = writer.stats()
+        yield "db_write_queue_depth" + db, "gauge", "Mutations waiting for the group-commit writer", stats["queue_depth"]
+        yield "db_write_batches_total" + db, "counter", "Group-commit transactions committed", stats["batches"]
+        yield "db_write_failed_total" + db, "counter", "Mutations lost to a failed BEGIN/COMMIT", stats["failed"]
+    return collect